@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+import shutil
+import logging
+import resource
+import subprocess
+import tempfile
+from datetime import datetime
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_DIR = os.path.dirname(BENCHMARK_DIR)
+SCRIPTS_DIR = os.path.join(PIPELINE_DIR, 'scripts')
+CONFIG_DIR = os.path.join(PIPELINE_DIR, 'configs')
+
+# Stage cases run in this order on the same work directory, each one in a fresh
+# process, so every stage reads what the previous one wrote
+STAGE_CASES = ['ingestion', 'validation', 'transformation', 'analytics']
+CASES = STAGE_CASES + ['end_to_end']
+
+# Metrics compared against the baseline (higher is worse)
+COMPARED_METRICS = ['wall_seconds', 'cpu_seconds', 'peak_rss_bytes']
+
+# Records per source used to measure the in-memory size of a dataset
+MEMORY_SAMPLE_ROWS = 100_000
+
+# Stage scripts whose cold start is measured, and the import time each may take
+STAGE_SCRIPTS = {
+    'ingestion': 'data-ingestion.py',
+    'validation': 'data-validation.py',
+    'transformation': 'data-transformation.py',
+    'analytics': 'analytics-processor.py'
+}
+IMPORT_BUDGET_MS = {'ingestion': 50, 'validation': 50, 'transformation': 50, 'analytics': 50}
+
+# Dependencies that must only be imported by the code paths that use them
+HEAVY_MODULES = ['pandas', 'numpy', 'jsonschema', 'requests']
+
+def parse_scale(value):
+    """Turn 10k / 1m / 10m into a row count"""
+    value = value.strip().lower()
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(value[-1], 1)
+    return int(float(value.rstrip('km')) * multiplier)
+
+def load_runner_module():
+    """Import pipeline-runner.py, which knows how to load the stage scripts"""
+    sys.path.insert(0, SCRIPTS_DIR)
+    spec = importlib.util.spec_from_file_location('pipeline_runner', os.path.join(SCRIPTS_DIR, 'pipeline-runner.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def write_benchmark_configs(config_dir, rows):
+    """Copy the pipeline configs, turning every source into a sample-only source
+    
+    The largest source gets `rows` records and the others keep their
+    relative size from ingestion-config.json.
+    """
+    os.makedirs(config_dir, exist_ok=True)
+    for name in ('validation-config.json', 'transformation-config.json'):
+        shutil.copy(os.path.join(CONFIG_DIR, name), os.path.join(config_dir, name))
+    
+    with open(os.path.join(CONFIG_DIR, 'ingestion-config.json'), 'r') as f:
+        config = json.load(f)
+    
+    largest = max(source.get('sample_size', 1000) for source in config['sources'])
+    for source in config['sources']:
+        source['sample_size'] = max(1, rows * source.get('sample_size', 1000) // largest)
+        source.pop('url', None)
+        source['fallback_to_sample'] = True
+    
+    with open(os.path.join(config_dir, 'ingestion-config.json'), 'w') as f:
+        json.dump(config, f, indent=2)
+    
+    return sum(source['sample_size'] for source in config['sources'])
+
+def current_rss_bytes():
+    """Resident set size of this process right now"""
+    with open('/proc/self/statm', 'r') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def run_case(case, config_dir, data_dir):
+    """Run one case in this process and return its measurements"""
+    runner_module = load_runner_module()
+    load = runner_module.load_stage_class
+    rss_before = current_rss_bytes()
+    
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    
+    if case == 'ingestion':
+        stage = load('ingestion')(os.path.join(config_dir, 'ingestion-config.json'), data_dir=data_dir)
+        success = stage.run()
+    elif case == 'validation':
+        stage = load('validation')(os.path.join(config_dir, 'validation-config.json'), data_dir=data_dir)
+        success = stage.run()
+    elif case == 'transformation':
+        stage = load('transformation')(os.path.join(config_dir, 'transformation-config.json'), data_dir=data_dir)
+        success = stage.run()
+    elif case == 'analytics':
+        stage = load('analytics')(data_dir=data_dir)
+        success = stage.run()
+    else:
+        stage = runner_module.PipelineRunner(config_dir=config_dir, data_dir=data_dir)
+        success = stage.run()
+    
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    
+    if case == 'end_to_end':
+        records = stage.validator.metrics.summary()['records_in']
+    else:
+        records = stage.metrics.summary()['records_in'] or stage.metrics.summary()['records_out']
+    
+    return {
+        'success': bool(success),
+        'wall_seconds': round(wall, 6),
+        'cpu_seconds': round(cpu, 6),
+        'records': records,
+        'records_per_second': round(records / wall, 1) if wall > 0 else None,
+        'rss_before_bytes': rss_before,
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    }
+
+def records_nbytes(records):
+    """Deep size of a list of dicts, counting shared objects once"""
+    seen = set()
+    size = sys.getsizeof(records)
+    for record in records:
+        size += sys.getsizeof(record)
+        for value in record.values():
+            if id(value) not in seen:
+                seen.add(id(value))
+                size += sys.getsizeof(value)
+    return size
+
+def measure_dataset_memory(config_dir, data_dir):
+    """Bytes per million records of every source, as a list of dicts and as a typed Dataset"""
+    runner_module = load_runner_module()
+    from pipeline_dataset import Dataset
+    
+    ingestion = runner_module.load_stage_class('ingestion')(os.path.join(config_dir, 'ingestion-config.json'), data_dir=data_dir)
+    with open(os.path.join(config_dir, 'validation-config.json'), 'r') as f:
+        validation_config = json.load(f)
+    
+    memory = {}
+    for source in ingestion.config['sources']:
+        rows = min(source.get('sample_size', 1000), MEMORY_SAMPLE_ROWS)
+        records = ingestion.build_sample_records(source['name'], rows)
+        column_types = next((c.get('column_types') for c in validation_config.get('files', [])
+                             if c['name'] in source['name']), None)
+        dataset = Dataset.from_records(records, column_types)
+        
+        per_million = 1_000_000 / rows
+        memory[source['name']] = {
+            'rows_measured': rows,
+            'records_bytes_per_million': int(records_nbytes(records) * per_million),
+            'dataset_bytes_per_million': int(dataset.nbytes * per_million),
+            'column_types': dataset.schema
+        }
+    return memory
+
+def measure_interchange(config_dir, data_dir):
+    """Size and write/read throughput of the largest source in every interchange format"""
+    runner_module = load_runner_module()
+    from pipeline_dataset import Dataset
+    from pipeline_io import SUFFIXES, Interchange, read_data
+    
+    ingestion = runner_module.load_stage_class('ingestion')(os.path.join(config_dir, 'ingestion-config.json'), data_dir=data_dir)
+    source = max(ingestion.config['sources'], key=lambda s: s.get('sample_size', 1000))
+    rows = min(source.get('sample_size', 1000), MEMORY_SAMPLE_ROWS)
+    dataset = Dataset.from_records(ingestion.build_sample_records(source['name'], rows))
+    per_million = 1_000_000 / rows
+    
+    interchange = {}
+    for suffix, (fmt, compression) in SUFFIXES.items():
+        writer = Interchange(fmt, compression)
+        if writer.suffix != suffix:
+            # Read-only extension (downloaded payloads)
+            continue
+        path = os.path.join(data_dir, writer.filename(source['name']))
+        
+        start = time.perf_counter()
+        writer.write(path, dataset)
+        write_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        read_data(path)
+        read_seconds = time.perf_counter() - start
+        
+        interchange[writer.suffix.lstrip('.')] = {
+            'source': source['name'],
+            'rows_measured': rows,
+            'bytes_per_million': int(os.path.getsize(path) * per_million),
+            'write_records_per_second': round(rows / write_seconds, 1) if write_seconds > 0 else None,
+            'read_records_per_second': round(rows / read_seconds, 1) if read_seconds > 0 else None
+        }
+        os.remove(path)
+    return interchange
+
+def measure_imports(stage):
+    """Cold-start import cost of a stage script, from python -X importtime"""
+    path = os.path.join(SCRIPTS_DIR, STAGE_SCRIPTS[stage])
+    code = (f"import sys, importlib.util; sys.path.insert(0, {SCRIPTS_DIR!r}); "
+            f"sys.stderr.write('-- stage --\\n'); "
+            f"spec = importlib.util.spec_from_file_location('stage', {path!r}); "
+            f"spec.loader.exec_module(importlib.util.module_from_spec(spec))")
+    
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    startup = time.perf_counter() - start
+    
+    # Only imports after the marker belong to the stage, the rest is interpreter startup
+    lines = completed.stderr.split('-- stage --\n', 1)[-1].splitlines()
+    modules = []
+    for line in lines:
+        parts = line.split('|')
+        if not line.startswith('import time:') or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2][1:]
+        modules.append((name.strip(), int(parts[1]), len(name) - len(name.lstrip())))
+    
+    top_level = [(name, cumulative) for name, cumulative, depth in modules if depth == 0]
+    import_ms = sum(cumulative for _, cumulative in top_level) / 1000
+    return {
+        'success': completed.returncode == 0,
+        'startup_ms': round(startup * 1000, 1),
+        'import_ms': round(import_ms, 1),
+        'budget_ms': IMPORT_BUDGET_MS[stage],
+        'heavy_modules': [name for name in HEAVY_MODULES if any(m[0] == name for m in modules)],
+        'slowest_imports': [{'module': name, 'ms': round(cumulative / 1000, 1)}
+                            for name, cumulative in sorted(top_level, key=lambda m: -m[1])[:5]]
+    }
+
+def run_case_subprocess(case, config_dir, data_dir):
+    """Run a case in a fresh interpreter so peak memory and imports are not shared"""
+    command = [sys.executable, os.path.abspath(__file__), '--run-case', case,
+               '--config-dir', config_dir, '--data-dir', data_dir]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        logger.error(f"Case {case} failed:\n{completed.stderr[-2000:]}")
+        return {'success': False}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def run_benchmarks(scales, cases, work_dir):
+    """Run every case at every scale"""
+    results = {
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'cpu_count': os.cpu_count(),
+        'results': {},
+        'dataset_memory': {},
+        'interchange': {},
+        'imports': {}
+    }
+    
+    for stage in STAGE_SCRIPTS:
+        imports = measure_imports(stage)
+        results['imports'][stage] = imports
+        logger.info(f"import {stage:<15} {imports['import_ms']:>8.1f} ms (budget {imports['budget_ms']} ms), "
+                    f"startup {imports['startup_ms']:.1f} ms, heavy modules: {', '.join(imports['heavy_modules']) or 'none'}")
+    
+    for scale in scales:
+        rows = parse_scale(scale)
+        scale_dir = os.path.join(work_dir, scale)
+        config_dir = os.path.join(scale_dir, 'config')
+        total_rows = write_benchmark_configs(config_dir, rows)
+        logger.info(f"Scale {scale}: {total_rows} synthetic rows across all sources")
+        
+        scale_results = {}
+        stage_data_dir = os.path.join(scale_dir, 'stages')
+        for case in STAGE_CASES:
+            if case in cases:
+                scale_results[case] = run_case_subprocess(case, config_dir, stage_data_dir)
+            elif any(c in cases for c in STAGE_CASES[STAGE_CASES.index(case) + 1:]):
+                # Later stages need this stage's output, run it unmeasured
+                run_case_subprocess(case, config_dir, stage_data_dir)
+        
+        if 'end_to_end' in cases:
+            scale_results['end_to_end'] = run_case_subprocess('end_to_end', config_dir, os.path.join(scale_dir, 'e2e'))
+        
+        for case, result in scale_results.items():
+            logger.info(f"{scale:>5} {case:<15} {result.get('wall_seconds', float('nan')):>10.3f}s "
+                        f"{result.get('records_per_second') or 0:>12.0f} rec/s "
+                        f"{(result.get('peak_rss_bytes') or 0) / 2**20:>8.1f} MiB")
+        
+        results['results'][scale] = scale_results
+        
+        memory = measure_dataset_memory(config_dir, os.path.join(scale_dir, 'memory'))
+        for name, usage in memory.items():
+            logger.info(f"{scale:>5} {name:<15} {usage['records_bytes_per_million'] / 2**20:>8.1f} MiB per million "
+                        f"records as dicts, {usage['dataset_bytes_per_million'] / 2**20:>8.1f} MiB as a Dataset")
+        results['dataset_memory'][scale] = memory
+        
+        interchange_dir = os.path.join(scale_dir, 'interchange')
+        os.makedirs(interchange_dir, exist_ok=True)
+        interchange = measure_interchange(config_dir, interchange_dir)
+        for name, usage in interchange.items():
+            logger.info(f"{scale:>5} {name:<15} {usage['bytes_per_million'] / 2**20:>8.1f} MiB per million records, "
+                        f"write {usage['write_records_per_second'] or 0:>10.0f} rec/s, "
+                        f"read {usage['read_records_per_second'] or 0:>10.0f} rec/s")
+        results['interchange'][scale] = interchange
+    
+    return results
+
+def compare_results(current, baseline, threshold):
+    """List (scale, case, metric, baseline, current, change) for every regression beyond threshold"""
+    regressions = []
+    for scale, cases in current['results'].items():
+        for case, result in cases.items():
+            base = baseline.get('results', {}).get(scale, {}).get(case)
+            if not base:
+                continue
+            for metric in COMPARED_METRICS:
+                if not base.get(metric) or result.get(metric) is None:
+                    continue
+                change = (result[metric] - base[metric]) / base[metric]
+                if change > threshold:
+                    regressions.append((scale, case, metric, base[metric], result[metric], change))
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the data pipeline stages on synthetic data")
+    parser.add_argument('--scales', default='10k', help="Comma separated row counts, e.g. 10k,1m,10m")
+    parser.add_argument('--cases', default=','.join(CASES), help=f"Comma separated subset of {','.join(CASES)}")
+    parser.add_argument('--work-dir', help="Where synthetic data is generated (a temporary directory by default)")
+    parser.add_argument('--output', help="Results file (benchmarks/results/benchmark-<timestamp>.json by default)")
+    parser.add_argument('--compare', metavar='BASELINE', help="Baseline results file to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Relative increase counted as a regression (default 0.10)")
+    parser.add_argument('--import-budget-ms', type=float,
+                        help="Import time budget of every stage, overriding the per-stage defaults")
+    parser.add_argument('--save-baseline', metavar='PATH', help="Also store these results as a baseline")
+    parser.add_argument('--run-case', choices=CASES, help=argparse.SUPPRESS)
+    parser.add_argument('--config-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    
+    # Child process: run a single case and print its measurements
+    if args.run_case:
+        logging.getLogger().setLevel(logging.WARNING)
+        print(json.dumps(run_case(args.run_case, args.config_dir, args.data_dir)))
+        return 0
+    
+    scales = [scale.strip() for scale in args.scales.split(',') if scale.strip()]
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    
+    if args.import_budget_ms is not None:
+        for stage in IMPORT_BUDGET_MS:
+            IMPORT_BUDGET_MS[stage] = args.import_budget_ms
+    
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='pipeline-benchmark-')
+    try:
+        results = run_benchmarks(scales, cases, work_dir)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    output = args.output or os.path.join(
+        BENCHMARK_DIR, 'results', f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results written to {output}")
+    
+    if args.save_baseline:
+        shutil.copy(output, args.save_baseline)
+        logger.info(f"Baseline stored in {args.save_baseline}")
+    
+    over_budget = [stage for stage, imports in results['imports'].items()
+                   if imports['import_ms'] > imports['budget_ms']]
+    for stage in over_budget:
+        imports = results['imports'][stage]
+        logger.error(f"IMPORT BUDGET {stage}: {imports['import_ms']} ms > {imports['budget_ms']} ms "
+                     f"(slowest: {imports['slowest_imports'][:3]})")
+    
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        
+        regressions = compare_results(results, baseline, args.threshold)
+        for scale, case, metric, before, after, change in regressions:
+            logger.error(f"REGRESSION {scale} {case} {metric}: {before} -> {after} (+{change:.1%})")
+        if regressions:
+            return 1
+        logger.info(f"No regressions beyond {args.threshold:.0%} against {args.compare}")
+    
+    failed = [f"{scale}/{case}" for scale, cases_ in results['results'].items()
+              for case, result in cases_.items() if not result.get('success')]
+    if failed:
+        logger.error(f"Failed cases: {', '.join(failed)}")
+        return 1
+    return 1 if over_budget else 0
+
+if __name__ == "__main__":
+    exit(main())
\ No newline at end of file
@@ -2,58 +2,98 @@
 import json
 import os
 import logging
+import numbers
+import statistics
+from collections import Counter
 from datetime import datetime
-import pandas as pd
-import numpy as np
+from pipeline_metrics import StageMetrics
+from pipeline_dataset import as_dataset
+from pipeline_memory import FRAME_OVERHEAD, MemoryBudget, SortRuns
+from pipeline_io import Interchange, is_data_file, read_data
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Age groups of the user analytics (left-closed bins)
+AGE_BINS = [0, 25, 35, 45, 55, 100]
+AGE_LABELS = ['18-25', '26-35', '36-45', '46-55', '55+']
+
 class AnalyticsProcessor:
-    def __init__(self):
-        self.input_dir = "/data/transformed"
-        self.output_dir = "/data/analytics"
+    def __init__(self, data_dir="/data"):
+        self.data_dir = data_dir
+        self.input_dir = os.path.join(data_dir, "transformed")
+        self.output_dir = os.path.join(data_dir, "analytics")
         os.makedirs(self.output_dir, exist_ok=True)
+        self.metrics = StageMetrics('analytics')
+        self.budget = MemoryBudget('analytics', data_dir)
+        self.interchange = Interchange()
     
-    def generate_user_analytics(self):
-        """Generate user analytics report"""
+    def generate_user_analytics(self, users_data=None):
+        """Generate user analytics report
+        
+        users_data can be handed over in memory; otherwise it is read from the transformed zone.
+        """
         logger.info("Generating user analytics")
         
-        users_file = os.path.join(self.input_dir, "transformed_users.json")
-        if not os.path.exists(users_file):
+        users_file = self.interchange.find(self.input_dir, "transformed_users")
+        if users_data is None and users_file is None:
             logger.warning("Users data not found for analytics")
             return False
         
+        file_metrics = self.metrics.file("user_analytics")
+        
         try:
-            with open(users_file, 'r') as f:
-                users_data = json.load(f)
-            
-            df = pd.DataFrame(users_data)
-            
-            analytics = {
-                'total_users': len(df),
-                'active_users': len(df[df.get('active', True) == True]) if 'active' in df.columns else len(df),
-                'age_distribution': {},
-                'domain_analysis': {},
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            # Age distribution analysis
-            if 'age' in df.columns:
-                age_bins = [0, 25, 35, 45, 55, 100]
-                age_labels = ['18-25', '26-35', '36-45', '46-55', '55+']
-                df['age_group'] = pd.cut(df['age'], bins=age_bins, labels=age_labels, right=False)
-                analytics['age_distribution'] = df['age_group'].value_counts().to_dict()
-            
-            # Email domain analysis
-            if 'email' in df.columns:
-                df['email_domain'] = df['email'].str.split('@').str[1]
-                analytics['domain_analysis'] = df['email_domain'].value_counts().head(10).to_dict()
+            if users_data is None:
+                with file_metrics.phase('parse'):
+                    users_data = read_data(users_file)
+                file_metrics.read_file(users_file)
+            users_data = as_dataset(users_data)
+            file_metrics.records_in += len(users_data)
             
+            with file_metrics.phase('compute'):
+                import pandas as pd
+                
+                analytics = {
+                    'total_users': 0,
+                    'active_users': 0,
+                    'age_distribution': {},
+                    'domain_analysis': {},
+                    'timestamp': datetime.now().isoformat()
+                }
+                
+                # Only the analysed columns are converted, in batches that fit the memory budget
+                columns = users_data.select([f for f in ('active', 'age', 'email') if f in users_data.columns])
+                rows = len(columns)
+                if not self.budget.fits(columns.nbytes * FRAME_OVERHEAD):
+                    rows = self.budget.frame_batch_rows(columns)
+                
+                age_counts, domain_counts = None, None
+                for batch in columns.batches(rows):
+                    df = batch.to_frame()
+                    analytics['total_users'] += len(df)
+                    analytics['active_users'] += len(df[df.get('active', True) == True]) if 'active' in df.columns else len(df)
+                    
+                    # Age distribution analysis
+                    if 'age' in df.columns:
+                        df['age_group'] = pd.cut(df['age'], bins=AGE_BINS, labels=AGE_LABELS, right=False)
+                        counts = df['age_group'].value_counts()
+                        age_counts = counts if age_counts is None else age_counts.add(counts, fill_value=0)
+                    
+                    # Email domain analysis
+                    if 'email' in df.columns:
+                        df['email_domain'] = df['email'].str.split('@').str[1]
+                        counts = df['email_domain'].value_counts()
+                        domain_counts = counts if domain_counts is None else domain_counts.add(counts, fill_value=0)
+                
+                if age_counts is not None:
+                    age_counts = age_counts.astype(int).sort_values(ascending=False, kind='stable')
+                    analytics['age_distribution'] = age_counts.to_dict()
+                if domain_counts is not None:
+                    domain_counts = domain_counts.astype(int).sort_values(ascending=False, kind='stable')
+                    analytics['domain_analysis'] = domain_counts.head(10).to_dict()
+                
             # Save analytics
-            output_file = os.path.join(self.output_dir, "user_analytics.json")
-            with open(output_file, 'w') as f:
-                json.dump(analytics, f, indent=2, default=str)
+            self.write_report("user_analytics.json", analytics)
             
             logger.info("User analytics generated successfully")
             return True
@@ -62,49 +102,62 @@ class AnalyticsProcessor:
             logger.error(f"Error generating user analytics: {str(e)}")
             return False
     
-    def generate_transaction_analytics(self):
-        """Generate transaction analytics report"""
+    def generate_transaction_analytics(self, transactions_data=None):
+        """Generate transaction analytics report
+        
+        transactions_data can be handed over in memory; otherwise it is read from the transformed zone.
+        """
         logger.info("Generating transaction analytics")
         
-        transactions_file = os.path.join(self.input_dir, "transformed_transactions.json")
-        if not os.path.exists(transactions_file):
+        transactions_file = self.interchange.find(self.input_dir, "transformed_transactions")
+        if transactions_data is None and transactions_file is None:
             logger.warning("Transactions data not found for analytics")
             return False
         
+        file_metrics = self.metrics.file("transaction_analytics")
+        
         try:
-            with open(transactions_file, 'r') as f:
-                transactions_data = json.load(f)
-            
-            df = pd.DataFrame(transactions_data)
-            
-            analytics = {
-                'total_transactions': len(df),
-                'revenue_metrics': {},
-                'user_metrics': {},
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            # Revenue analytics
-            if 'amount_sum' in df.columns:
-                analytics['revenue_metrics'] = {
-                    'total_revenue': float(df['amount_sum'].sum()),
-                    'average_revenue_per_user': float(df['amount_sum'].mean()),
-                    'median_revenue_per_user': float(df['amount_sum'].median()),
-                    'top_spending_users': df.nlargest(10, 'amount_sum')[['user_id', 'amount_sum']].to_dict('records')
-                }
-            
-            # User transaction patterns
-            if 'id_count' in df.columns:
-                analytics['user_metrics'] = {
-                    'average_transactions_per_user': float(df['id_count'].mean()),
-                    'median_transactions_per_user': float(df['id_count'].median()),
-                    'most_active_users': df.nlargest(10, 'id_count')[['user_id', 'id_count']].to_dict('records')
-                }
+            if transactions_data is None:
+                with file_metrics.phase('parse'):
+                    transactions_data = read_data(transactions_file)
+                file_metrics.read_file(transactions_file)
+            transactions_data = as_dataset(transactions_data)
+            file_metrics.records_in += len(transactions_data)
             
+            with file_metrics.phase('compute'):
+                import pandas as pd
+                
+                if not self.budget.fits(transactions_data.nbytes * FRAME_OVERHEAD):
+                    analytics = self.transaction_analytics_in_batches(transactions_data)
+                else:
+                    df = transactions_data.to_frame()
+                    
+                    analytics = {
+                        'total_transactions': len(df),
+                        'revenue_metrics': {},
+                        'user_metrics': {},
+                        'timestamp': datetime.now().isoformat()
+                    }
+                    
+                    # Revenue analytics
+                    if 'amount_sum' in df.columns:
+                        analytics['revenue_metrics'] = {
+                            'total_revenue': float(df['amount_sum'].sum()),
+                            'average_revenue_per_user': float(df['amount_sum'].mean()),
+                            'median_revenue_per_user': float(df['amount_sum'].median()),
+                            'top_spending_users': df.nlargest(10, 'amount_sum')[['user_id', 'amount_sum']].to_dict('records')
+                        }
+                    
+                    # User transaction patterns
+                    if 'id_count' in df.columns:
+                        analytics['user_metrics'] = {
+                            'average_transactions_per_user': float(df['id_count'].mean()),
+                            'median_transactions_per_user': float(df['id_count'].median()),
+                            'most_active_users': df.nlargest(10, 'id_count')[['user_id', 'id_count']].to_dict('records')
+                        }
+                    
             # Save analytics
-            output_file = os.path.join(self.output_dir, "transaction_analytics.json")
-            with open(output_file, 'w') as f:
-                json.dump(analytics, f, indent=2, default=str)
+            self.write_report("transaction_analytics.json", analytics)
             
             logger.info("Transaction analytics generated successfully")
             return True
@@ -113,8 +166,78 @@ class AnalyticsProcessor:
             logger.error(f"Error generating transaction analytics: {str(e)}")
             return False
     
-    def generate_summary_report(self):
-        """Generate overall summary report"""
+    def transaction_analytics_in_batches(self, transactions_data):
+        """Transaction analytics of data that does not fit the memory budget as one frame
+        
+        Totals are accumulated per batch, the top 10 are carried over between
+        batches and medians come from sorted runs spilled to disk.
+        """
+        import pandas as pd
+        
+        analytics = {
+            'total_transactions': len(transactions_data),
+            'revenue_metrics': {},
+            'user_metrics': {},
+            'timestamp': datetime.now().isoformat()
+        }
+        
+        metrics = [
+            ('amount_sum', 'revenue_metrics', 'top_spending_users',
+             ('total_revenue', 'average_revenue_per_user', 'median_revenue_per_user')),
+            ('id_count', 'user_metrics', 'most_active_users',
+             (None, 'average_transactions_per_user', 'median_transactions_per_user'))
+        ]
+        for column, section, top_key, (total_key, average_key, median_key) in metrics:
+            if column not in transactions_data.columns:
+                continue
+            
+            columns = transactions_data.select(['user_id', column])
+            total, count, top = 0.0, 0, None
+            runs = SortRuns(self.budget, column)
+            try:
+                for batch in columns.batches(self.budget.frame_batch_rows(columns)):
+                    df = batch.to_frame()
+                    values = df[column].dropna()
+                    total += float(values.sum())
+                    count += len(values)
+                    runs.add(values.to_numpy(dtype=float))
+                    top = df if top is None else pd.concat([top, df], ignore_index=True)
+                    top = top.nlargest(10, column)
+                median = runs.median()
+            finally:
+                runs.close()
+            
+            if total_key:
+                analytics[section][total_key] = total
+            analytics[section][average_key] = total / count if count else float('nan')
+            analytics[section][median_key] = float(median)
+            analytics[section][top_key] = top[['user_id', column]].to_dict('records')
+        
+        return analytics
+    
+    def write_report(self, filename, analytics):
+        """Write an analytics report to the analytics zone"""
+        output_file = os.path.join(self.output_dir, filename)
+        file_metrics = self.metrics.file(filename.replace('.json', ''))
+        with file_metrics.phase('serialise'):
+            with open(output_file, 'w') as f:
+                json.dump(analytics, f, indent=2, default=str)
+        file_metrics.records_out += 1
+        file_metrics.wrote_file(output_file)
+    
+    def count_files(self, zone, predicate):
+        """Count files in a data zone, which may not exist when checkpoints are disabled"""
+        zone_dir = os.path.join(self.data_dir, zone)
+        if not os.path.isdir(zone_dir):
+            return 0
+        return len([f for f in os.listdir(zone_dir) if predicate(f)])
+    
+    def generate_summary_report(self, stage_summaries=None):
+        """Generate overall summary report
+        
+        stage_summaries maps stage name to its summary; by default the
+        *-summary.json files written by the earlier stages are read.
+        """
         logger.info("Generating summary report")
         
         try:
@@ -128,25 +251,28 @@ class AnalyticsProcessor:
             }
             
             # Collect data summaries
-            summary_files = [
-                '/data/ingestion-summary.json',
-                '/data/validation-summary.json',
-                '/data/transformation-summary.json'
-            ]
-            
-            for summary_file in summary_files:
-                if os.path.exists(summary_file):
-                    with open(summary_file, 'r') as f:
-                        stage_summary = json.load(f)
-                        stage_name = os.path.basename(summary_file).replace('-summary.json', '')
-                        summary['data_summary'][stage_name] = stage_summary
+            if stage_summaries is not None:
+                summary['data_summary'].update(stage_summaries)
+            else:
+                summary_files = [
+                    os.path.join(self.data_dir, 'ingestion-summary.json'),
+                    os.path.join(self.data_dir, 'validation-summary.json'),
+                    os.path.join(self.data_dir, 'transformation-summary.json')
+                ]
+                
+                for summary_file in summary_files:
+                    if os.path.exists(summary_file):
+                        with open(summary_file, 'r') as f:
+                            stage_summary = json.load(f)
+                            stage_name = os.path.basename(summary_file).replace('-summary.json', '')
+                            summary['data_summary'][stage_name] = stage_summary
             
             # Count processed files
             processed_files = {
-                'raw_files': len([f for f in os.listdir('/data/raw') if f.endswith(('.json', '.csv'))]),
-                'validated_files': len([f for f in os.listdir('/data/validated') if f.startswith('validated_')]),
-                'transformed_files': len([f for f in os.listdir('/data/transformed') if f.startswith('transformed_')]),
-                'analytics_files': len([f for f in os.listdir('/data/analytics') if f.endswith('.json')])
+                'raw_files': self.count_files('raw', lambda f: is_data_file(f) and not f.endswith('_metadata.json')),
+                'validated_files': self.count_files('validated', lambda f: f.startswith('validated_')),
+                'transformed_files': self.count_files('transformed', lambda f: f.startswith('transformed_')),
+                'analytics_files': self.count_files('analytics', lambda f: f.endswith('.json'))
             }
             
             summary['data_summary']['file_counts'] = processed_files
@@ -164,11 +290,17 @@ class AnalyticsProcessor:
                         analytics_data = json.load(f)
                         summary['analytics_summary'][analytics_file.replace('.json', '')] = analytics_data
             
+            # Stage-level instrumentation of the analytics stage itself
+            summary['pipeline_execution']['metrics'] = self.metrics.summary()
+            summary['pipeline_execution']['memory'] = self.budget.summary()
+            
             # Save summary report
             output_file = os.path.join(self.output_dir, "pipeline_summary_report.json")
             with open(output_file, 'w') as f:
                 json.dump(summary, f, indent=2, default=str)
             
+            self.metrics.write_exposition(self.data_dir)
+            
             logger.info("Summary report generated successfully")
             return True
             
@@ -196,6 +328,110 @@ class AnalyticsProcessor:
         logger.info(f"Analytics processing completed. {success_count} reports generated")
         return success_count > 0
 
+class IncrementalAnalytics:
+    """Running analytics state fed with micro-batches of transformed records
+    
+    Produces the same reports as AnalyticsProcessor without recomputing
+    history: user counters are bumped per record and per-group aggregate
+    partials (e.g. amount_sum / amount_count per user_id) are merged.
+    """
+    
+    def __init__(self, group_by=None):
+        self.group_by = group_by or ['user_id']
+        self.total_users = 0
+        self.active_users = 0
+        self.age_distribution = {label: 0 for label in AGE_LABELS}
+        self.domain_counts = Counter()
+        self.transaction_groups = {}
+    
+    def add_users(self, records):
+        """Fold a batch of transformed users into the running state"""
+        for record in records:
+            self.total_users += 1
+            if record.get('active', True) == True:
+                self.active_users += 1
+            
+            age = record.get('age')
+            if isinstance(age, numbers.Number):
+                for i, label in enumerate(AGE_LABELS):
+                    if AGE_BINS[i] <= age < AGE_BINS[i + 1]:
+                        self.age_distribution[label] += 1
+                        break
+            
+            email = record.get('email')
+            if isinstance(email, str) and '@' in email:
+                self.domain_counts[email.split('@')[1]] += 1
+    
+    def add_transactions(self, records):
+        """Merge a batch of per-group aggregate partials into the running state"""
+        for record in records:
+            key = tuple(record.get(field) for field in self.group_by)
+            merged = self.transaction_groups.get(key)
+            if merged is None:
+                self.transaction_groups[key] = dict(record)
+                continue
+            
+            for column, value in record.items():
+                if column in self.group_by or not isinstance(value, numbers.Number):
+                    merged[column] = value
+                elif column.endswith(('_sum', '_count')):
+                    merged[column] = merged.get(column, 0) + value
+                elif column.endswith('_min'):
+                    merged[column] = min(merged.get(column, value), value)
+                elif column.endswith('_max'):
+                    merged[column] = max(merged.get(column, value), value)
+            
+            # Means are recomputed from the merged sums and counts
+            for column in list(merged):
+                if column.endswith('_mean'):
+                    field = column[:-len('_mean')]
+                    count = merged.get(f'{field}_count')
+                    if count:
+                        merged[column] = merged.get(f'{field}_sum', 0) / count
+    
+    def user_analytics(self):
+        """Current user analytics report"""
+        return {
+            'total_users': self.total_users,
+            'active_users': self.active_users,
+            'age_distribution': dict(self.age_distribution),
+            'domain_analysis': dict(self.domain_counts.most_common(10)),
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def transaction_analytics(self):
+        """Current transaction analytics report"""
+        rows = list(self.transaction_groups.values())
+        analytics = {
+            'total_transactions': len(rows),
+            'revenue_metrics': {},
+            'user_metrics': {},
+            'timestamp': datetime.now().isoformat()
+        }
+        
+        revenue = [row for row in rows if 'amount_sum' in row]
+        if revenue:
+            amounts = [row['amount_sum'] for row in revenue]
+            top = sorted(revenue, key=lambda row: row['amount_sum'], reverse=True)[:10]
+            analytics['revenue_metrics'] = {
+                'total_revenue': float(sum(amounts)),
+                'average_revenue_per_user': float(statistics.mean(amounts)),
+                'median_revenue_per_user': float(statistics.median(amounts)),
+                'top_spending_users': [{'user_id': row.get('user_id'), 'amount_sum': row['amount_sum']} for row in top]
+            }
+        
+        activity = [row for row in rows if 'id_count' in row]
+        if activity:
+            counts = [row['id_count'] for row in activity]
+            top = sorted(activity, key=lambda row: row['id_count'], reverse=True)[:10]
+            analytics['user_metrics'] = {
+                'average_transactions_per_user': float(statistics.mean(counts)),
+                'median_transactions_per_user': float(statistics.median(counts)),
+                'most_active_users': [{'user_id': row.get('user_id'), 'id_count': row['id_count']} for row in top]
+            }
+        
+        return analytics
+
 if __name__ == "__main__":
     processor = AnalyticsProcessor()
     success = processor.run()
@@ -1,55 +1,357 @@
 #!/usr/bin/env python3
-import requests
 import json
 import csv
 import os
 import time
+import gzip
+import zlib
+import base64
+import shutil
+import hashlib
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from pipeline_metrics import StageMetrics
+from pipeline_io import Interchange
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Objects at least this large are downloaded as parallel byte ranges when the server supports them
+RANGED_DOWNLOAD_THRESHOLD = 64 * 1024**2
+DEFAULT_PARALLEL_SEGMENTS = 4
+DEFAULT_SEGMENT_BYTES = 32 * 1024**2
+SEGMENT_RETRIES = 3
+DOWNLOAD_CHUNK_BYTES = 1024**2
+
+# Transfers are requested compressed; raw files are kept, so they are compressed for size
+ACCEPT_ENCODING = 'gzip, deflate'
+RAW_COMPRESS_LEVEL = 6
+
+def preallocate(fd, size):
+    """Reserve the blocks of a file up front, so parallel writers do not fragment it"""
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        # Not supported by every filesystem; a sparse file of the right size still works
+        os.ftruncate(fd, size)
+
+def digest_sha256(headers):
+    """Hex sha256 announced in a Repr-Digest or Digest header, or None"""
+    for header in ('Repr-Digest', 'Digest'):
+        for item in headers.get(header, '').split(','):
+            algorithm, _, value = item.strip().partition('=')
+            if algorithm.lower() == 'sha-256' and value:
+                return base64.b64decode(value.strip(':')).hex()
+    return None
+
+def file_sha256(path):
+    """Hex sha256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 class DataIngestion:
-    def __init__(self, config_path="/config/ingestion-config.json"):
+    def __init__(self, config_path="/config/ingestion-config.json", data_dir="/data"):
         with open(config_path, 'r') as f:
             self.config = json.load(f)
         
-        self.output_dir = "/data/raw"
+        self.data_dir = data_dir
+        self.output_dir = os.path.join(data_dir, "raw")
         os.makedirs(self.output_dir, exist_ok=True)
+        self.metrics = StageMetrics('ingestion')
+        self.interchange = Interchange()
+    
+    def probe_ranges(self, source_config):
+        """Size and validators of a large object served with byte ranges, or None
+        
+        None means the source is downloaded in a single stream: the server does
+        not advertise Accept-Ranges, the object is below ranged_threshold_bytes,
+        or parallel_segments is less than 2.
+        """
+        import requests
+        if source_config.get('parallel_segments', DEFAULT_PARALLEL_SEGMENTS) < 2:
+            return None
+        
+        headers = dict(source_config.get('headers', {}), **{'Accept-Encoding': 'identity'})
+        try:
+            response = requests.head(source_config['url'], headers=headers, params=source_config.get('params', {}),
+                                     timeout=30, allow_redirects=True)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning(f"Range probe of {source_config['name']} failed, downloading in one stream: {str(e)}")
+            return None
+        
+        size = int(response.headers.get('Content-Length') or 0)
+        threshold = source_config.get('ranged_threshold_bytes', RANGED_DOWNLOAD_THRESHOLD)
+        if response.headers.get('Accept-Ranges', '').lower() != 'bytes' or size < threshold:
+            return None
+        
+        return {
+            'url': response.url,
+            'size': size,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'sha256': source_config.get('sha256') or digest_sha256(response.headers)
+        }
+    
+    def load_segment_state(self, state_path, part_path, remote):
+        """Progress of an earlier ranged download of the same object, or None"""
+        try:
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        same_object = all(state.get(key) == remote[key] for key in ('url', 'size', 'etag', 'last_modified'))
+        if not same_object or not os.path.exists(part_path) or os.path.getsize(part_path) != remote['size']:
+            logger.info(f"Discarding partial download {part_path}, the remote object changed")
+            return None
+        return state
+    
+    def write_segment_state(self, state_path, state):
+        """Persist the download progress atomically"""
+        with open(f"{state_path}.tmp", 'w') as f:
+            json.dump(state, f)
+        os.replace(f"{state_path}.tmp", state_path)
+    
+    def download_segment(self, remote, headers, part_path, start, end):
+        """Write bytes start..end (inclusive) of the object at their offset in the part file"""
+        import requests
+        range_headers = dict(headers, **{'Range': f"bytes={start}-{end}", 'Accept-Encoding': 'identity'})
+        # A changed object is sent in full (200) instead of the range. Weak ETags never match
+        # If-Range, so those fall back to Last-Modified, or to the sha256 check alone
+        etag = remote['etag'] if remote['etag'] and not remote['etag'].startswith('W/') else None
+        if etag or remote['last_modified']:
+            range_headers['If-Range'] = etag or remote['last_modified']
+        
+        offset = start
+        with requests.get(remote['url'], headers=range_headers, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise IOError(f"Server answered HTTP {response.status_code} to the range bytes={start}-{end}")
+            
+            fd = os.open(part_path, os.O_WRONLY)
+            try:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                    view = memoryview(chunk)
+                    while view:
+                        written = os.pwrite(fd, view, offset)
+                        view = view[written:]
+                        offset += written
+            finally:
+                os.close(fd)
+        
+        if offset != end + 1:
+            raise IOError(f"Range bytes={start}-{end} ended after {offset - start} bytes")
+        return offset - start
     
-    def download_dataset(self, source_config):
-        """Download dataset from external source"""
+    def download_ranged(self, source_config, remote, path):
+        """Download an object as parallel byte-range segments into a preallocated file
+        
+        Finished segments are recorded in <path>.part.state, so after a failure
+        the next run only fetches the segments that are missing. The whole
+        object is checked against the expected sha256 (the source's sha256 or
+        the server's Digest header) before it is moved to path.
+        
+        Returns the sha256 of the object.
+        """
+        part_path, state_path = f"{path}.part", f"{path}.part.state"
+        headers = source_config.get('headers', {})
+        workers = source_config.get('parallel_segments', DEFAULT_PARALLEL_SEGMENTS)
+        
+        state = self.load_segment_state(state_path, part_path, remote)
+        if state is None:
+            state = {key: remote[key] for key in ('url', 'size', 'etag', 'last_modified')}
+            state['segment_bytes'] = source_config.get('segment_bytes', DEFAULT_SEGMENT_BYTES)
+            state['done'] = []
+            with open(part_path, 'wb') as f:
+                preallocate(f.fileno(), remote['size'])
+            self.write_segment_state(state_path, state)
+        
+        done = set(state['done'])
+        segments = [(start, min(start + state['segment_bytes'], remote['size']) - 1)
+                    for start in range(0, remote['size'], state['segment_bytes']) if start not in done]
+        logger.info(f"Downloading {source_config['name']} ({remote['size']} bytes) as {len(segments)} ranges "
+                    f"on {workers} connections ({len(done)} ranges already done)")
+        
+        lock = threading.Lock()
+        
+        def fetch(segment):
+            start, end = segment
+            for attempt in range(SEGMENT_RETRIES):
+                try:
+                    self.download_segment(remote, headers, part_path, start, end)
+                    break
+                except Exception as e:
+                    if attempt == SEGMENT_RETRIES - 1:
+                        raise
+                    logger.warning(f"Range bytes={start}-{end} of {source_config['name']} failed, retrying: {str(e)}")
+                    time.sleep(2 ** attempt)
+            
+            with lock:
+                state['done'].append(start)
+                self.write_segment_state(state_path, state)
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(fetch, segment) for segment in segments]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            raise IOError(f"{len(errors)} of {len(segments)} ranges failed, the next run resumes them: {str(errors[0])}")
+        
+        sha256 = file_sha256(part_path)
+        if remote['sha256'] and sha256 != remote['sha256'].lower():
+            os.remove(part_path)
+            os.remove(state_path)
+            raise ValueError(f"Checksum mismatch for {source_config['name']}: expected {remote['sha256']}, got {sha256}")
+        
+        os.replace(part_path, path)
+        os.remove(state_path)
+        return sha256
+    
+    def store_compressed(self, response, path):
+        """Stream a response body into a gzip file in the raw zone
+        
+        A body the server already gzipped is written as received, without
+        decoding it; anything else is compressed on the way. Returns the
+        transfer details recorded in the metadata.
+        """
+        encoding = response.headers.get('Content-Encoding', 'identity').lower()
+        uncompressed = 0
+        if encoding == 'gzip':
+            # Decompressed only to count the uncompressed size
+            counter = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            with open(path, 'wb') as f:
+                for chunk in response.raw.stream(DOWNLOAD_CHUNK_BYTES, decode_content=False):
+                    f.write(chunk)
+                    uncompressed += len(counter.decompress(chunk))
+        else:
+            with gzip.open(path, 'wb', compresslevel=RAW_COMPRESS_LEVEL) as f:
+                for chunk in response.raw.stream(DOWNLOAD_CHUNK_BYTES, decode_content=True):
+                    f.write(chunk)
+                    uncompressed += len(chunk)
+        
+        return {'content_encoding': encoding, 'transferred_bytes': response.raw.tell(), 'uncompressed_size': uncompressed}
+    
+    def compress_file(self, source_path, path):
+        """Gzip a downloaded file into the raw zone"""
+        with open(source_path, 'rb') as src, gzip.open(path, 'wb', compresslevel=RAW_COMPRESS_LEVEL) as dst:
+            shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK_BYTES)
+    
+    def parse_file(self, path, data_format):
+        """Records of a downloaded payload on disk, decompressed while reading if gzipped"""
+        opener = gzip.open if path.endswith('.gz') else open
+        if data_format == 'json':
+            with opener(path, 'rt') as f:
+                return json.load(f)
+        if data_format == 'csv':
+            # Same parsing as DataValidator.load_file; pandas infers the compression
+            import pandas as pd
+            return pd.read_csv(path).to_dict('records')
+        with opener(path, 'rb') as f:
+            return f.read()
+    
+    def download_dataset(self, source_config, save=True):
+        """Download dataset from external source
+        
+        Returns the parsed records (raw bytes for formats other than json/csv),
+        or None if the download failed. With save=False nothing is written to
+        the shared volume, so an in-process runner can hand the records on.
+        Large objects on servers that accept byte ranges are downloaded in
+        parallel segments (see download_ranged).
+        
+        Transfers ask for gzip/deflate. Unless the source sets raw_compression
+        to none, the payload is kept in the raw zone as <name>.<format>.gz,
+        streamed through without being decoded when it arrives gzipped.
+        """
         source_name = source_config['name']
         url = source_config['url']
         data_format = source_config.get('format', 'json')
+        compress = source_config.get('raw_compression', 'gzip') != 'none'
         
         logger.info(f"Downloading dataset: {source_name}")
         
+        file_metrics = self.metrics.file(self.source_filename(source_config))
+        output_file = os.path.join(self.output_dir, self.source_filename(source_config))
+        
         try:
-            headers = source_config.get('headers', {})
+            headers = dict(source_config.get('headers', {}), **{'Accept-Encoding': ACCEPT_ENCODING})
             params = source_config.get('params', {})
+            sha256 = None
+            payload_file = None
             
-            response = requests.get(url, headers=headers, params=params, timeout=30)
-            response.raise_for_status()
+            with file_metrics.phase('fetch'):
+                # Imported here so sample-only runs never pay for it
+                import requests
+                remote = self.probe_ranges(source_config)
+                if remote:
+                    download_file = os.path.join(self.output_dir, f"{source_name}.download")
+                    sha256 = self.download_ranged(source_config, remote, download_file)
+                    payload_file = download_file
+                    transfer = {'content_encoding': 'identity', 'transferred_bytes': remote['size'],
+                                'uncompressed_size': remote['size']}
+                else:
+                    response = requests.get(url, headers=headers, params=params, timeout=30, stream=save and compress)
+                    response.raise_for_status()
+                    if save and compress:
+                        transfer = self.store_compressed(response, output_file)
+                        payload_file = output_file
+                    else:
+                        transfer = {'content_encoding': response.headers.get('Content-Encoding', 'identity').lower(),
+                                    'transferred_bytes': response.raw.tell(),
+                                    'uncompressed_size': len(response.content)}
+                file_metrics.bytes_read += transfer['transferred_bytes']
             
             # Handle different data formats
-            if data_format == 'json':
-                data = response.json()
-                output_file = os.path.join(self.output_dir, f"{source_name}.json")
-                with open(output_file, 'w') as f:
-                    json.dump(data, f, indent=2)
+            with file_metrics.phase('parse'):
+                if payload_file:
+                    data = self.parse_file(payload_file, data_format)
+                elif data_format == 'json':
+                    data = response.json()
+                elif data_format == 'csv':
+                    # Parse the same way DataValidator.load_file reads CSV from disk
+                    import io
+                    import pandas as pd
+                    data = pd.read_csv(io.BytesIO(response.content)).to_dict('records')
+                else:
+                    data = response.content
+            
+            file_metrics.records_in += len(data) if isinstance(data, list) else 1
+            file_metrics.records_out += len(data) if isinstance(data, list) else 1
             
-            elif data_format == 'csv':
-                output_file = os.path.join(self.output_dir, f"{source_name}.csv")
-                with open(output_file, 'w') as f:
-                    f.write(response.text)
+            if not save:
+                if remote:
+                    os.remove(download_file)
+                logger.info(f"Downloaded {source_name} (in memory)")
+                return data
             
-            else:
-                output_file = os.path.join(self.output_dir, f"{source_name}.{data_format}")
-                with open(output_file, 'wb') as f:
-                    f.write(response.content)
+            with file_metrics.phase('serialise'):
+                if remote and compress:
+                    self.compress_file(download_file, output_file)
+                    os.remove(download_file)
+                
+                elif compress:
+                    # Already streamed to the raw zone by store_compressed
+                    pass
+                
+                elif data_format == 'json':
+                    self.interchange.write(output_file, data)
+                    if remote:
+                        os.remove(download_file)
+                
+                elif remote:
+                    # CSV and binary payloads are kept byte for byte
+                    os.replace(download_file, output_file)
+                
+                else:
+                    with open(output_file, 'wb') as f:
+                        f.write(response.content)
+            
+            file_metrics.wrote_file(output_file)
             
             logger.info(f"Downloaded {source_name} to {output_file}")
             
@@ -59,26 +361,33 @@ class DataIngestion:
                 'url': url,
                 'downloaded_at': datetime.now().isoformat(),
                 'file_size': os.path.getsize(output_file),
-                'format': data_format
+                'format': data_format,
+                'transfer': dict(transfer,
+                                 compression='gzip' if compress else 'none',
+                                 compressed_size=os.path.getsize(output_file) if compress else None)
             }
+            if remote:
+                metadata['download'] = {
+                    'ranged': True,
+                    'object_size': remote['size'],
+                    'segment_bytes': source_config.get('segment_bytes', DEFAULT_SEGMENT_BYTES),
+                    'parallel_segments': source_config.get('parallel_segments', DEFAULT_PARALLEL_SEGMENTS),
+                    'sha256': sha256,
+                    'sha256_verified': bool(remote['sha256'])
+                }
             
             metadata_file = os.path.join(self.output_dir, f"{source_name}_metadata.json")
             with open(metadata_file, 'w') as f:
                 json.dump(metadata, f, indent=2)
             
-            return True
+            return data
             
         except Exception as e:
             logger.error(f"Failed to download {source_name}: {str(e)}")
-            return False
+            return None
     
-    def generate_sample_data(self, source_config):
-        """Generate sample data if external source is unavailable"""
-        source_name = source_config['name']
-        sample_size = source_config.get('sample_size', 1000)
-        
-        logger.info(f"Generating sample data for: {source_name}")
-        
+    def build_sample_records(self, source_name, sample_size):
+        """Build sample records for a source"""
         # Generate sample user data
         if 'users' in source_name:
             data = []
@@ -111,12 +420,75 @@ class DataIngestion:
         else:
             data = [{'id': i, 'value': f'sample_{i}'} for i in range(sample_size)]
         
-        output_file = os.path.join(self.output_dir, f"{source_name}.json")
-        with open(output_file, 'w') as f:
-            json.dump(data, f, indent=2)
+        return data
+    
+    def generate_sample_data(self, source_config, save=True):
+        """Generate sample data if external source is unavailable"""
+        source_name = source_config['name']
+        sample_size = source_config.get('sample_size', 1000)
+        file_metrics = self.metrics.file(self.interchange.filename(source_name))
+        
+        logger.info(f"Generating sample data for: {source_name}")
+        
+        with file_metrics.phase('compute'):
+            data = self.build_sample_records(source_name, sample_size)
+        file_metrics.records_out += len(data)
+        
+        if not save:
+            logger.info(f"Generated sample data for {source_name} (in memory)")
+            return data
+        
+        output_file = os.path.join(self.output_dir, self.interchange.filename(source_name))
+        with file_metrics.phase('serialise'):
+            self.interchange.write(output_file, data)
+        file_metrics.wrote_file(output_file)
         
         logger.info(f"Generated sample data: {output_file}")
-        return True
+        return data
+    
+    def source_filename(self, source_config):
+        """Name of the raw file a downloaded source is stored under"""
+        data_format = source_config.get('format', 'json')
+        if source_config.get('raw_compression', 'gzip') != 'none':
+            return f"{source_config['name']}.{data_format}.gz"
+        if data_format == 'json':
+            return self.interchange.filename(source_config['name'])
+        return f"{source_config['name']}.{data_format}"
+    
+    def ingest_source(self, source_config, save=True):
+        """Ingest one source, falling back to sample data
+        
+        Returns (filename, data), or (None, None) if the source could not be ingested.
+        """
+        # Try to download from external source first (sources without a URL are sample-only)
+        if source_config.get('url'):
+            data = self.download_dataset(source_config, save=save)
+            if data is not None:
+                return self.source_filename(source_config), data
+        
+        # Fallback to sample data generation
+        if source_config.get('fallback_to_sample', True):
+            data = self.generate_sample_data(source_config, save=save)
+            return self.interchange.filename(source_config['name']), data
+        
+        return None, None
+    
+    def build_summary(self, total_sources, success_count):
+        """Build the ingestion summary"""
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'total_sources': total_sources,
+            'successful_sources': success_count,
+            'status': 'completed' if success_count > 0 else 'failed',
+            'metrics': self.metrics.summary()
+        }
+    
+    def write_summary(self, summary):
+        """Write the ingestion summary that gates the validation stage"""
+        with open(os.path.join(self.data_dir, 'ingestion-summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        
+        self.metrics.write_exposition(self.data_dir)
     
     def run(self):
         """Execute data ingestion process"""
@@ -127,14 +499,9 @@ class DataIngestion:
         
         for source in sources:
             try:
-                # Try to download from external source first
-                if self.download_dataset(source):
+                filename, _ = self.ingest_source(source)
+                if filename:
                     success_count += 1
-                else:
-                    # Fallback to sample data generation
-                    if source.get('fallback_to_sample', True):
-                        if self.generate_sample_data(source):
-                            success_count += 1
             
             except Exception as e:
                 logger.error(f"Error processing source {source.get('name', 'unknown')}: {str(e)}")
@@ -142,15 +509,8 @@ class DataIngestion:
         logger.info(f"Data ingestion completed. {success_count}/{len(sources)} sources processed successfully")
         
         # Create ingestion summary
-        summary = {
-            'timestamp': datetime.now().isoformat(),
-            'total_sources': len(sources),
-            'successful_sources': success_count,
-            'status': 'completed' if success_count > 0 else 'failed'
-        }
-        
-        with open('/data/ingestion-summary.json', 'w') as f:
-            json.dump(summary, f, indent=2)
+        summary = self.build_summary(len(sources), success_count)
+        self.write_summary(summary)
         
         return success_count > 0
 
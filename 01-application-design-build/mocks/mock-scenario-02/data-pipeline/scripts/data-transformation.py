@@ -4,27 +4,32 @@ import csv
 import os
 import logging
 from datetime import datetime
-import pandas as pd
-import numpy as np
+from pipeline_metrics import StageMetrics
+from pipeline_dataset import Column, Dataset, MISSING, as_dataset
+from pipeline_memory import FRAME_OVERHEAD, MemoryBudget, PartialAggregator
+from pipeline_io import Interchange, is_csv, is_data_file, read_data, strip_suffix, suffix_of
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class DataTransformer:
-    def __init__(self, config_path="/config/transformation-config.json"):
+    def __init__(self, config_path="/config/transformation-config.json", data_dir="/data"):
         with open(config_path, 'r') as f:
             self.config = json.load(f)
         
-        self.input_dir = "/data/validated"
-        self.output_dir = "/data/transformed"
+        self.data_dir = data_dir
+        self.input_dir = os.path.join(data_dir, "validated")
+        self.output_dir = os.path.join(data_dir, "transformed")
         os.makedirs(self.output_dir, exist_ok=True)
+        self.metrics = StageMetrics('transformation')
+        self.budget = MemoryBudget('transformation', data_dir)
+        self.interchange = Interchange()
     
     def aggregate_data(self, data, aggregation_config):
         """Aggregate data based on configuration"""
-        if not isinstance(data, list) or not data:
-            return []
-        
-        df = pd.DataFrame(data)
+        data = as_dataset(data)
+        if data is None or not len(data):
+            return Dataset()
         
         group_by = aggregation_config.get('group_by', [])
         if not group_by:
@@ -33,14 +38,26 @@ class DataTransformer:
         aggregations = aggregation_config.get('aggregations', {})
         
         try:
-            grouped = df.groupby(group_by)
+            import pandas as pd
+            
+            # Only the grouped and aggregated columns are converted
+            columns = data.select(dict.fromkeys(group_by + list(aggregations)))
+            if PartialAggregator.supports(aggregations) and not self.budget.fits(columns.nbytes * FRAME_OVERHEAD):
+                # Fold batches into per-group partials, spilled to disk if they outgrow the budget
+                aggregator = PartialAggregator(self.budget, group_by, aggregations)
+                for batch in columns.batches(self.budget.frame_batch_rows(columns)):
+                    aggregator.add(batch.to_frame())
+                return Dataset.from_frame(aggregator.result())
+            
+            df = columns.to_frame()
+            grouped = df.groupby(group_by, observed=True)
             result = grouped.agg(aggregations).reset_index()
             
             # Flatten column names if needed
             if isinstance(result.columns, pd.MultiIndex):
                 result.columns = ['_'.join(col).strip() if col[1] else col[0] for col in result.columns]
             
-            return result.to_dict('records')
+            return Dataset.from_frame(result)
         
         except Exception as e:
             logger.error(f"Aggregation failed: {str(e)}")
@@ -48,12 +65,17 @@ class DataTransformer:
     
     def filter_data(self, data, filter_config):
         """Filter data based on conditions"""
-        if not isinstance(data, list) or not data:
-            return []
+        data = as_dataset(data)
+        if data is None or not len(data):
+            return Dataset()
         
-        df = pd.DataFrame(data)
+        import numpy as np
         
         conditions = filter_config.get('conditions', [])
+        fields = [c.get('field') for c in conditions if c.get('field') in data.columns]
+        df = data.to_frame(fields=list(dict.fromkeys(fields)))
+        keep = np.ones(len(data), dtype=bool)
+        
         for condition in conditions:
             field = condition.get('field')
             operator = condition.get('operator')
@@ -63,108 +85,139 @@ class DataTransformer:
                 continue
             
             try:
+                column = df[field]
                 if operator == 'equals':
-                    df = df[df[field] == value]
+                    keep &= (column == value).to_numpy(dtype=bool)
                 elif operator == 'not_equals':
-                    df = df[df[field] != value]
-                elif operator == 'greater_than':
-                    df = df[df[field] > value]
-                elif operator == 'less_than':
-                    df = df[df[field] < value]
+                    keep &= (column != value).to_numpy(dtype=bool)
+                elif operator in ('greater_than', 'less_than'):
+                    # Strings are categorical columns, which pandas only compares for equality
+                    if column.dtype.name == 'category':
+                        column = column.astype(object)
+                    keep &= (column > value if operator == 'greater_than' else column < value).to_numpy(dtype=bool)
                 elif operator == 'contains':
-                    df = df[df[field].astype(str).str.contains(str(value), na=False)]
+                    keep &= column.astype(str).str.contains(str(value), na=False).to_numpy(dtype=bool)
                 elif operator == 'in':
-                    df = df[df[field].isin(value)]
+                    keep &= column.isin(value).to_numpy(dtype=bool)
                 elif operator == 'not_null':
-                    df = df[df[field].notna()]
+                    keep &= column.notna().to_numpy(dtype=bool)
             
             except Exception as e:
                 logger.warning(f"Filter condition failed: {condition}, error: {str(e)}")
         
-        return df.to_dict('records')
+        return data.take(np.flatnonzero(keep))
     
-    def enrich_data(self, data, enrichment_config):
-        """Enrich data with calculated fields"""
-        if not isinstance(data, list) or not data:
-            return []
-        
-        enriched_data = []
+    def calculate_field(self, data, calculation):
+        """Column of one calculated field"""
+        if calculation['type'] == 'concatenate':
+            fields = calculation['fields']
+            separator = calculation.get('separator', ' ')
+            columns = [data.columns[f] if f in data.columns else Column.repeat('', len(data)) for f in fields]
+            return Column.from_values(
+                separator.join('' if value is MISSING else str(value) for value in values)
+                for values in zip(*columns))
         
-        for record in data:
-            enriched_record = record.copy()
+        elif calculation['type'] == 'arithmetic':
+            operation = calculation['operation']
+            columns = [data.columns[calculation[f]] if calculation[f] in data.columns else Column.repeat(0, len(data))
+                       for f in ('field1', 'field2')]
+            failures = []
             
-            # Add calculated fields
-            calculated_fields = enrichment_config.get('calculated_fields', {})
-            for field_name, calculation in calculated_fields.items():
+            def calculate(field1, field2):
+                field1 = 0 if field1 is MISSING else field1
+                field2 = 0 if field2 is MISSING else field2
                 try:
-                    if calculation['type'] == 'concatenate':
-                        fields = calculation['fields']
-                        separator = calculation.get('separator', ' ')
-                        values = [str(record.get(f, '')) for f in fields]
-                        enriched_record[field_name] = separator.join(values)
-                    
-                    elif calculation['type'] == 'arithmetic':
-                        field1 = record.get(calculation['field1'], 0)
-                        field2 = record.get(calculation['field2'], 0)
-                        operation = calculation['operation']
-                        
-                        if operation == 'add':
-                            enriched_record[field_name] = field1 + field2
-                        elif operation == 'subtract':
-                            enriched_record[field_name] = field1 - field2
-                        elif operation == 'multiply':
-                            enriched_record[field_name] = field1 * field2
-                        elif operation == 'divide' and field2 != 0:
-                            enriched_record[field_name] = field1 / field2
-                    
-                    elif calculation['type'] == 'timestamp':
-                        enriched_record[field_name] = datetime.now().isoformat()
-                    
-                    elif calculation['type'] == 'constant':
-                        enriched_record[field_name] = calculation['value']
-                
+                    if operation == 'add':
+                        return field1 + field2
+                    elif operation == 'subtract':
+                        return field1 - field2
+                    elif operation == 'multiply':
+                        return field1 * field2
+                    elif operation == 'divide' and field2 != 0:
+                        return field1 / field2
                 except Exception as e:
-                    logger.warning(f"Enrichment calculation failed for {field_name}: {str(e)}")
+                    failures.append(str(e))
+                return MISSING
             
-            enriched_data.append(enriched_record)
+            column = Column.from_values(calculate(field1, field2) for field1, field2 in zip(*columns))
+            if failures:
+                logger.warning(f"Arithmetic failed for {len(failures)} records: {failures[0]}")
+            return column
         
-        return enriched_data
+        elif calculation['type'] == 'timestamp':
+            return Column.repeat(datetime.now().isoformat(), len(data))
+        
+        elif calculation['type'] == 'constant':
+            return Column.repeat(calculation['value'], len(data))
+        
+        return None
     
-    def transform_file(self, filename):
-        """Transform a single data file"""
-        logger.info(f"Transforming file: {filename}")
+    def enrich_data(self, data, enrichment_config):
+        """Enrich data with calculated fields"""
+        data = as_dataset(data)
+        if data is None or not len(data):
+            return Dataset()
         
-        input_path = os.path.join(self.input_dir, filename)
+        enriched_data = data
         
-        if not os.path.exists(input_path):
-            logger.error(f"Input file not found: {input_path}")
-            return False
+        # Add calculated fields, computed from the input columns
+        calculated_fields = enrichment_config.get('calculated_fields', {})
+        for field_name, calculation in calculated_fields.items():
+            try:
+                column = self.calculate_field(data, calculation)
+                if column is not None:
+                    enriched_data = enriched_data.with_column(field_name, column)
+            
+            except Exception as e:
+                logger.warning(f"Enrichment calculation failed for {field_name}: {str(e)}")
         
-        # Find transformation config for this file
-        file_config = None
+        return enriched_data
+    
+    def get_file_config(self, filename):
+        """Find transformation config for a file"""
         for config in self.config.get('files', []):
             if config['name'] in filename:
-                file_config = config
-                break
+                return config
         
-        if not file_config:
-            logger.warning(f"No transformation config found for {filename}, using default")
-            file_config = {'name': filename, 'transformations': []}
+        logger.warning(f"No transformation config found for {filename}, using default")
+        return {'name': filename, 'transformations': []}
+    
+    def load_file(self, filename):
+        """Load records of a validated data file, or None if the format is unsupported"""
+        input_path = os.path.join(self.input_dir, filename)
+        file_metrics = self.metrics.file(filename)
         
-        try:
-            # Load data
-            if filename.endswith('.json'):
-                with open(input_path, 'r') as f:
-                    data = json.load(f)
-            elif filename.endswith('.csv'):
-                df = pd.read_csv(input_path)
-                data = df.to_dict('records')
+        with file_metrics.phase('parse'):
+            if suffix_of(filename):
+                data = read_data(input_path)
+            elif is_csv(filename):
+                import pandas as pd
+                data = Dataset.from_frame(pd.read_csv(input_path))
             else:
                 logger.warning(f"Unsupported file format: {filename}")
-                return False
-            
-            # Apply transformations
-            transformations = file_config.get('transformations', [])
+                return None
+        
+        file_metrics.read_file(input_path)
+        return data
+    
+    def base_name(self, filename):
+        """Dataset name without stage prefix and extension"""
+        return strip_suffix(filename).replace('validated_', '')
+    
+    def transform_records(self, filename, data):
+        """Apply the configured transformations to in-memory records
+        
+        Returns (transformed_data, report).
+        """
+        file_config = self.get_file_config(filename)
+        dataset = as_dataset(data)
+        data = dataset if dataset is not None else data
+        input_records = len(data) if isinstance(data, Dataset) else 1
+        file_metrics = self.metrics.file(filename)
+        
+        # Apply transformations
+        transformations = file_config.get('transformations', [])
+        with file_metrics.phase('compute'):
             for transformation in transformations:
                 transform_type = transformation.get('type')
                 
@@ -174,35 +227,68 @@ class DataTransformer:
                     data = self.aggregate_data(data, transformation)
                 elif transform_type == 'enrich':
                     data = self.enrich_data(data, transformation)
-            
-            # Save transformed data in multiple formats
-            base_name = filename.replace('validated_', '').replace('.json', '').replace('.csv', '')
-            
-            # JSON format
-            json_output = os.path.join(self.output_dir, f"transformed_{base_name}.json")
-            with open(json_output, 'w') as f:
-                json.dump(data, f, indent=2)
+        
+        file_metrics.records_in += input_records
+        file_metrics.records_out += len(data) if isinstance(data, Dataset) else 1
+        
+        # Create transformation report
+        report = {
+            'file': filename,
+            'input_records': input_records,
+            'output_records': len(data) if isinstance(data, Dataset) else 1,
+            'transformations_applied': len(transformations),
+            'timestamp': datetime.now().isoformat()
+        }
+        
+        return data, report
+    
+    def save_transformed(self, filename, data, report):
+        """Save transformed data in multiple formats together with its report"""
+        base_name = self.base_name(filename)
+        file_metrics = self.metrics.file(filename)
+        
+        with file_metrics.phase('serialise'):
+            # Interchange format (NDJSON by default)
+            records_output = os.path.join(self.output_dir, self.interchange.filename(f"transformed_{base_name}"))
+            self.interchange.write(records_output, data)
+            file_metrics.wrote_file(records_output)
             
             # CSV format
-            if data:
-                df = pd.DataFrame(data)
+            if isinstance(data, Dataset) and len(data):
                 csv_output = os.path.join(self.output_dir, f"transformed_{base_name}.csv")
-                df.to_csv(csv_output, index=False)
+                # Written in batches that fit the memory budget
+                rows = self.budget.frame_batch_rows(data)
+                for i, batch in enumerate(data.batches(rows)):
+                    df = batch.to_frame(iso_datetimes=True)
+                    df.to_csv(csv_output, index=False, mode='w' if i == 0 else 'a', header=i == 0)
+                file_metrics.wrote_file(csv_output)
+        
+        report_path = os.path.join(self.output_dir, f"{base_name}_transformation_report.json")
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    def transform_file(self, filename):
+        """Transform a single data file"""
+        logger.info(f"Transforming file: {filename}")
+        
+        input_path = os.path.join(self.input_dir, filename)
+        
+        if not os.path.exists(input_path):
+            logger.error(f"Input file not found: {input_path}")
+            return False
+        
+        try:
+            # Load data
+            data = self.load_file(filename)
+            if data is None:
+                return False
             
-            logger.info(f"Transformation completed for {filename}")
+            data, report = self.transform_records(filename, data)
             
-            # Create transformation report
-            report = {
-                'file': filename,
-                'input_records': len(data) if isinstance(data, list) else 1,
-                'output_records': len(data) if isinstance(data, list) else 1,
-                'transformations_applied': len(transformations),
-                'timestamp': datetime.now().isoformat()
-            }
+            # Save transformed data in multiple formats
+            self.save_transformed(filename, data, report)
             
-            report_path = os.path.join(self.output_dir, f"{base_name}_transformation_report.json")
-            with open(report_path, 'w') as f:
-                json.dump(report, f, indent=2)
+            logger.info(f"Transformation completed for {filename}")
             
             return True
             
@@ -210,6 +296,24 @@ class DataTransformer:
             logger.error(f"Error transforming {filename}: {str(e)}")
             return False
     
+    def build_summary(self, total_files, success_count):
+        """Build the transformation summary"""
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'total_files': total_files,
+            'successful_transformations': success_count,
+            'status': 'completed' if success_count > 0 else 'failed',
+            'metrics': self.metrics.summary(),
+            'memory': self.budget.summary()
+        }
+    
+    def write_summary(self, summary):
+        """Write the transformation summary that gates the analytics stage"""
+        with open(os.path.join(self.data_dir, 'transformation-summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        
+        self.metrics.write_exposition(self.data_dir)
+    
     def run(self):
         """Execute data transformation process"""
         logger.info("Starting data transformation process")
@@ -220,7 +324,7 @@ class DataTransformer:
         
         # Get all validated data files
         data_files = [f for f in os.listdir(self.input_dir) 
-                     if f.startswith('validated_') and f.endswith(('.json', '.csv'))]
+                     if f.startswith('validated_') and is_data_file(f)]
         
         if not data_files:
             logger.error("No validated data files found for transformation")
@@ -234,15 +338,8 @@ class DataTransformer:
         logger.info(f"Data transformation completed. {success_count}/{len(data_files)} files transformed successfully")
         
         # Create transformation summary
-        summary = {
-            'timestamp': datetime.now().isoformat(),
-            'total_files': len(data_files),
-            'successful_transformations': success_count,
-            'status': 'completed' if success_count > 0 else 'failed'
-        }
-        
-        with open('/data/transformation-summary.json', 'w') as f:
-            json.dump(summary, f, indent=2)
+        summary = self.build_summary(len(data_files), success_count)
+        self.write_summary(summary)
         
         return success_count > 0
 
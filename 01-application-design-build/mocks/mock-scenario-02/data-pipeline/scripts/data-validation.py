@@ -4,25 +4,48 @@ import csv
 import os
 import logging
 from datetime import datetime
-import pandas as pd
-from jsonschema import validate, ValidationError
+from pipeline_metrics import StageMetrics
+from pipeline_dataset import Dataset, MISSING, as_dataset
+from pipeline_memory import MemoryBudget, find_duplicates
+from pipeline_io import Interchange, is_csv, is_data_file, read_data, strip_suffix, suffix_of
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Rough size of a record materialised as a dict, for schema validation
+RECORD_BYTES = 500
+
+# Schema keywords that only constrain the items, so batches can be validated on their own
+ITEM_LEVEL_KEYWORDS = {'type', 'items', '$schema', 'title', 'description'}
+
 class DataValidator:
-    def __init__(self, config_path="/config/validation-config.json"):
+    def __init__(self, config_path="/config/validation-config.json", data_dir="/data"):
         with open(config_path, 'r') as f:
             self.config = json.load(f)
         
-        self.input_dir = "/data/raw"
-        self.output_dir = "/data/validated"
+        self.data_dir = data_dir
+        self.input_dir = os.path.join(data_dir, "raw")
+        self.output_dir = os.path.join(data_dir, "validated")
         os.makedirs(self.output_dir, exist_ok=True)
+        self.metrics = StageMetrics('validation')
+        self.budget = MemoryBudget('validation', data_dir)
+        self.interchange = Interchange()
     
     def validate_json_schema(self, data, schema):
         """Validate JSON data against schema"""
+        # Only files with a schema need jsonschema
+        from jsonschema import validate, ValidationError
         try:
-            validate(instance=data, schema=schema)
+            if not isinstance(data, Dataset):
+                validate(instance=data, schema=schema)
+                return True, []
+            
+            # Records are materialised one batch at a time when they do not fit the budget
+            rows = len(data)
+            if set(schema) <= ITEM_LEVEL_KEYWORDS and not self.budget.fits(len(data) * RECORD_BYTES):
+                rows = self.budget.batch_rows(RECORD_BYTES)
+            for batch in data.batches(rows):
+                validate(instance=batch.to_records(), schema=schema)
             return True, []
         except ValidationError as e:
             return False, [str(e)]
@@ -31,7 +54,7 @@ class DataValidator:
         """Validate data quality based on rules"""
         errors = []
         
-        if not isinstance(data, list):
+        if not isinstance(data, Dataset):
             errors.append("Data must be a list of records")
             return False, errors
         
@@ -46,104 +69,101 @@ class DataValidator:
         
         # Validate individual records
         required_fields = rules.get('required_fields', [])
-        for i, record in enumerate(data[:100]):  # Check first 100 records
+        checked = min(len(data), 100)  # Check first 100 records
+        required_values = {}
+        for field in required_fields:
+            column = data.columns.get(field)
+            required_values[field] = [None] * checked if column is None else column.head(checked)
+        for i in range(checked):
             for field in required_fields:
-                if field not in record or record[field] is None:
+                if required_values[field][i] is None:
                     errors.append(f"Record {i}: Missing required field '{field}'")
         
         # Check for duplicates if specified
         if rules.get('check_duplicates', False):
             unique_field = rules.get('unique_field', 'id')
-            seen_values = set()
-            for i, record in enumerate(data):
-                if unique_field in record:
-                    value = record[unique_field]
-                    if value in seen_values:
-                        errors.append(f"Record {i}: Duplicate value '{value}' for field '{unique_field}'")
-                    seen_values.add(value)
+            column = data.columns.get(unique_field)
+            values = ((i, value) for i, value in enumerate(column if column is not None else []) if value is not MISSING)
+            for i, value in find_duplicates(self.budget, values, len(data)):
+                errors.append(f"Record {i}: Duplicate value '{value}' for field '{unique_field}'")
         
         return len(errors) == 0, errors
     
     def clean_data(self, data, cleaning_rules):
-        """Clean data based on cleaning rules"""
-        if not isinstance(data, list):
+        """Clean data based on cleaning rules, column by column"""
+        if not isinstance(data, Dataset):
             return data
         
-        cleaned_data = []
-        
-        for record in data:
-            cleaned_record = record.copy()
-            
-            # Remove null values if specified
-            if cleaning_rules.get('remove_nulls', False):
-                cleaned_record = {k: v for k, v in cleaned_record.items() if v is not None}
-            
-            # Standardize field names
-            if cleaning_rules.get('standardize_fields', False):
-                standardized = {}
-                for k, v in cleaned_record.items():
-                    new_key = k.lower().replace(' ', '_').replace('-', '_')
-                    standardized[new_key] = v
-                cleaned_record = standardized
-            
-            # Apply field transformations
-            transformations = cleaning_rules.get('transformations', {})
-            for field, transform in transformations.items():
-                if field in cleaned_record:
-                    if transform == 'trim':
-                        if isinstance(cleaned_record[field], str):
-                            cleaned_record[field] = cleaned_record[field].strip()
-                    elif transform == 'uppercase':
-                        if isinstance(cleaned_record[field], str):
-                            cleaned_record[field] = cleaned_record[field].upper()
-                    elif transform == 'lowercase':
-                        if isinstance(cleaned_record[field], str):
-                            cleaned_record[field] = cleaned_record[field].lower()
-            
-            cleaned_data.append(cleaned_record)
-        
-        return cleaned_data
-    
-    def validate_file(self, filename):
-        """Validate a single data file"""
-        logger.info(f"Validating file: {filename}")
+        # Remove null values if specified
+        if cleaning_rules.get('remove_nulls', False):
+            data = Dataset({name: column.without_nulls() for name, column in data.columns.items()}, len(data))
         
-        input_path = os.path.join(self.input_dir, filename)
+        # Standardize field names
+        if cleaning_rules.get('standardize_fields', False):
+            data = data.rename(lambda k: k.lower().replace(' ', '_').replace('-', '_'))
         
-        if not os.path.exists(input_path):
-            logger.error(f"Input file not found: {input_path}")
-            return False
+        # Apply field transformations
+        transformations = cleaning_rules.get('transformations', {})
+        for field, transform in transformations.items():
+            if field in data.columns:
+                if transform == 'trim':
+                    data = data.with_column(field, data.columns[field].map_strings(str.strip))
+                elif transform == 'uppercase':
+                    data = data.with_column(field, data.columns[field].map_strings(str.upper))
+                elif transform == 'lowercase':
+                    data = data.with_column(field, data.columns[field].map_strings(str.lower))
         
-        # Find validation config for this file
-        file_config = None
+        return data
+    
+    def get_file_config(self, filename):
+        """Find validation config for a file"""
         for config in self.config.get('files', []):
             if config['name'] in filename:
-                file_config = config
-                break
+                return config
         
-        if not file_config:
-            logger.warning(f"No validation config found for {filename}, using default")
-            file_config = {'name': filename, 'rules': {}}
+        logger.warning(f"No validation config found for {filename}, using default")
+        return {'name': filename, 'rules': {}}
+    
+    def load_file(self, filename):
+        """Load records of a raw data file, or None if the format is unsupported"""
+        input_path = os.path.join(self.input_dir, filename)
+        file_metrics = self.metrics.file(filename)
         
-        try:
-            # Load data
-            if filename.endswith('.json'):
-                with open(input_path, 'r') as f:
-                    data = json.load(f)
-            elif filename.endswith('.csv'):
-                df = pd.read_csv(input_path)
-                data = df.to_dict('records')
+        with file_metrics.phase('parse'):
+            if suffix_of(filename):
+                data = read_data(input_path, self.get_file_config(filename).get('column_types'))
+            elif is_csv(filename):
+                # pandas decompresses .csv.gz on the fly
+                import pandas as pd
+                data = Dataset.from_frame(pd.read_csv(input_path))
             else:
                 logger.warning(f"Unsupported file format: {filename}")
-                return False
-            
+                return None
+        
+        file_metrics.read_file(input_path)
+        return data
+    
+    def validate_records(self, filename, data):
+        """Validate and clean in-memory records of a file
+        
+        Returns (cleaned_data, report); cleaned_data is None if schema validation failed.
+        """
+        file_config = self.get_file_config(filename)
+        file_metrics = self.metrics.file(filename)
+        
+        # Records handed over in memory are stored column by column as well
+        dataset = as_dataset(data, file_config.get('column_types'))
+        data = dataset if dataset is not None else data
+        file_metrics.records_in += len(data) if isinstance(data, Dataset) else 1
+        
+        with file_metrics.phase('compute'):
             # Validate schema if provided
             schema = file_config.get('schema')
             if schema:
                 is_valid, schema_errors = self.validate_json_schema(data, schema)
                 if not is_valid:
                     logger.error(f"Schema validation failed for {filename}: {schema_errors}")
-                    return False
+                    return None, None
             
             # Validate data quality
             rules = file_config.get('rules', {})
@@ -154,40 +174,97 @@ class DataValidator:
             # Clean data
             cleaning_rules = file_config.get('cleaning', {})
             cleaned_data = self.clean_data(data, cleaning_rules)
+        
+        file_metrics.records_out += len(cleaned_data) if isinstance(cleaned_data, Dataset) else 1
+        
+        # Create validation report
+        report = {
+            'file': filename,
+            'original_records': len(data) if isinstance(data, Dataset) else 1,
+            'validated_records': len(cleaned_data) if isinstance(cleaned_data, Dataset) else 1,
+            'schema_valid': schema is None or is_valid,
+            'quality_errors': quality_errors,
+            'timestamp': datetime.now().isoformat()
+        }
+        
+        return cleaned_data, report
+    
+    def save_validated(self, filename, cleaned_data, report):
+        """Save validated and cleaned data together with its report"""
+        if is_csv(filename):
+            output_filename = f"validated_{strip_suffix(filename)}.csv"
+        else:
+            output_filename = f"validated_{self.interchange.filename(strip_suffix(filename))}"
+        output_path = os.path.join(self.output_dir, output_filename)
+        file_metrics = self.metrics.file(filename)
+        
+        with file_metrics.phase('serialise'):
+            if suffix_of(filename):
+                self.interchange.write(output_path, cleaned_data)
+            elif is_csv(filename):
+                # Written in batches that fit the memory budget
+                rows = self.budget.frame_batch_rows(cleaned_data)
+                for i, batch in enumerate(cleaned_data.batches(rows)):
+                    df = batch.to_frame(iso_datetimes=True)
+                    df.to_csv(output_path, index=False, mode='w' if i == 0 else 'a', header=i == 0)
+        
+        file_metrics.wrote_file(output_path)
+        
+        report_path = os.path.join(self.output_dir, f"{filename}_validation_report.json")
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        
+        return output_filename
+    
+    def validate_file(self, filename):
+        """Validate a single data file"""
+        logger.info(f"Validating file: {filename}")
+        
+        input_path = os.path.join(self.input_dir, filename)
+        
+        if not os.path.exists(input_path):
+            logger.error(f"Input file not found: {input_path}")
+            return False
+        
+        try:
+            # Load data
+            data = self.load_file(filename)
+            if data is None:
+                return False
             
-            # Save validated and cleaned data
-            output_filename = f"validated_{filename}"
-            output_path = os.path.join(self.output_dir, output_filename)
+            cleaned_data, report = self.validate_records(filename, data)
+            if cleaned_data is None:
+                return False
             
-            if filename.endswith('.json'):
-                with open(output_path, 'w') as f:
-                    json.dump(cleaned_data, f, indent=2)
-            elif filename.endswith('.csv'):
-                df = pd.DataFrame(cleaned_data)
-                df.to_csv(output_path, index=False)
+            # Save validated and cleaned data
+            output_filename = self.save_validated(filename, cleaned_data, report)
             
             logger.info(f"Validation completed for {filename} -> {output_filename}")
             
-            # Create validation report
-            report = {
-                'file': filename,
-                'original_records': len(data) if isinstance(data, list) else 1,
-                'validated_records': len(cleaned_data) if isinstance(cleaned_data, list) else 1,
-                'schema_valid': schema is None or is_valid,
-                'quality_errors': quality_errors,
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            report_path = os.path.join(self.output_dir, f"{filename}_validation_report.json")
-            with open(report_path, 'w') as f:
-                json.dump(report, f, indent=2)
-            
             return True
             
         except Exception as e:
             logger.error(f"Error validating {filename}: {str(e)}")
             return False
     
+    def build_summary(self, total_files, success_count):
+        """Build the validation summary"""
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'total_files': total_files,
+            'successful_validations': success_count,
+            'status': 'completed' if success_count > 0 else 'failed',
+            'metrics': self.metrics.summary(),
+            'memory': self.budget.summary()
+        }
+    
+    def write_summary(self, summary):
+        """Write the validation summary that gates the transformation stage"""
+        with open(os.path.join(self.data_dir, 'validation-summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        
+        self.metrics.write_exposition(self.data_dir)
+    
     def run(self):
         """Execute data validation process"""
         logger.info("Starting data validation process")
@@ -198,7 +275,7 @@ class DataValidator:
         
         # Get all data files
         data_files = [f for f in os.listdir(self.input_dir) 
-                     if f.endswith(('.json', '.csv')) and not f.endswith('_metadata.json')]
+                     if is_data_file(f) and not f.endswith('_metadata.json')]
         
         if not data_files:
             logger.error("No data files found for validation")
@@ -212,15 +289,8 @@ class DataValidator:
         logger.info(f"Data validation completed. {success_count}/{len(data_files)} files validated successfully")
         
         # Create validation summary
-        summary = {
-            'timestamp': datetime.now().isoformat(),
-            'total_files': len(data_files),
-            'successful_validations': success_count,
-            'status': 'completed' if success_count > 0 else 'failed'
-        }
-        
-        with open('/data/validation-summary.json', 'w') as f:
-            json.dump(summary, f, indent=2)
+        summary = self.build_summary(len(data_files), success_count)
+        self.write_summary(summary)
         
         return success_count > 0
 
@@ -0,0 +1,626 @@
+#!/usr/bin/env python3
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+import queue
+import threading
+import logging
+import hashlib
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pipeline_io import is_data_file
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Stage scripts keep their hyphenated names so the per-stage Jobs keep working
+STAGE_SCRIPTS = {
+    'ingestion': ('data-ingestion.py', 'DataIngestion'),
+    'validation': ('data-validation.py', 'DataValidator'),
+    'transformation': ('data-transformation.py', 'DataTransformer'),
+    'analytics': ('analytics-processor.py', 'AnalyticsProcessor')
+}
+
+# Analytics reports (AnalyticsProcessor.generate_<report>) and the datasets they read
+ANALYTICS_INPUTS = {
+    'user_analytics': ['users'],
+    'transaction_analytics': ['transactions']
+}
+
+# Default thread pool size per stage in pipelined mode
+DEFAULT_STAGE_WORKERS = {
+    'ingestion': 4,
+    'validation': 2,
+    'transformation': 2,
+    'analytics': 2
+}
+
+def load_stage_module(stage):
+    """Import a stage script as a module"""
+    script, _ = STAGE_SCRIPTS[stage]
+    module_name = script[:-len('.py')].replace('-', '_')
+    
+    module = sys.modules.get(module_name)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(SCRIPTS_DIR, script))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    
+    return module
+
+def load_stage_class(stage):
+    """Import a stage class from its script file"""
+    return getattr(load_stage_module(stage), STAGE_SCRIPTS[stage][1])
+
+class PipelineRunner:
+    def __init__(self, config_dir="/config", data_dir="/data", checkpoint=False):
+        self.data_dir = data_dir
+        self.checkpoint = checkpoint
+        
+        self.ingestion = load_stage_class('ingestion')(
+            os.path.join(config_dir, 'ingestion-config.json'), data_dir=data_dir)
+        self.validator = load_stage_class('validation')(
+            os.path.join(config_dir, 'validation-config.json'), data_dir=data_dir)
+        self.transformer = load_stage_class('transformation')(
+            os.path.join(config_dir, 'transformation-config.json'), data_dir=data_dir)
+        self.analytics = load_stage_class('analytics')(data_dir=data_dir)
+        
+        # Transformed tables handed to analytics, keyed by dataset name
+        self.datasets = {}
+        self.lock = threading.Lock()
+        self.counts = {
+            'sources': 0, 'ingested': 0,
+            'validation_files': 0, 'validated': 0,
+            'transformation_files': 0, 'transformed': 0
+        }
+    
+    def count(self, key):
+        """Bump a stage counter; stages may run on several threads"""
+        with self.lock:
+            self.counts[key] += 1
+    
+    def ingest_step(self, source):
+        """Ingest one source in memory, returns (filename, data) or (None, None)"""
+        source_name = source.get('name', 'unknown')
+        self.count('sources')
+        
+        try:
+            filename, data = self.ingestion.ingest_source(source, save=self.checkpoint)
+        except Exception as e:
+            logger.error(f"Error processing source {source_name}: {str(e)}")
+            return None, None
+        
+        if filename is None:
+            return None, None
+        self.count('ingested')
+        
+        if not is_data_file(filename):
+            logger.warning(f"Unsupported file format for in-process validation: {filename}")
+            return None, None
+        
+        return filename, data
+    
+    def validate_step(self, filename, data):
+        """Validate and clean ingested records, returns (validated_filename, data) or (None, None)"""
+        self.count('validation_files')
+        try:
+            cleaned_data, report = self.validator.validate_records(filename, data)
+            if cleaned_data is None:
+                return None, None
+            if self.checkpoint:
+                self.validator.save_validated(filename, cleaned_data, report)
+        except Exception as e:
+            logger.error(f"Error validating {filename}: {str(e)}")
+            return None, None
+        
+        self.count('validated')
+        return f"validated_{filename}", cleaned_data
+    
+    def transform_step(self, validated_filename, data):
+        """Transform validated records and publish them for analytics"""
+        self.count('transformation_files')
+        try:
+            transformed_data, report = self.transformer.transform_records(validated_filename, data)
+            if self.checkpoint:
+                self.transformer.save_transformed(validated_filename, transformed_data, report)
+        except Exception as e:
+            logger.error(f"Error transforming {validated_filename}: {str(e)}")
+            return False
+        
+        self.count('transformed')
+        with self.lock:
+            self.datasets[self.transformer.base_name(validated_filename)] = transformed_data
+        
+        logger.info(f"Dataset {self.transformer.base_name(validated_filename)} ready for analytics "
+                    f"({len(transformed_data)} records)")
+        return True
+    
+    def run_source(self, source):
+        """Carry one source through ingestion, validation and transformation in memory"""
+        filename, data = self.ingest_step(source)
+        if filename is None:
+            return False
+        
+        validated_filename, data = self.validate_step(filename, data)
+        if validated_filename is None:
+            return False
+        
+        return self.transform_step(validated_filename, data)
+    
+    def stage_summaries(self):
+        """Build the per-stage summaries the standalone Jobs would have written"""
+        return {
+            'ingestion': self.ingestion.build_summary(self.counts['sources'], self.counts['ingested']),
+            'validation': self.validator.build_summary(self.counts['validation_files'], self.counts['validated']),
+            'transformation': self.transformer.build_summary(
+                self.counts['transformation_files'], self.counts['transformed'])
+        }
+    
+    def write_stage_summaries(self):
+        """Write the per-stage summary files and return them"""
+        summaries = self.stage_summaries()
+        self.ingestion.write_summary(summaries['ingestion'])
+        self.validator.write_summary(summaries['validation'])
+        self.transformer.write_summary(summaries['transformation'])
+        return summaries
+    
+    def run_report(self, report):
+        """Run one analytics report on its in-memory inputs"""
+        inputs = [self.datasets[name] for name in ANALYTICS_INPUTS[report]]
+        generate = getattr(self.analytics, f"generate_{report}")
+        return generate(*inputs)
+    
+    def run_analytics(self, stage_summaries):
+        """Run analytics on the in-memory transformed tables"""
+        success_count = 0
+        
+        for report, inputs in ANALYTICS_INPUTS.items():
+            if all(name in self.datasets for name in inputs) and self.run_report(report):
+                success_count += 1
+        
+        if self.analytics.generate_summary_report(stage_summaries):
+            success_count += 1
+        
+        logger.info(f"Analytics processing completed. {success_count} reports generated")
+        return success_count > 0
+    
+    def run(self):
+        """Execute the whole pipeline in this process"""
+        logger.info(f"Starting in-process pipeline (checkpoints {'enabled' if self.checkpoint else 'disabled'})")
+        
+        for source in self.ingestion.config.get('sources', []):
+            self.run_source(source)
+        
+        summaries = self.write_stage_summaries()
+        
+        if self.counts['transformed'] == 0:
+            logger.error("No source made it through transformation, skipping analytics")
+            return False
+        
+        return self.run_analytics(summaries)
+
+class PipelineScheduler:
+    """Per-file DAG execution on top of a PipelineRunner
+    
+    Every source moves ingest -> validate -> transform as soon as its previous
+    step is done, with a bounded thread pool per stage, and each analytics
+    report starts as soon as the datasets it declares in ANALYTICS_INPUTS are complete.
+    """
+    
+    def __init__(self, runner, workers=None):
+        self.runner = runner
+        self.workers = dict(DEFAULT_STAGE_WORKERS, **(workers or {}))
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.finished = {}  # dataset name -> True if it made it through transformation
+        self.report_futures = {}
+        self.pending_sources = 0
+        self.sources_done = threading.Event()
+    
+    def submit(self, stage, fn, *args):
+        """Run fn on the stage pool"""
+        return self.pools[stage].submit(fn, *args)
+    
+    def submit_step(self, stage, dataset, fn, *args):
+        """Run a per-source step; an unexpected error finishes the source as failed"""
+        def step():
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(f"{stage} of {dataset} failed: {str(e)}")
+                self.source_finished(dataset, False)
+        
+        return self.submit(stage, step)
+    
+    def ingest(self, source):
+        source_name = source.get('name', 'unknown')
+        filename, data = self.runner.ingest_step(source)
+        if filename is None:
+            self.source_finished(source_name, False)
+        else:
+            self.submit_step('validation', source_name, self.validate, source_name, filename, data)
+    
+    def validate(self, dataset, filename, data):
+        validated_filename, data = self.runner.validate_step(filename, data)
+        if validated_filename is None:
+            self.source_finished(dataset, False)
+        else:
+            self.submit_step('transformation', dataset, self.transform, dataset, validated_filename, data)
+    
+    def transform(self, dataset, validated_filename, data):
+        self.source_finished(dataset, self.runner.transform_step(validated_filename, data))
+    
+    def source_finished(self, dataset, success):
+        """Record a finished source and start every report whose inputs are now complete"""
+        with self.lock:
+            self.finished[dataset] = success
+            ready = [report for report, inputs in ANALYTICS_INPUTS.items()
+                     if report not in self.report_futures
+                     and all(self.finished.get(name) for name in inputs)]
+            for report in ready:
+                logger.info(f"Inputs of {report} complete, starting it")
+                self.report_futures[report] = self.submit('analytics', self.runner.run_report, report)
+            
+            self.pending_sources -= 1
+            if self.pending_sources == 0:
+                self.sources_done.set()
+    
+    def run(self):
+        """Execute the pipeline as a per-file DAG"""
+        sources = self.runner.ingestion.config.get('sources', [])
+        logger.info(f"Starting pipelined execution of {len(sources)} sources with workers {self.workers}")
+        
+        self.pools = {stage: ThreadPoolExecutor(max_workers=count, thread_name_prefix=stage)
+                      for stage, count in self.workers.items()}
+        try:
+            self.pending_sources = len(sources)
+            if not sources:
+                self.sources_done.set()
+            for source in sources:
+                self.submit_step('ingestion', source.get('name', 'unknown'), self.ingest, source)
+            
+            self.sources_done.wait()
+            summaries = self.runner.write_stage_summaries()
+            
+            success_count = 0
+            for report, future in self.report_futures.items():
+                if future.exception() is not None:
+                    logger.error(f"Error generating {report}: {str(future.exception())}")
+                elif future.result():
+                    success_count += 1
+            
+            if self.runner.counts['transformed'] == 0:
+                logger.error("No source made it through transformation, skipping analytics")
+                return False
+            
+            if self.runner.analytics.generate_summary_report(summaries):
+                success_count += 1
+            
+            logger.info(f"Analytics processing completed. {success_count} reports generated")
+            return success_count > 0
+        
+        finally:
+            for pool in self.pools.values():
+                pool.shutdown(wait=True)
+
+class MicroBatchPipeline:
+    """Long-running micro-batch mode on top of a PipelineRunner
+    
+    Sources are polled every poll_interval seconds (and batches can be pushed
+    with POST /sources/<name> on listen_port). Only records whose unique
+    field was not seen before are queued; they flow through validation,
+    transformation and IncrementalAnalytics in batches of batch_size, so
+    history is never recomputed.
+    
+    A key counts as seen once its batch succeeded, so the records of a
+    failed batch are queued again by the next poll. Records without the
+    unique field are keyed by a hash of their content. The seen_keys most
+    recently seen keys of each source are remembered: a poll returning
+    more records than that is refused, since forgotten keys would be
+    counted again on every poll.
+    """
+    
+    def __init__(self, runner, poll_interval=60, batch_size=500, listen_port=0, snapshot_interval=5, seen_keys=100000):
+        self.runner = runner
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.listen_port = listen_port
+        self.snapshot_interval = snapshot_interval
+        self.seen_keys = seen_keys
+        self.running = True
+        
+        self.batches = queue.Queue()
+        # Keys of processed records, least recently seen first, and of queued ones
+        self.seen = defaultdict(OrderedDict)
+        self.queued = defaultdict(set)
+        self.seen_lock = threading.Lock()
+        
+        group_by = ['user_id']
+        for transformation in runner.transformer.get_file_config('validated_transactions.json').get('transformations', []):
+            if transformation.get('type') == 'aggregate':
+                group_by = transformation.get('group_by', group_by)
+        self.analytics = load_stage_module('analytics').IncrementalAnalytics(group_by)
+        self.last_snapshot = 0
+        
+        self.metrics = {
+            'batches': 0,
+            'failed_batches': 0,
+            'records_in': 0,
+            'records_out': 0,
+            'recent_batches': deque(maxlen=100)
+        }
+    
+    def unique_field(self, filename):
+        return self.runner.validator.get_file_config(filename).get('rules', {}).get('unique_field', 'id')
+    
+    def record_key(self, record, unique_field):
+        """Unique field value of a record, or a hash of its content when it has none"""
+        key = record.get(unique_field) if isinstance(record, dict) else None
+        if key is not None:
+            return key
+        content = json.dumps(record, sort_keys=True, default=str).encode()
+        return ('content', hashlib.blake2b(content, digest_size=16).hexdigest())
+    
+    def new_records(self, filename, records):
+        """Drop records that were already processed or are queued"""
+        unique_field = self.unique_field(filename)
+        fresh = []
+        with self.seen_lock:
+            seen, queued = self.seen[filename], self.queued[filename]
+            for record in records:
+                key = self.record_key(record, unique_field)
+                if key in seen:
+                    # Still in the source: forgetting it would count it again
+                    seen.move_to_end(key)
+                elif key not in queued:
+                    queued.add(key)
+                    fresh.append(record)
+        return fresh
+    
+    def batch_done(self, filename, records, success):
+        """Mark the keys of a processed batch as seen, or let them be queued again if it failed"""
+        unique_field = self.unique_field(filename)
+        keys = [self.record_key(record, unique_field) for record in records]
+        with self.seen_lock:
+            seen, queued = self.seen[filename], self.queued[filename]
+            queued.difference_update(keys)
+            if success:
+                for key in keys:
+                    seen[key] = True
+                    seen.move_to_end(key)
+                if len(seen) > self.seen_keys:
+                    logger.warning(f"Forgetting {len(seen) - self.seen_keys} keys of {filename}, "
+                                   f"more than --seen-keys {self.seen_keys}: they would be counted again if seen again")
+                while len(seen) > self.seen_keys:
+                    seen.popitem(last=False)
+    
+    def enqueue(self, filename, records, received_at=None):
+        """Queue new records of a source as micro-batches"""
+        received_at = received_at or time.time()
+        records = self.new_records(filename, records)
+        for start in range(0, len(records), self.batch_size):
+            self.batches.put((filename, records[start:start + self.batch_size], received_at))
+        return len(records)
+    
+    def poll_once(self):
+        """Poll every configured source once and queue what is new"""
+        for source in self.runner.ingestion.config.get('sources', []):
+            try:
+                filename, data = self.runner.ingestion.ingest_source(source, save=False)
+                if not filename or not isinstance(data, list):
+                    continue
+                if len(data) > self.seen_keys:
+                    logger.error(f"Source {source.get('name', 'unknown')} returned {len(data)} records, more than "
+                                 f"--seen-keys {self.seen_keys} remembered: not queued, raise --seen-keys")
+                    continue
+                queued = self.enqueue(filename, data)
+                if queued:
+                    logger.info(f"Queued {queued} new records from {source.get('name', 'unknown')}")
+            except Exception as e:
+                logger.error(f"Error polling source {source.get('name', 'unknown')}: {str(e)}")
+    
+    def poll_sources(self):
+        """Poll the sources every poll_interval seconds"""
+        while self.running:
+            self.poll_once()
+            time.sleep(self.poll_interval)
+    
+    def serve_pushes(self):
+        """Accept pushed batches (JSON array or NDJSON) on POST /sources/<name>"""
+        pipeline = self
+        
+        class PushHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                parts = self.path.strip('/').split('/')
+                if len(parts) != 2 or parts[0] != 'sources':
+                    self.send_error(404, "Use POST /sources/<name>")
+                    return
+                
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                try:
+                    records = json.loads(body)
+                    if isinstance(records, dict):
+                        records = [records]
+                except json.JSONDecodeError:
+                    try:
+                        records = [json.loads(line) for line in body.splitlines() if line.strip()]
+                    except json.JSONDecodeError as e:
+                        self.send_error(400, f"Invalid JSON: {str(e)}")
+                        return
+                
+                if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+                    self.send_error(400, "Expected a JSON object, an array of objects or NDJSON objects")
+                    return
+                
+                queued = pipeline.enqueue(f"{parts[1]}.json", records)
+                payload = json.dumps({'received': len(records), 'queued': queued}).encode()
+                self.send_response(202)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+        
+        server = ThreadingHTTPServer(('127.0.0.1', self.listen_port), PushHandler)
+        logger.info(f"Accepting pushed batches on 127.0.0.1:{self.listen_port}")
+        server.serve_forever()
+    
+    def process_batch(self, filename, records, received_at):
+        """Run one micro-batch through validation, transformation and analytics"""
+        started = time.time()
+        
+        cleaned_data, _ = self.runner.validator.validate_records(filename, records)
+        if cleaned_data is None:
+            self.metrics['failed_batches'] += 1
+            return False
+        
+        validated_filename = f"validated_{filename}"
+        transformed_data, _ = self.runner.transformer.transform_records(validated_filename, cleaned_data)
+        
+        dataset = self.runner.transformer.base_name(validated_filename)
+        if dataset == 'users':
+            self.analytics.add_users(transformed_data)
+        elif dataset == 'transactions':
+            self.analytics.add_transactions(transformed_data)
+        
+        finished = time.time()
+        processing_time = finished - started
+        self.metrics['batches'] += 1
+        self.metrics['records_in'] += len(records)
+        self.metrics['records_out'] += len(transformed_data)
+        self.metrics['recent_batches'].append({
+            'dataset': dataset,
+            'records': len(records),
+            'output_records': len(transformed_data),
+            'latency_ms': round((finished - received_at) * 1000, 2),
+            'processing_ms': round(processing_time * 1000, 2),
+            'records_per_second': round(len(records) / processing_time, 1) if processing_time > 0 else None,
+            'timestamp': datetime.now().isoformat()
+        })
+        return True
+    
+    def write_snapshots(self):
+        """Write the current analytics and batch metrics"""
+        self.runner.analytics.write_report("user_analytics.json", self.analytics.user_analytics())
+        self.runner.analytics.write_report("transaction_analytics.json", self.analytics.transaction_analytics())
+        
+        recent = list(self.metrics['recent_batches'])
+        latencies = sorted(batch['latency_ms'] for batch in recent)
+        stream_metrics = {
+            'timestamp': datetime.now().isoformat(),
+            'batches': self.metrics['batches'],
+            'failed_batches': self.metrics['failed_batches'],
+            'records_in': self.metrics['records_in'],
+            'records_out': self.metrics['records_out'],
+            'queued_batches': self.batches.qsize(),
+            'latency_ms_p50': latencies[len(latencies) // 2] if latencies else None,
+            'latency_ms_max': latencies[-1] if latencies else None,
+            'recent_batches': recent
+        }
+        self.runner.analytics.write_report("stream_metrics.json", stream_metrics)
+        self.last_snapshot = time.time()
+    
+    def run_batch(self, filename, records, received_at):
+        """Process a queued micro-batch and record its keys as seen if it succeeded"""
+        success = False
+        try:
+            success = self.process_batch(filename, records, received_at)
+        except Exception as e:
+            self.metrics['failed_batches'] += 1
+            logger.error(f"Error processing batch of {filename}: {str(e)}")
+        self.batch_done(filename, records, success)
+    
+    def process_batches(self):
+        """Drain queued micro-batches"""
+        while self.running:
+            try:
+                filename, records, received_at = self.batches.get(timeout=1)
+            except queue.Empty:
+                continue
+            
+            self.run_batch(filename, records, received_at)
+            
+            if self.batches.empty() or time.time() - self.last_snapshot >= self.snapshot_interval:
+                self.write_snapshots()
+    
+    def run(self):
+        """Start polling, push endpoint and batch processing"""
+        logger.info(f"Starting micro-batch pipeline (poll every {self.poll_interval}s, batch size {self.batch_size})")
+        
+        threads = [
+            threading.Thread(target=self.poll_sources, daemon=True),
+            threading.Thread(target=self.process_batches, daemon=True)
+        ]
+        if self.listen_port:
+            threads.append(threading.Thread(target=self.serve_pushes, daemon=True))
+        
+        for thread in threads:
+            thread.start()
+        
+        # Keep main thread alive
+        try:
+            while self.running:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            logger.info("Received shutdown signal")
+        finally:
+            self.running = False
+            logger.info("Micro-batch pipeline shutting down")
+        
+        return True
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the data pipeline stages in a single process")
+    parser.add_argument('--config-dir', default=os.environ.get('PIPELINE_CONFIG_DIR', '/config'),
+                        help="Directory holding the ingestion, validation and transformation configs")
+    parser.add_argument('--data-dir', default=os.environ.get('PIPELINE_DATA_DIR', '/data'),
+                        help="Root of the raw/validated/transformed/analytics zones")
+    parser.add_argument('--checkpoint', action='store_true',
+                        default=os.environ.get('PIPELINE_CHECKPOINTS', '').lower() in ('1', 'true', 'yes'),
+                        help="Also write raw, validated and transformed files as checkpoints")
+    parser.add_argument('--pipelined', action='store_true',
+                        default=os.environ.get('PIPELINE_MODE', '') == 'pipelined',
+                        help="Let each source flow through the stages as soon as it is ready")
+    for stage, count in DEFAULT_STAGE_WORKERS.items():
+        parser.add_argument(f'--{stage}-workers', type=int,
+                            default=int(os.environ.get(f'PIPELINE_{stage.upper()}_WORKERS', count)),
+                            help=f"Thread pool size of the {stage} stage in pipelined mode")
+    parser.add_argument('--watch', action='store_true',
+                        default=os.environ.get('PIPELINE_MODE', '') == 'watch',
+                        help="Keep running and process new source records in micro-batches")
+    parser.add_argument('--poll-interval', type=float,
+                        default=float(os.environ.get('PIPELINE_POLL_INTERVAL', 60)),
+                        help="Seconds between source polls in watch mode")
+    parser.add_argument('--batch-size', type=int,
+                        default=int(os.environ.get('PIPELINE_BATCH_SIZE', 500)),
+                        help="Records per micro-batch in watch mode")
+    parser.add_argument('--listen-port', type=int,
+                        default=int(os.environ.get('PIPELINE_LISTEN_PORT', 0)),
+                        help="Local port accepting pushed batches in watch mode (0 disables it)")
+    parser.add_argument('--seen-keys', type=int,
+                        default=int(os.environ.get('PIPELINE_SEEN_KEYS', 100000)),
+                        help="Processed record keys remembered per source in watch mode")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    runner = PipelineRunner(config_dir=args.config_dir, data_dir=args.data_dir, checkpoint=args.checkpoint)
+    if args.watch:
+        success = MicroBatchPipeline(runner, poll_interval=args.poll_interval, batch_size=args.batch_size,
+                                     listen_port=args.listen_port, seen_keys=args.seen_keys).run()
+    elif args.pipelined:
+        workers = {stage: getattr(args, f'{stage}_workers') for stage in DEFAULT_STAGE_WORKERS}
+        success = PipelineScheduler(runner, workers).run()
+    else:
+        success = runner.run()
+    exit(0 if success else 1)
\ No newline at end of file
@@ -0,0 +1,564 @@
+"""Typed, column-oriented datasets shared by the pipeline stages
+
+A Dataset keeps every field of a list of records as one typed column instead
+of one dict per record: numbers in narrow array.array buffers, low-cardinality
+strings as categoricals, other strings in a single UTF-8 buffer with offsets
+and ISO datetimes parsed once into microseconds since the epoch.
+"""
+import sys
+import json
+import array
+import itertools
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Column kinds, also accepted in the column_types of a file config
+INT = 'int'
+FLOAT = 'float'
+BOOL = 'bool'
+STRING = 'string'
+CATEGORY = 'category'
+DATETIME = 'datetime'
+OBJECT = 'object'
+KINDS = (INT, FLOAT, BOOL, STRING, CATEGORY, DATETIME, OBJECT)
+
+# Validity of a row in a column
+VALID = 0
+NULL = 1
+ABSENT = 2
+
+# Strings stay categorical until they have more than this many distinct
+# values and more distinct values than half the rows
+CATEGORY_MIN_DISTINCT = 256
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+SIGNED_TYPECODES = [('b', 2**7), ('h', 2**15), ('i', 2**31), ('q', 2**63)]
+UNSIGNED_TYPECODES = [('B', 2**8), ('H', 2**16), ('I', 2**32), ('Q', 2**64)]
+
+class _Missing:
+    """Value of a row that does not have the field at all"""
+    
+    def __repr__(self):
+        return '<missing>'
+
+MISSING = _Missing()
+
+def narrow_array(values, unsigned=False):
+    """Smallest array.array that holds a sequence of ints"""
+    typecodes = UNSIGNED_TYPECODES if unsigned else SIGNED_TYPECODES
+    low, high = (min(values), max(values)) if len(values) else (0, 0)
+    for typecode, limit in typecodes:
+        if (0 if unsigned else -limit) <= low and high < limit:
+            return values if getattr(values, 'typecode', None) == typecode else array.array(typecode, values)
+    return array.array(typecodes[-1][0], values)
+
+def parse_datetime(value, strict=True):
+    """Microseconds since the epoch of a naive ISO datetime, or None
+    
+    With strict, only strings that isoformat() reproduces exactly are
+    accepted, so inferred datetime columns write back the same text.
+    """
+    if len(value) < 10 or value[4] != '-' or value[7] != '-':
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None or (strict and parsed.isoformat() != value):
+        return None
+    return (parsed - EPOCH) // MICROSECOND
+
+def format_datetime(micros):
+    return (EPOCH + timedelta(microseconds=micros)).isoformat()
+
+class Column:
+    """Typed storage of one field"""
+    
+    def __init__(self, kind, values, validity=None, categories=None, data=None):
+        self.kind = kind
+        self.values = values            # array.array, or a list for OBJECT; offsets for STRING
+        self.validity = validity        # bytearray of VALID/NULL/ABSENT, None when all valid
+        self.categories = categories    # CATEGORY only
+        self.data = data                # STRING only, UTF-8 bytes
+    
+    @classmethod
+    def from_values(cls, values, kind=None):
+        """Build a column from Python values (None is null, MISSING is absent)"""
+        builder = ColumnBuilder(kind)
+        for value in values:
+            builder.append(value)
+        return builder.finish()
+    
+    @classmethod
+    def repeat(cls, value, length):
+        """Column holding the same value in every row"""
+        if isinstance(value, str):
+            return cls(CATEGORY, array.array('B', bytes(length)), categories=[value])
+        return cls.from_values([value] * length)
+    
+    def __len__(self):
+        return len(self.values) - 1 if self.kind == STRING else len(self.values)
+    
+    def decoded(self):
+        """Python values of all rows, ignoring validity"""
+        if self.kind in (INT, FLOAT, OBJECT):
+            return self.values
+        if self.kind == BOOL:
+            return map(bool, self.values)
+        if self.kind == CATEGORY:
+            categories = self.categories
+            return (categories[code] for code in self.values)
+        if self.kind == DATETIME:
+            return map(format_datetime, self.values)
+        data, offsets = self.data, self.values
+        return (data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1))
+    
+    def __iter__(self):
+        """Python values of all rows, None for nulls and MISSING for absent rows"""
+        if self.validity is None:
+            yield from self.decoded()
+            return
+        for value, flag in zip(self.decoded(), self.validity):
+            yield value if flag == VALID else (None if flag == NULL else MISSING)
+    
+    def to_list(self):
+        """Python values with None for both null and absent rows"""
+        return [None if value is MISSING else value for value in self]
+    
+    def head(self, rows):
+        """to_list() of the first rows only, without decoding the others"""
+        return [None if value is MISSING else value for value in itertools.islice(self, rows)]
+    
+    def mask(self):
+        """Numpy boolean array of the rows without a value"""
+        import numpy as np
+        return np.frombuffer(self.validity, dtype=np.uint8) != VALID
+    
+    @property
+    def nbytes(self):
+        if self.kind == OBJECT:
+            size = sys.getsizeof(self.values) + sum(sys.getsizeof(value) for value in self.values)
+        else:
+            size = len(self.values) * self.values.itemsize
+        if self.categories is not None:
+            size += sys.getsizeof(self.categories) + sum(sys.getsizeof(value) for value in self.categories)
+        if self.data is not None:
+            size += len(self.data)
+        if self.validity is not None:
+            size += len(self.validity)
+        return size
+    
+    def take(self, indices):
+        """Column of the rows at the given positions (a numpy integer array)"""
+        import numpy as np
+        validity = None
+        if self.validity is not None:
+            validity = bytearray(np.frombuffer(self.validity, dtype=np.uint8)[indices].tobytes())
+            if not any(validity):
+                validity = None
+        
+        if self.kind == OBJECT:
+            return Column(OBJECT, [self.values[i] for i in indices.tolist()], validity)
+        
+        if self.kind == STRING:
+            offsets = np.frombuffer(self.values, dtype=self.values.typecode)
+            starts, ends = offsets[indices].tolist(), offsets[indices + 1].tolist()
+            data = b''.join(self.data[start:end] for start, end in zip(starts, ends))
+            new_offsets = array.array(self.values.typecode, [0])
+            new_offsets.extend(np.cumsum(offsets[indices + 1] - offsets[indices]).tolist())
+            return Column(STRING, new_offsets, validity, data=data)
+        
+        values = array.array(self.values.typecode)
+        values.frombytes(np.frombuffer(self.values, dtype=self.values.typecode)[indices].tobytes())
+        return Column(self.kind, values, validity, categories=self.categories)
+    
+    def map_strings(self, function):
+        """Column with function applied to every string value"""
+        if self.kind == CATEGORY:
+            # Categories that collapse into the same value are merged
+            lookup, categories, remap = {}, [], []
+            for category in self.categories:
+                mapped = function(category)
+                if mapped not in lookup:
+                    lookup[mapped] = len(categories)
+                    categories.append(mapped)
+                remap.append(lookup[mapped])
+            if len(categories) == len(self.categories):
+                return Column(CATEGORY, self.values, self.validity, categories=categories)
+            return Column(CATEGORY, narrow_array([remap[code] for code in self.values], unsigned=True),
+                          self.validity, categories=categories)
+        
+        if self.kind in (STRING, OBJECT):
+            return Column.from_values(function(value) if isinstance(value, str) else value for value in self)
+        
+        return self
+    
+    def without_nulls(self):
+        """Column where null rows are absent"""
+        if self.validity is None or NULL not in self.validity:
+            return self
+        validity = self.validity.replace(bytes([NULL]), bytes([ABSENT]))
+        return Column(self.kind, self.values, validity, self.categories, self.data)
+    
+    def to_series(self, iso_datetimes=False):
+        """Pandas Series with the narrowest matching dtype"""
+        import numpy as np
+        import pandas as pd
+        
+        if self.kind in (INT, FLOAT):
+            values = np.frombuffer(self.values, dtype=self.values.typecode)
+            if self.validity is None:
+                return pd.Series(values)
+            # Like pandas on records: ints with gaps become floats with NaN
+            values = values.astype(np.float64)
+            values[self.mask()] = np.nan
+            return pd.Series(values)
+        
+        if self.kind == BOOL and self.validity is None:
+            return pd.Series(np.frombuffer(self.values, dtype=np.int8).astype(bool))
+        
+        if self.kind == CATEGORY:
+            codes = np.frombuffer(self.values, dtype=self.values.typecode).astype(np.int32)
+            if self.validity is not None:
+                codes[self.mask()] = -1
+            return pd.Series(pd.Categorical.from_codes(codes, categories=self.categories))
+        
+        if self.kind == DATETIME and not iso_datetimes:
+            values = np.frombuffer(self.values, dtype=np.int64).copy()
+            if self.validity is not None:
+                values[self.mask()] = np.iinfo(np.int64).min
+            return pd.Series(values.view('datetime64[us]'))
+        
+        return pd.Series(self.to_list(), dtype=object)
+    
+    @classmethod
+    def from_series(cls, series):
+        """Column from a pandas Series"""
+        import numpy as np
+        import pandas as pd
+        
+        dtype = series.dtype
+        if isinstance(dtype, pd.CategoricalDtype) and all(isinstance(c, str) for c in dtype.categories):
+            codes = series.cat.codes.to_numpy()
+            validity = cls.validity_from_mask(codes < 0)
+            return cls(CATEGORY, narrow_array(np.where(codes < 0, 0, codes).tolist(), unsigned=True),
+                       validity, categories=list(dtype.categories))
+        
+        if pd.api.types.is_bool_dtype(dtype) and dtype != object:
+            values = array.array('b')
+            values.frombytes(series.to_numpy(dtype=np.int8).tobytes())
+            return cls(BOOL, values)
+        
+        if pd.api.types.is_integer_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype):
+            if series.hasnans:
+                return cls.from_values(None if pd.isna(value) else int(value) for value in series)
+            return cls(INT, narrow_array(series.to_numpy().tolist()))
+        
+        if pd.api.types.is_float_dtype(dtype):
+            values = series.to_numpy(dtype=np.float64)
+            mask = np.isnan(values)
+            return cls(FLOAT, array.array('d', np.where(mask, 0.0, values).tobytes()),
+                       cls.validity_from_mask(mask))
+        
+        if pd.api.types.is_datetime64_dtype(dtype):
+            mask = series.isna().to_numpy()
+            values = series.to_numpy().astype('datetime64[us]').view(np.int64)
+            return cls(DATETIME, array.array('q', np.where(mask, 0, values).tobytes()),
+                       cls.validity_from_mask(mask))
+        
+        return cls.from_values(None if cls.is_na(value) else value for value in series.tolist())
+    
+    @staticmethod
+    def is_na(value):
+        """Scalar missing markers of pandas (None, NaN, NaT, pd.NA)"""
+        return value is None or value != value or type(value).__name__ in ('NAType', 'NaTType')
+    
+    @staticmethod
+    def validity_from_mask(mask):
+        return bytearray(mask.astype('uint8').tobytes()) if mask.any() else None
+
+class ColumnBuilder:
+    """Appends the values of one field row by row, settling its kind on the way"""
+    
+    def __init__(self, kind=None, rows=0):
+        if kind is not None and kind not in KINDS:
+            raise ValueError(f"Unknown column type '{kind}', expected one of {', '.join(KINDS)}")
+        self.declared = kind
+        self.kind = None
+        self.validity = bytearray([ABSENT]) * rows
+        self.values = None
+        self.lookup = None
+        self.data = None
+    
+    def initial_kind(self, value):
+        if self.declared is not None:
+            return self.declared
+        if isinstance(value, bool):
+            return BOOL
+        if isinstance(value, int):
+            return INT
+        if isinstance(value, float):
+            return FLOAT
+        if isinstance(value, str):
+            return DATETIME if parse_datetime(value) is not None else CATEGORY
+        return OBJECT
+    
+    def start(self, kind):
+        """Set up empty storage for kind, with placeholders for the rows seen so far"""
+        self.kind = kind
+        rows = len(self.validity)
+        if kind == OBJECT:
+            self.values = [None] * rows
+        elif kind == STRING:
+            self.data = bytearray()
+            self.values = array.array('Q', bytes(8 * (rows + 1)))
+        else:
+            self.values = array.array({FLOAT: 'd', BOOL: 'b'}.get(kind, 'q'), bytes(8 * rows if kind != BOOL else rows))
+            self.lookup = {} if kind == CATEGORY else None
+    
+    def store(self, value):
+        """Add a non-null value to the storage, False if the kind cannot hold it"""
+        kind = self.kind
+        if kind == OBJECT:
+            self.values.append(value)
+        elif kind == CATEGORY:
+            if not isinstance(value, str):
+                return False
+            code = self.lookup.get(value)
+            if code is None:
+                code = self.lookup[value] = len(self.lookup)
+                rows = len(self.validity) + 1
+                if (self.declared != CATEGORY and code >= CATEGORY_MIN_DISTINCT and code * 2 > rows):
+                    self.convert(STRING)
+                    return self.store(value)
+            self.values.append(code)
+        elif kind == STRING:
+            if not isinstance(value, str):
+                return False
+            self.data += value.encode('utf-8')
+            self.values.append(len(self.data))
+        elif kind == DATETIME:
+            micros = parse_datetime(value, strict=self.declared != DATETIME) if isinstance(value, str) else None
+            if micros is None:
+                return False
+            self.values.append(micros)
+        elif kind == INT:
+            if type(value) is not int or not -2**63 <= value < 2**63:
+                return False
+            self.values.append(value)
+        elif kind == FLOAT:
+            # JSON numbers mix 100 and 99.5; ints beyond 2**53 would not survive as floats
+            if type(value) is int and -2**53 <= value <= 2**53:
+                value = float(value)
+            elif type(value) is not float:
+                return False
+            self.values.append(value)
+        elif kind == BOOL:
+            if type(value) is not bool:
+                return False
+            self.values.append(value)
+        return True
+    
+    def placeholder(self):
+        if self.kind == OBJECT:
+            self.values.append(None)
+        elif self.kind == STRING:
+            self.values.append(len(self.data))
+        else:
+            self.values.append(0)
+    
+    def current_values(self):
+        """Python values stored so far (placeholders included)"""
+        if self.kind == CATEGORY:
+            categories = list(self.lookup)
+            return [categories[code] if code < len(categories) else None for code in self.values]
+        return list(Column(self.kind, self.values, categories=None, data=self.data).decoded())
+    
+    def convert(self, kind):
+        """Move the rows seen so far to the storage of another kind"""
+        values, validity = self.current_values(), self.validity
+        self.validity = bytearray()
+        self.start(kind)
+        for value, flag in zip(values, validity):
+            if flag == VALID:
+                self.store(value)
+            else:
+                self.placeholder()
+            self.validity.append(flag)
+    
+    def widen(self, value):
+        """Switch to a kind that can hold value as well as the rows seen so far"""
+        if self.declared is not None and self.declared != OBJECT:
+            logger.warning(f"Value {value!r} does not fit the declared column type "
+                           f"'{self.declared}', keeping the column as plain objects")
+            self.declared = OBJECT
+        if self.kind == DATETIME and isinstance(value, str):
+            self.convert(CATEGORY if self.declared is None else STRING)
+        elif self.kind == INT and self.declared is None and type(value) is float \
+                and all(-2**53 <= number <= 2**53 for number in self.values):
+            self.convert(FLOAT)
+        else:
+            self.convert(OBJECT)
+    
+    def append(self, value):
+        if value is None or value is MISSING:
+            if self.kind is not None:
+                self.placeholder()
+            self.validity.append(NULL if value is None else ABSENT)
+            return
+        
+        if self.kind is None:
+            self.start(self.initial_kind(value))
+        if not self.store(value):
+            self.widen(value)
+            self.store(value)
+        self.validity.append(VALID)
+    
+    def finish(self):
+        """Freeze into a Column with the narrowest storage"""
+        validity = self.validity if any(self.validity) else None
+        if self.kind is None:
+            return Column(OBJECT, [None] * len(self.validity), validity)
+        if self.kind == INT:
+            return Column(INT, narrow_array(self.values), validity)
+        if self.kind == CATEGORY:
+            return Column(CATEGORY, narrow_array(self.values, unsigned=True), validity, categories=list(self.lookup))
+        if self.kind == STRING:
+            return Column(STRING, narrow_array(self.values, unsigned=True), validity, data=bytes(self.data))
+        return Column(self.kind, self.values, validity)
+
+class Dataset:
+    """Records of a file stored column by column"""
+    
+    def __init__(self, columns=None, length=0):
+        self.columns = dict(columns or {})
+        self.length = length
+    
+    @classmethod
+    def from_records(cls, records, schema=None):
+        """Build a dataset from an iterable of dicts in a single pass
+        
+        schema maps field names to column kinds; other fields are inferred.
+        """
+        schema = schema or {}
+        builders = {}
+        rows = 0
+        for record in records:
+            if not isinstance(record, dict):
+                raise TypeError(f"Record {rows} is not an object: {record!r}")
+            for name, value in record.items():
+                builder = builders.get(name)
+                if builder is None:
+                    builder = builders[name] = ColumnBuilder(schema.get(name), rows)
+                builder.append(value)
+            rows += 1
+            
+            # Fields this record does not have
+            if len(record) < len(builders):
+                for builder in builders.values():
+                    if len(builder.validity) < rows:
+                        builder.append(MISSING)
+        
+        return cls({name: builder.finish() for name, builder in builders.items()}, rows)
+    
+    @classmethod
+    def from_frame(cls, df):
+        """Build a dataset from a pandas DataFrame"""
+        return cls({str(name): Column.from_series(df[name]) for name in df.columns}, len(df))
+    
+    def __len__(self):
+        return self.length
+    
+    def __iter__(self):
+        """Records as dicts, without the fields a record does not have"""
+        names = list(self.columns)
+        if not names:
+            for _ in range(self.length):
+                yield {}
+            return
+        
+        rows = zip(*self.columns.values())
+        if all(column.validity is None for column in self.columns.values()):
+            for values in rows:
+                yield dict(zip(names, values))
+        else:
+            for values in rows:
+                yield {name: value for name, value in zip(names, values) if value is not MISSING}
+    
+    def to_records(self):
+        return list(self)
+    
+    @property
+    def schema(self):
+        """Kind of every column"""
+        return {name: column.kind for name, column in self.columns.items()}
+    
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+    
+    def memory_usage(self):
+        """Bytes held by every column"""
+        return {name: column.nbytes for name, column in self.columns.items()}
+    
+    def with_column(self, name, column):
+        """Dataset with a column added or replaced"""
+        columns = dict(self.columns)
+        columns[name] = column
+        return Dataset(columns, self.length)
+    
+    def rename(self, function):
+        """Dataset with every field renamed by function; a later field wins a clash"""
+        columns = {}
+        for name, column in self.columns.items():
+            columns[function(name)] = column
+        return Dataset(columns, self.length)
+    
+    def take(self, indices):
+        """Dataset of the rows at the given positions (a numpy integer array)"""
+        return Dataset({name: column.take(indices) for name, column in self.columns.items()}, len(indices))
+    
+    def select(self, fields):
+        """Dataset of some fields only (KeyError if one does not exist)"""
+        return Dataset({name: self.columns[name] for name in fields}, self.length)
+    
+    def batches(self, rows):
+        """Consecutive slices of at most rows records; an empty dataset yields itself once"""
+        import numpy as np
+        if self.length <= rows:
+            yield self
+            return
+        for start in range(0, self.length, rows):
+            yield self.take(np.arange(start, min(start + rows, self.length)))
+    
+    def to_frame(self, fields=None, iso_datetimes=False):
+        """Pandas DataFrame of all (or some) fields with typed dtypes
+        
+        Strings of low cardinality become categoricals, ints keep their
+        narrow width and datetimes are datetime64 unless iso_datetimes.
+        """
+        import pandas as pd
+        names = self.columns if fields is None else fields
+        data = {name: self.columns[name].to_series(iso_datetimes) for name in names}
+        return pd.DataFrame(data, index=pd.RangeIndex(self.length))
+    
+    def write_json(self, f):
+        """Write the records as a JSON array, formatted like json.dump(records, f, indent=2)"""
+        first = True
+        for record in self:
+            f.write('[\n  ' if first else ',\n  ')
+            f.write(json.dumps(record, indent=2).replace('\n', '\n  '))
+            first = False
+        f.write('[]' if first else '\n]')
+
+def as_dataset(data, schema=None):
+    """Dataset of a list of records (or the dataset itself), None for anything else"""
+    if isinstance(data, Dataset):
+        return data
+    if isinstance(data, list):
+        return Dataset.from_records(data, schema)
+    return None
\ No newline at end of file
@@ -0,0 +1,184 @@
+"""Interchange format of the record files the pipeline stages hand to each other
+
+Records are written as compact newline-delimited JSON, one object per line,
+optionally gzip or zlib compressed, so files stay small and are read
+straight into columns, a chunk of lines at a time. PIPELINE_INTERCHANGE_FORMAT=json switches back to
+indented JSON arrays for debugging, and PIPELINE_INTERCHANGE_COMPRESSION
+picks none (the default), gzip or zlib. Readers go by the file extension,
+so a stage reads whatever format the previous stage was configured with,
+as well as the gzipped JSON and CSV payloads ingestion keeps in the raw zone.
+"""
+import io
+import os
+import json
+import gzip
+import zlib
+import itertools
+from pipeline_dataset import Dataset, as_dataset
+
+FORMATS = ('ndjson', 'json')
+COMPRESSIONS = ('none', 'gzip', 'zlib')
+
+# Extension of the record files of every (format, compression); .json.gz is
+# only read, it holds downloaded payloads stored as received
+SUFFIXES = {
+    '.ndjson': ('ndjson', 'none'),
+    '.ndjson.gz': ('ndjson', 'gzip'),
+    '.ndjson.zz': ('ndjson', 'zlib'),
+    '.json': ('json', 'none'),
+    '.json.gz': ('json', 'gzip')
+}
+CSV_SUFFIXES = ('.csv', '.csv.gz')
+
+# Intermediate files are read once, so compression favours speed over ratio
+COMPRESS_LEVEL = 1
+
+# Records encoded per write, and bytes of lines parsed per json.loads call
+WRITE_BATCH_RECORDS = 1000
+READ_CHUNK_BYTES = 1024**2
+
+def interchange_format(fmt=None, compression=None):
+    """(format, compression) from the arguments or the PIPELINE_INTERCHANGE_* variables"""
+    fmt = (fmt or os.environ.get('PIPELINE_INTERCHANGE_FORMAT') or 'ndjson').lower()
+    compression = (compression or os.environ.get('PIPELINE_INTERCHANGE_COMPRESSION') or 'none').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown interchange format '{fmt}', expected one of {', '.join(FORMATS)}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown interchange compression '{compression}', expected one of {', '.join(COMPRESSIONS)}")
+    
+    # Pretty JSON only exists to be read by people, so it is never compressed
+    return fmt, 'none' if fmt == 'json' else compression
+
+def suffix_of(filename):
+    """Record file extension of a filename, or None"""
+    for suffix in SUFFIXES:
+        if filename.endswith(suffix):
+            return suffix
+    return None
+
+def is_csv(filename):
+    """Whether the file is CSV, possibly gzipped"""
+    return filename.endswith(CSV_SUFFIXES)
+
+def is_data_file(filename):
+    """Whether a stage can load the file (a record file or CSV)"""
+    return suffix_of(filename) is not None or is_csv(filename)
+
+def strip_suffix(filename):
+    """Filename without its record file or CSV extension"""
+    suffix = suffix_of(filename) or next((suffix for suffix in CSV_SUFFIXES if filename.endswith(suffix)), '')
+    return filename[:-len(suffix)] if suffix else filename
+
+class ZlibFile(io.RawIOBase):
+    """Binary file holding a single zlib stream, compressed on write and decompressed on read"""
+    
+    def __init__(self, path, mode='r'):
+        self.file = open(path, mode + 'b')
+        self.compressor = zlib.compressobj(COMPRESS_LEVEL) if mode == 'w' else None
+        self.decompressor = zlib.decompressobj() if mode == 'r' else None
+        self.pending = memoryview(b'')
+    
+    def readable(self):
+        return self.decompressor is not None
+    
+    def writable(self):
+        return self.compressor is not None
+    
+    def readinto(self, buffer):
+        while not self.pending:
+            if self.decompressor.eof:
+                return 0
+            chunk = self.file.read(READ_CHUNK_BYTES)
+            if not chunk:
+                raise EOFError("zlib stream ended before the end-of-stream marker")
+            self.pending = memoryview(self.decompressor.decompress(chunk))
+        
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+    
+    def write(self, data):
+        self.file.write(self.compressor.compress(data))
+        return len(data)
+    
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.compressor is not None:
+                self.file.write(self.compressor.flush())
+        finally:
+            self.file.close()
+            super().close()
+
+def open_text(path, mode='r'):
+    """Open a record file for text reading or writing, (de)compressing by its extension"""
+    suffix = suffix_of(path)
+    compression = SUFFIXES[suffix][1] if suffix else 'none'
+    if compression == 'gzip':
+        return gzip.open(path, mode + 't', compresslevel=COMPRESS_LEVEL)
+    if compression == 'zlib':
+        raw = ZlibFile(path, mode)
+        return io.TextIOWrapper(io.BufferedReader(raw) if mode == 'r' else io.BufferedWriter(raw))
+    return open(path, mode)
+
+def write_ndjson(f, records):
+    """Write records as compact JSON lines"""
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    records = iter(records)
+    while True:
+        lines = [encode(record) for record in itertools.islice(records, WRITE_BATCH_RECORDS)]
+        if not lines:
+            return
+        f.write('\n'.join(lines) + '\n')
+
+def iter_records(path):
+    """Records of an NDJSON file, parsed a chunk of lines at a time"""
+    with open_text(path, 'r') as f:
+        while True:
+            lines = f.readlines(READ_CHUNK_BYTES)
+            if not lines:
+                return
+            yield from json.loads('[' + ','.join(line for line in lines if line.strip()) + ']')
+
+def read_data(path, schema=None):
+    """Records of a record file as a Dataset, or the document itself if it is not a list of records"""
+    if SUFFIXES[suffix_of(path)][0] == 'json':
+        with open_text(path, 'r') as f:
+            data = json.load(f)
+        dataset = as_dataset(data, schema)
+        return dataset if dataset is not None else data
+    
+    # Lines go straight into the column builders, no list of dicts is materialised
+    return Dataset.from_records(iter_records(path), schema)
+
+class Interchange:
+    """Format the stage writes its record files in"""
+    
+    def __init__(self, fmt=None, compression=None):
+        self.format, self.compression = interchange_format(fmt, compression)
+        self.suffix = next(suffix for suffix, kind in SUFFIXES.items() if kind == (self.format, self.compression))
+    
+    def filename(self, name):
+        """Record file name of a dataset name"""
+        return f"{name}{self.suffix}"
+    
+    def find(self, directory, name):
+        """Path of the record file of a dataset in any format, this one first, or None"""
+        for suffix in [self.suffix] + [suffix for suffix in SUFFIXES if suffix != self.suffix]:
+            path = os.path.join(directory, f"{name}{suffix}")
+            if os.path.exists(path):
+                return path
+        return None
+    
+    def write(self, path, data):
+        """Write records (a Dataset or a list), or any other JSON document as a single record"""
+        with open_text(path, 'w') as f:
+            if self.format == 'json':
+                if isinstance(data, Dataset):
+                    data.write_json(f)
+                else:
+                    json.dump(data, f, indent=2)
+            else:
+                write_ndjson(f, data if isinstance(data, (list, Dataset)) else [data])
\ No newline at end of file
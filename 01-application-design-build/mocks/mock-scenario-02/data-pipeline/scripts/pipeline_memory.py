@@ -0,0 +1,335 @@
+"""Memory budget of the pipeline stages and spill-to-disk helpers
+
+The budget is read from PIPELINE_MEMORY_BUDGET or derived from the memory
+limit of the container's cgroup. Stages size their batches from what is
+left of it and spill intermediate state (duplicate sets, group partials,
+sort runs) to <data_dir>/spill/<stage> when it would not fit.
+"""
+import os
+import json
+import array
+import heapq
+import tempfile
+import threading
+
+# Share of the container limit the stages plan with; the rest is left to
+# the interpreter, pandas and allocator fragmentation
+DEFAULT_BUDGET_FRACTION = 0.6
+
+# cgroup v1 reports "no limit" as a huge page-aligned number
+UNLIMITED = 2**60
+
+# Pandas needs several times the raw column bytes for temporaries
+FRAME_OVERHEAD = 4
+
+# Rough cost of one entry of a Python set of scalars
+SET_ENTRY_BYTES = 100
+
+MIN_BATCH_ROWS = 1000
+
+# Spilled state is split into partitions of at least MIN_PARTITION_BYTES,
+# with the number of partitions (open files) kept between these bounds
+MIN_SPILL_PARTITIONS = 16
+MAX_SPILL_PARTITIONS = 256
+MIN_PARTITION_BYTES = 16 * 1024**2
+
+SIZE_UNITS = {
+    'k': 1000, 'm': 1000**2, 'g': 1000**3,
+    'ki': 1024, 'mi': 1024**2, 'gi': 1024**3
+}
+
+def parse_size(value):
+    """Bytes of a size such as 536870912, 512Mi or 2G"""
+    value = str(value).strip().lower().rstrip('b')
+    for unit in sorted(SIZE_UNITS, key=len, reverse=True):
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * SIZE_UNITS[unit])
+    return int(float(value))
+
+def cgroup_memory_limit():
+    """Memory limit of the container (cgroup v2, then v1), or None if unlimited"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path, 'r') as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value == 'max':
+            return None
+        try:
+            limit = int(value)
+        except ValueError:
+            continue
+        return limit if limit < UNLIMITED else None
+    return None
+
+def current_rss_bytes():
+    """Resident set size of this process right now"""
+    with open('/proc/self/statm', 'r') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+class MemoryBudget:
+    """Memory the stage process may use, shared by everything running in it"""
+    
+    def __init__(self, stage, data_dir="/data", limit=None):
+        self.stage = stage
+        self.spill_dir = os.path.join(data_dir, 'spill', stage)
+        self.spilled_bytes = 0
+        self.spill_files = 0
+        self.lock = threading.Lock()
+        
+        if limit is not None:
+            self.limit, self.source = limit, 'argument'
+        elif os.environ.get('PIPELINE_MEMORY_BUDGET'):
+            self.limit, self.source = parse_size(os.environ['PIPELINE_MEMORY_BUDGET']), 'PIPELINE_MEMORY_BUDGET'
+        else:
+            fraction = float(os.environ.get('PIPELINE_MEMORY_FRACTION', DEFAULT_BUDGET_FRACTION))
+            container_limit = cgroup_memory_limit()
+            self.source = 'cgroup' if container_limit else 'physical memory'
+            if not container_limit:
+                container_limit = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+            self.limit = int(container_limit * fraction)
+    
+    def available(self):
+        """Bytes left before the process reaches the budget"""
+        return max(0, self.limit - current_rss_bytes())
+    
+    def fits(self, nbytes):
+        return nbytes <= self.available()
+    
+    def batch_rows(self, bytes_per_row):
+        """Rows per batch so that one batch takes at most half of what is left"""
+        return max(MIN_BATCH_ROWS, int(self.available() // 2 // max(1, bytes_per_row)))
+    
+    def frame_batch_rows(self, dataset):
+        """Rows per batch when converting a Dataset to pandas frames"""
+        bytes_per_row = dataset.nbytes / len(dataset) if len(dataset) else 1
+        return self.batch_rows(bytes_per_row * FRAME_OVERHEAD)
+    
+    def spill_path(self, prefix):
+        """New empty file in the spill directory"""
+        os.makedirs(self.spill_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=f"{prefix}-", dir=self.spill_dir)
+        os.close(fd)
+        with self.lock:
+            self.spill_files += 1
+        return path
+    
+    def release(self, path):
+        """Account for a spill file and remove it"""
+        with self.lock:
+            self.spilled_bytes += os.path.getsize(path)
+        os.remove(path)
+    
+    def summary(self):
+        return {
+            'budget_bytes': self.limit,
+            'budget_source': self.source,
+            'spilled_bytes': self.spilled_bytes,
+            'spill_files': self.spill_files
+        }
+
+def find_duplicates(budget, values, rows):
+    """(position, value) of every value already seen earlier, in row order
+    
+    values yields (position, value) pairs for about rows rows. The seen-set
+    stays in memory when it fits the budget, otherwise values are
+    hash-partitioned to spill files and every partition is checked on its own.
+    """
+    if budget.fits(rows * SET_ENTRY_BYTES):
+        duplicates, seen = [], set()
+        for i, value in values:
+            if value in seen:
+                duplicates.append((i, value))
+            seen.add(value)
+        return duplicates
+    
+    partition_bytes = max(MIN_PARTITION_BYTES, budget.available())
+    partitions = min(MAX_SPILL_PARTITIONS, max(MIN_SPILL_PARTITIONS, -(-rows * SET_ENTRY_BYTES // partition_bytes)))
+    paths = [budget.spill_path('duplicates') for _ in range(partitions)]
+    duplicates = []
+    try:
+        files = [open(path, 'w') for path in paths]
+        try:
+            for i, value in values:
+                key = json.dumps(value, sort_keys=True)
+                files[hash(key) % partitions].write(f"{i}\t{key}\n")
+        finally:
+            for f in files:
+                f.close()
+        
+        for path in paths:
+            seen = set()
+            with open(path, 'r') as f:
+                for line in f:
+                    i, key = line.rstrip('\n').split('\t', 1)
+                    if key in seen:
+                        duplicates.append((int(i), json.loads(key)))
+                    seen.add(key)
+    finally:
+        for path in paths:
+            budget.release(path)
+    
+    duplicates.sort(key=lambda duplicate: duplicate[0])
+    return duplicates
+
+class PartialAggregator:
+    """Group-by aggregation folded in batches, spilling partials by key partition
+    
+    Supports the decomposable aggregations sum, count, min, max and mean.
+    The result has the columns pandas produces for
+    df.groupby(group_by).agg(aggregations).reset_index() once flattened.
+    """
+    
+    STATES = {'sum': ['sum'], 'count': ['count'], 'min': ['min'], 'max': ['max'], 'mean': ['sum', 'count']}
+    MERGE = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+    
+    def __init__(self, budget, group_by, aggregations):
+        self.budget = budget
+        self.group_by = list(group_by)
+        self.aggregations = aggregations
+        self.state = None
+        self.spilled = {}
+        self.partitions = MIN_SPILL_PARTITIONS
+        
+        self.state_columns = {}
+        for column, functions in aggregations.items():
+            for function in ([functions] if isinstance(functions, str) else functions):
+                for state in self.STATES[function]:
+                    self.state_columns[f"{column}__{state}"] = (column, state)
+    
+    @classmethod
+    def supports(cls, aggregations):
+        """Whether every aggregation can be computed from partials"""
+        return all(function in cls.STATES
+                   for functions in aggregations.values()
+                   for function in ([functions] if isinstance(functions, str) else functions))
+    
+    def add(self, df):
+        """Fold a batch (a pandas DataFrame) into the partial state"""
+        import pandas as pd
+        partial = df.groupby(self.group_by, observed=True).agg(**self.state_columns)
+        if self.state is not None:
+            partial = self.merge(pd.concat([self.state, partial]))
+        self.state = partial
+        
+        if not self.budget.fits(int(self.state.memory_usage(deep=True).sum()) * FRAME_OVERHEAD):
+            self.spill()
+    
+    def merge(self, partials):
+        """Combine partial rows of the same groups"""
+        merge = {name: self.MERGE[state] for name, (_, state) in self.state_columns.items()}
+        return partials.groupby(level=list(range(len(self.group_by))), observed=True).agg(merge)
+    
+    def spill(self):
+        """Write the partial state to its key partitions and start over"""
+        import pandas as pd
+        partition_of = pd.util.hash_pandas_object(self.state.index, index=False).to_numpy() % self.partitions
+        for partition in range(self.partitions):
+            part = self.state[partition_of == partition]
+            if len(part):
+                path = self.budget.spill_path('group-partials')
+                part.to_pickle(path)
+                self.spilled.setdefault(partition, []).append(path)
+        self.state = None
+    
+    def finish(self, partial):
+        """Final aggregation columns of merged partials"""
+        import pandas as pd
+        result = pd.DataFrame(index=partial.index)
+        for column, functions in self.aggregations.items():
+            for function in ([functions] if isinstance(functions, str) else functions):
+                name = column if isinstance(functions, str) else f"{column}_{function}"
+                if function == 'mean':
+                    result[name] = partial[f"{column}__sum"] / partial[f"{column}__count"]
+                else:
+                    result[name] = partial[f"{column}__{function}"]
+        return result
+    
+    def result(self):
+        """Aggregated pandas DataFrame, groups sorted by key"""
+        import pandas as pd
+        if not self.spilled:
+            if self.state is None:
+                return pd.DataFrame(columns=self.group_by)
+            return self.finish(self.state).sort_index().reset_index()
+        
+        if self.state is not None:
+            self.spill()
+        
+        results = []
+        for partition, paths in sorted(self.spilled.items()):
+            partials = []
+            for path in paths:
+                partials.append(pd.read_pickle(path))
+                self.budget.release(path)
+            results.append(self.finish(self.merge(pd.concat(partials))))
+        self.spilled = {}
+        return pd.concat(results).sort_index().reset_index()
+
+class SortRuns:
+    """External sort of numbers: sorted runs spill to disk and are merged on read"""
+    
+    def __init__(self, budget, prefix='sort-run'):
+        self.budget = budget
+        self.prefix = prefix
+        self.buffer = array.array('d')
+        self.runs = []
+        self.count = 0
+        self.run_rows = budget.batch_rows(self.buffer.itemsize * 4)
+    
+    def add(self, values):
+        self.buffer.extend(values)
+        self.count += len(values)
+        if len(self.buffer) >= self.run_rows:
+            self.flush()
+    
+    def flush(self):
+        """Sort the buffered values into a run on disk"""
+        if not self.buffer:
+            return
+        path = self.budget.spill_path(self.prefix)
+        with open(path, 'wb') as f:
+            array.array('d', sorted(self.buffer)).tofile(f)
+        self.runs.append(path)
+        self.buffer = array.array('d')
+    
+    def read_run(self, path, chunk=65536):
+        with open(path, 'rb') as f:
+            while True:
+                values = array.array('d')
+                try:
+                    values.fromfile(f, chunk)
+                except EOFError:
+                    pass
+                if not values:
+                    return
+                yield from values
+    
+    def __len__(self):
+        return self.count
+    
+    def __iter__(self):
+        """All values in ascending order"""
+        if not self.runs:
+            yield from sorted(self.buffer)
+            return
+        self.flush()
+        yield from heapq.merge(*[self.read_run(path) for path in self.runs])
+    
+    def median(self):
+        if not self.count:
+            return float('nan')
+        middle = (self.count - 1) // 2
+        for i, value in enumerate(self):
+            if i == middle:
+                if self.count % 2:
+                    return value
+                lower = value
+            elif i == middle + 1:
+                return (lower + value) / 2
+    
+    def close(self):
+        for path in self.runs:
+            self.budget.release(path)
+        self.runs = []
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""Stage and per-file performance instrumentation shared by the pipeline scripts"""
+import os
+import time
+import resource
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+def peak_rss_bytes():
+    """High-water mark of the resident set size of this process"""
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class FileMetrics:
+    """Time, throughput and I/O volume spent on one file of a stage"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.phases = {}
+        self.cpu_seconds = 0.0
+        self.records_in = 0
+        self.records_out = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.peak_rss_bytes = 0
+        self.lock = threading.Lock()
+    
+    @contextmanager
+    def phase(self, name):
+        """Time a phase (fetch, parse, compute or serialise) of this file"""
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield self
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.thread_time() - cpu_start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + wall
+                self.cpu_seconds += cpu
+                self.peak_rss_bytes = peak_rss_bytes()
+    
+    def read_file(self, path):
+        """Account for an input file"""
+        self.bytes_read += os.path.getsize(path)
+    
+    def wrote_file(self, path):
+        """Account for an output file"""
+        self.bytes_written += os.path.getsize(path)
+    
+    @property
+    def wall_seconds(self):
+        return sum(self.phases.values())
+    
+    def as_dict(self):
+        wall = self.wall_seconds
+        # Steps that only produce records (e.g. sample generation) are rated on their output
+        records = self.records_in or self.records_out
+        return {
+            'wall_seconds': round(wall, 6),
+            'cpu_seconds': round(self.cpu_seconds, 6),
+            'records_in': self.records_in,
+            'records_out': self.records_out,
+            'records_per_second': round(records / wall, 1) if wall > 0 else None,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'peak_rss_bytes': self.peak_rss_bytes,
+            'phase_seconds': {phase: round(seconds, 6) for phase, seconds in self.phases.items()}
+        }
+
+class StageMetrics:
+    """Instrumentation of one pipeline stage and every file it handles"""
+    
+    def __init__(self, stage):
+        self.stage = stage
+        self.files = {}
+        self.lock = threading.Lock()
+        self.started_at = datetime.now().isoformat()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+    
+    def file(self, name):
+        """Metrics of a file, created on first use"""
+        with self.lock:
+            if name not in self.files:
+                self.files[name] = FileMetrics(name)
+            return self.files[name]
+    
+    def summary(self):
+        """Stage totals plus the per-file breakdown, for the *-summary.json files"""
+        wall = time.perf_counter() - self.wall_start
+        files = {name: metrics.as_dict() for name, metrics in self.files.items()}
+        records_in = sum(f['records_in'] for f in files.values())
+        records = records_in or sum(f['records_out'] for f in files.values())
+        
+        phase_seconds = {}
+        for f in files.values():
+            for phase, seconds in f['phase_seconds'].items():
+                phase_seconds[phase] = round(phase_seconds.get(phase, 0.0) + seconds, 6)
+        
+        return {
+            'stage': self.stage,
+            'started_at': self.started_at,
+            'wall_seconds': round(wall, 6),
+            'cpu_seconds': round(time.process_time() - self.cpu_start, 6),
+            'records_in': records_in,
+            'records_out': sum(f['records_out'] for f in files.values()),
+            'records_per_second': round(records / wall, 1) if wall > 0 else None,
+            'bytes_read': sum(f['bytes_read'] for f in files.values()),
+            'bytes_written': sum(f['bytes_written'] for f in files.values()),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'phase_seconds': phase_seconds,
+            'files': files
+        }
+    
+    def exposition(self, fmt='prometheus'):
+        """Render the metrics in Prometheus text format or OpenMetrics"""
+        summary = self.summary()
+        openmetrics = fmt == 'openmetrics'
+        lines = []
+        
+        def family(name, metric_type, help_text, samples, unit=None):
+            # OpenMetrics names the family without the _total suffix of its counter samples
+            family_name = name[:-len('_total')] if openmetrics and name.endswith('_total') else name
+            lines.append(f"# HELP {family_name} {help_text}")
+            lines.append(f"# TYPE {family_name} {metric_type}")
+            if openmetrics and unit:
+                lines.append(f"# UNIT {family_name} {unit}")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{value_}"' for key, value_ in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value if value is not None else 'NaN'}")
+        
+        stage = {'stage': self.stage}
+        files = summary['files']
+        family('pipeline_stage_wall_seconds', 'gauge', "Wall time of the stage",
+               [(stage, summary['wall_seconds'])], 'seconds')
+        family('pipeline_stage_cpu_seconds', 'gauge', "CPU time of the stage",
+               [(stage, summary['cpu_seconds'])], 'seconds')
+        family('pipeline_stage_peak_rss_bytes', 'gauge', "Peak resident set size of the stage process",
+               [(stage, summary['peak_rss_bytes'])], 'bytes')
+        family('pipeline_file_wall_seconds', 'gauge', "Wall time spent on a file",
+               [(dict(stage, file=name), f['wall_seconds']) for name, f in files.items()], 'seconds')
+        family('pipeline_file_cpu_seconds', 'gauge', "CPU time spent on a file",
+               [(dict(stage, file=name), f['cpu_seconds']) for name, f in files.items()], 'seconds')
+        family('pipeline_file_phase_seconds', 'gauge', "Wall time per phase of a file",
+               [(dict(stage, file=name, phase=phase), seconds)
+                for name, f in files.items() for phase, seconds in f['phase_seconds'].items()], 'seconds')
+        family('pipeline_file_records_in_total', 'counter', "Records read for a file",
+               [(dict(stage, file=name), f['records_in']) for name, f in files.items()])
+        family('pipeline_file_records_out_total', 'counter', "Records produced for a file",
+               [(dict(stage, file=name), f['records_out']) for name, f in files.items()])
+        family('pipeline_file_records_per_second', 'gauge', "Throughput of a file",
+               [(dict(stage, file=name), f['records_per_second']) for name, f in files.items()])
+        family('pipeline_file_read_bytes_total', 'counter', "Bytes read for a file",
+               [(dict(stage, file=name), f['bytes_read']) for name, f in files.items()], 'bytes')
+        family('pipeline_file_written_bytes_total', 'counter', "Bytes written for a file",
+               [(dict(stage, file=name), f['bytes_written']) for name, f in files.items()], 'bytes')
+        family('pipeline_file_peak_rss_bytes', 'gauge', "Process peak RSS after a file",
+               [(dict(stage, file=name), f['peak_rss_bytes']) for name, f in files.items()], 'bytes')
+        
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+    
+    def write_exposition(self, data_dir, fmt=None):
+        """Write <data_dir>/metrics/<stage>.prom if PIPELINE_METRICS_FORMAT (or fmt) asks for it"""
+        fmt = fmt or os.environ.get('PIPELINE_METRICS_FORMAT', '')
+        if fmt not in ('prometheus', 'openmetrics'):
+            return None
+        
+        metrics_dir = os.path.join(data_dir, 'metrics')
+        os.makedirs(metrics_dir, exist_ok=True)
+        output_file = os.path.join(metrics_dir, f"{self.stage}.prom")
+        with open(output_file, 'w') as f:
+            f.write(self.exposition(fmt))
+        return output_file
\ No newline at end of file
@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import base64
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import unittest
+import importlib.util
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+spec = importlib.util.spec_from_file_location('data_ingestion', os.path.join(SCRIPTS_DIR, 'data-ingestion.py'))
+data_ingestion = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(data_ingestion)
+
+ETAG = '"v1"'
+
+class RangeServer:
+    """Local HTTP server of one object, with Range and If-Range support that can be turned off or made to fail"""
+    
+    def __init__(self, body):
+        self.body = body
+        self.ranges = True
+        self.etag = ETAG
+        self.last_modified = None
+        self.digest = hashlib.sha256(body).digest()
+        # Range starts answered with a 500, and how many times each still fails
+        self.failures = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                self.send_object(head=True)
+            
+            def do_GET(self):
+                self.send_object(head=False)
+            
+            def send_object(self, head):
+                requested = self.headers.get('Range')
+                with server.lock:
+                    server.requests.append((self.command, requested))
+                
+                # Only a strong ETag or the Last-Modified date satisfies If-Range
+                validators = {server.last_modified} if server.etag.startswith('W/') else {server.etag, server.last_modified}
+                if_range = self.headers.get('If-Range')
+                if requested and server.ranges and (if_range is None or if_range in validators):
+                    start, end = (int(value) for value in requested[len('bytes='):].split('-'))
+                    with server.lock:
+                        failing = server.failures.get(start, 0)
+                        if failing:
+                            server.failures[start] = failing - 1
+                    if failing:
+                        self.send_error(500, "Injected failure")
+                        return
+                    content = server.body[start:end + 1]
+                    self.send_response(206)
+                    self.send_header('Content-Range', f"bytes {start}-{end}/{len(server.body)}")
+                else:
+                    content = server.body
+                    self.send_response(200)
+                
+                self.send_header('Content-Length', str(len(content)))
+                self.send_header('ETag', server.etag)
+                if server.last_modified:
+                    self.send_header('Last-Modified', server.last_modified)
+                self.send_header('Repr-Digest', f"sha-256=:{base64.b64encode(server.digest).decode()}:")
+                if server.ranges:
+                    self.send_header('Accept-Ranges', 'bytes')
+                self.end_headers()
+                if not head:
+                    self.wfile.write(content)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/users.json"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+    
+    def range_requests(self):
+        return [requested for command, requested in self.requests if command == 'GET' and requested]
+    
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class RangedDownloadTest(unittest.TestCase):
+    
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.records = [{'id': i, 'name': f"user{i}", 'email': f"user{i}@example.com"} for i in range(20000)]
+        self.body = json.dumps(self.records).encode()
+        self.server = RangeServer(self.body)
+        
+        self.work_dir = tempfile.mkdtemp(prefix='ingestion-test-')
+        config_path = os.path.join(self.work_dir, 'ingestion-config.json')
+        with open(config_path, 'w') as f:
+            json.dump({'sources': []}, f)
+        self.ingestion = data_ingestion.DataIngestion(config_path=config_path, data_dir=self.work_dir)
+        self.source = {
+            'name': 'users',
+            'url': self.server.url,
+            'format': 'json',
+            'raw_compression': 'none',
+            'ranged_threshold_bytes': 1024,
+            'segment_bytes': 64 * 1024,
+            'parallel_segments': 4
+        }
+        self.segments = -(-len(self.body) // self.source['segment_bytes'])
+    
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        logging.disable(logging.NOTSET)
+    
+    def metadata(self):
+        with open(os.path.join(self.work_dir, 'raw', 'users_metadata.json')) as f:
+            return json.load(f)
+    
+    def test_segmented_download(self):
+        data = self.ingestion.download_dataset(self.source)
+        
+        self.assertEqual(data, self.records)
+        self.assertEqual(len(self.server.range_requests()), self.segments)
+        download = self.metadata()['download']
+        self.assertTrue(download['ranged'])
+        self.assertTrue(download['sha256_verified'])
+        self.assertEqual(download['sha256'], hashlib.sha256(self.body).hexdigest())
+        leftovers = [name for name in os.listdir(os.path.join(self.work_dir, 'raw')) if '.download' in name]
+        self.assertEqual(leftovers, [])
+    
+    def test_failed_range_is_retried(self):
+        self.server.failures[self.source['segment_bytes']] = 1
+        with mock.patch.object(data_ingestion.time, 'sleep'):
+            data = self.ingestion.download_dataset(self.source)
+        
+        self.assertEqual(data, self.records)
+        self.assertEqual(len(self.server.range_requests()), self.segments + 1)
+    
+    def test_resume_from_state_file(self):
+        failed_start = 2 * self.source['segment_bytes']
+        self.server.failures[failed_start] = data_ingestion.SEGMENT_RETRIES
+        remote = self.ingestion.probe_ranges(self.source)
+        path = os.path.join(self.work_dir, 'raw', 'users.download')
+        with mock.patch.object(data_ingestion.time, 'sleep'):
+            with self.assertRaises(IOError):
+                self.ingestion.download_ranged(self.source, remote, path)
+        
+        with open(f"{path}.part.state") as f:
+            state = json.load(f)
+        self.assertEqual(len(state['done']), self.segments - 1)
+        self.assertNotIn(failed_start, state['done'])
+        
+        self.server.requests.clear()
+        sha256 = self.ingestion.download_ranged(self.source, remote, path)
+        self.assertEqual(self.server.range_requests(), [f"bytes={failed_start}-{failed_start + self.source['segment_bytes'] - 1}"])
+        self.assertEqual(sha256, hashlib.sha256(self.body).hexdigest())
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.body)
+        self.assertFalse(os.path.exists(f"{path}.part.state"))
+    
+    def test_weak_etag(self):
+        self.server.etag = 'W/"v1"'
+        data = self.ingestion.download_dataset(self.source)
+        
+        self.assertEqual(data, self.records)
+        self.assertEqual(len(self.server.range_requests()), self.segments)
+        self.assertTrue(self.metadata()['download']['ranged'])
+    
+    def test_weak_etag_with_last_modified(self):
+        self.server.etag = 'W/"v1"'
+        self.server.last_modified = 'Mon, 19 Oct 2026 06:00:00 GMT'
+        data = self.ingestion.download_dataset(self.source)
+        
+        self.assertEqual(data, self.records)
+        self.assertEqual(len(self.server.range_requests()), self.segments)
+        self.assertTrue(self.metadata()['download']['ranged'])
+    
+    def test_server_without_ranges(self):
+        self.server.ranges = False
+        data = self.ingestion.download_dataset(self.source)
+        
+        self.assertEqual(data, self.records)
+        self.assertEqual(self.server.range_requests(), [])
+        self.assertNotIn('download', self.metadata())
+    
+    def test_sha256_mismatch(self):
+        source = dict(self.source, sha256='0' * 64)
+        self.assertIsNone(self.ingestion.download_dataset(source))
+        
+        raw_files = os.listdir(os.path.join(self.work_dir, 'raw'))
+        self.assertEqual([name for name in raw_files if name.startswith('users')], [])
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,35 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+from pipeline_dataset import Dataset, FLOAT, INT, OBJECT
+
+class ColumnKindTest(unittest.TestCase):
+    
+    def kind(self, records, field):
+        return Dataset.from_records(records).columns[field].kind
+    
+    def test_ints_then_floats_are_floats(self):
+        dataset = Dataset.from_records([{'amount': 100}, {'amount': 99.5}, {'amount': None}, {}])
+        self.assertEqual(dataset.columns['amount'].kind, FLOAT)
+        self.assertEqual(dataset.columns['amount'].to_list(), [100.0, 99.5, None, None])
+        self.assertEqual(str(dataset.to_frame()['amount'].dtype), 'float64')
+    
+    def test_floats_then_ints_are_floats(self):
+        self.assertEqual(self.kind([{'amount': 99.5}, {'amount': 100}], 'amount'), FLOAT)
+    
+    def test_ints_stay_ints(self):
+        self.assertEqual(self.kind([{'id': 1}, {'id': 2}], 'id'), INT)
+    
+    def test_ints_too_large_for_floats_are_objects(self):
+        dataset = Dataset.from_records([{'id': 1}, {'id': 2**60}, {'id': 0.5}])
+        self.assertEqual(dataset.columns['id'].kind, OBJECT)
+        self.assertEqual(dataset.columns['id'].to_list(), [1, 2**60, 0.5])
+    
+    def test_bools_are_not_numbers(self):
+        self.assertEqual(self.kind([{'flag': 1}, {'flag': True}], 'flag'), OBJECT)
+        self.assertEqual(self.kind([{'flag': 1.5}, {'flag': True}], 'flag'), OBJECT)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+import importlib.util
+from unittest import mock
+
+PIPELINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(PIPELINE_DIR, 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+spec = importlib.util.spec_from_file_location('pipeline_runner', os.path.join(SCRIPTS_DIR, 'pipeline-runner.py'))
+pipeline_runner = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pipeline_runner)
+
+def users(count):
+    return [{'id': i, 'name': f"user{i}", 'email': f"user{i}@example{i % 3}.com", 'age': 20 + i % 50, 'active': i % 2 == 0}
+            for i in range(count)]
+
+def transactions(count):
+    return [{'id': i, 'user_id': i % 7, 'amount': 10.5 + i, 'currency': 'USD', 'status': 'completed'}
+            for i in range(count)]
+
+class MicroBatchPipelineTest(unittest.TestCase):
+    
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.data_dir = tempfile.mkdtemp(prefix='pipeline-runner-test-')
+        self.runner = pipeline_runner.PipelineRunner(config_dir=os.path.join(PIPELINE_DIR, 'configs'), data_dir=self.data_dir)
+        self.sources = {'users': users(300), 'transactions': transactions(400)}
+        self.runner.ingestion.config = {'sources': [{'name': name} for name in self.sources]}
+    
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+        logging.disable(logging.NOTSET)
+    
+    def poll(self, pipeline):
+        """Poll the sources once and process everything queued"""
+        def ingest_source(source, save=True):
+            return f"{source['name']}.json", [dict(record) for record in self.sources[source['name']]]
+        
+        with mock.patch.object(self.runner.ingestion, 'ingest_source', ingest_source):
+            pipeline.poll_once()
+        while not pipeline.batches.empty():
+            pipeline.run_batch(*pipeline.batches.get())
+    
+    def reports(self, pipeline):
+        user_report = pipeline.analytics.user_analytics()
+        transaction_report = pipeline.analytics.transaction_analytics()
+        for report in (user_report, transaction_report):
+            report.pop('timestamp')
+        return user_report, transaction_report
+    
+    def test_polling_again_changes_nothing(self):
+        pipeline = pipeline_runner.MicroBatchPipeline(self.runner, batch_size=100, seen_keys=1000)
+        self.poll(pipeline)
+        first = self.reports(pipeline)
+        self.assertGreater(first[0]['total_users'], 0)
+        self.assertGreater(first[1]['total_transactions'], 0)
+        
+        self.poll(pipeline)
+        self.poll(pipeline)
+        self.assertEqual(self.reports(pipeline), first)
+    
+    def test_records_without_unique_field_are_counted_once(self):
+        self.sources['transactions'] += [{'user_id': 1, 'amount': 5.0, 'currency': 'USD', 'status': 'completed'}]
+        pipeline = pipeline_runner.MicroBatchPipeline(self.runner, batch_size=100, seen_keys=1000)
+        self.poll(pipeline)
+        first = self.reports(pipeline)
+        
+        self.poll(pipeline)
+        self.assertEqual(self.reports(pipeline), first)
+        self.assertEqual(pipeline.enqueue('transactions.json', self.sources['transactions']), 0)
+    
+    def test_source_larger_than_seen_keys_is_refused(self):
+        pipeline = pipeline_runner.MicroBatchPipeline(self.runner, batch_size=100, seen_keys=350)
+        self.poll(pipeline)
+        total_users = pipeline.analytics.user_analytics()['total_users']
+        self.poll(pipeline)
+        
+        self.assertGreater(total_users, 0)
+        self.assertEqual(pipeline.analytics.user_analytics()['total_users'], total_users)
+        self.assertEqual(pipeline.analytics.transaction_analytics()['total_transactions'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -4,9 +4,18 @@ import time
 import os
 import logging
 import threading
+import signal
+import sys
 from datetime import datetime
 import glob
-from collections import defaultdict
+import fnmatch
+from log_watcher import create_watcher
+from log_checkpoint import Checkpoints, file_key, fingerprint
+from log_reader import LineReader
+from log_buffer import LogBuffer, DEFAULT_MAX_ENTRIES, DEFAULT_FLUSH_ENTRIES, DEFAULT_FLUSH_AGE
+from log_segment import SegmentWriter, DEFAULT_SEGMENT_BYTES, DEFAULT_SEGMENT_AGE
+from log_transport import TransportClient, DEFAULT_ADDRESS
+from log_record import encode_batch
 
 # Configure logging
 logging.basicConfig(
@@ -16,111 +25,245 @@ logging.basicConfig(
 
 logger = logging.getLogger('log-collector')
 
+# Longest the collection thread sleeps before checking whether it should stop
+WATCH_TIMEOUT = 1.0
+
+LOG_PATTERN = '*.log'
+
+# Bytes read from one file before the other changed files get their turn
+READ_BATCH_BYTES = 1024**2
+
+# Streamed batches leave as soon as they are this old, not after the file flush age
+STREAM_FLUSH_AGE = 0.01
+
+# Checkpoints are saved at most this often; every save is an fsync and a rename
+CHECKPOINT_INTERVAL = 1.0
+
 class LogCollector:
-    def __init__(self):
-        self.log_directory = '/logs'
-        self.output_directory = '/collected-logs'
+    def __init__(self, log_directory='/logs', output_directory='/collected-logs'):
+        self.log_directory = log_directory
+        self.output_directory = output_directory
         self.running = True
-        self.file_positions = {}
-        self.collected_logs = defaultdict(list)
+        
+        # LOG_TRANSPORT=socket streams batches to the processor, files remain the fallback
+        self.transport = None
+        if os.environ.get('LOG_TRANSPORT', 'file') == 'socket':
+            self.transport = TransportClient(os.environ.get('LOG_TRANSPORT_ADDRESS', DEFAULT_ADDRESS))
+        
+        # Bounded per-source queues between the collection and writing threads
+        self.buffer = LogBuffer(
+            max_entries=int(os.environ.get('LOG_BUFFER_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+            flush_entries=int(os.environ.get('LOG_FLUSH_ENTRIES', DEFAULT_FLUSH_ENTRIES)),
+            flush_age=float(os.environ.get('LOG_FLUSH_AGE_SECONDS', STREAM_FLUSH_AGE if self.transport else DEFAULT_FLUSH_AGE)),
+            overflow=os.environ.get('LOG_BUFFER_OVERFLOW', 'block')
+        )
+        
+        # inotify where available, adaptive polling otherwise (LOG_WATCH_MODE=auto|inotify|polling)
+        self.watch_mode = os.environ.get('LOG_WATCH_MODE', 'auto')
+        self.watcher = None
         
         # Ensure output directory exists
         os.makedirs(self.output_directory, exist_ok=True)
+        
+        # Output goes to rolled segments, published by rename once complete
+        self.segments = SegmentWriter(
+            self.output_directory,
+            max_bytes=int(os.environ.get('LOG_SEGMENT_BYTES', DEFAULT_SEGMENT_BYTES)),
+            max_age=float(os.environ.get('LOG_SEGMENT_AGE_SECONDS', DEFAULT_SEGMENT_AGE)),
+            compression=os.environ.get('LOG_SEGMENT_COMPRESSION', 'gzip')
+        )
+        self.segments.recover()
+        self.flush_lock = threading.Lock()
+        self.last_checkpoint = 0
+        
+        # Lines are read as bytes through one reused chunk buffer (or a memory map for large bursts)
+        self.reader = LineReader()
+        
+        # Read positions live on the shared volume so a restarted sidecar resumes where it stopped
+        self.checkpoints = Checkpoints(os.environ.get(
+            'LOG_CHECKPOINT_FILE', os.path.join(self.output_directory, '.collector-checkpoints.json')))
+    
+    def resume_position(self, f, file_path):
+        """Key and checkpointed offset of an open log file, handling rotation and truncation"""
+        stat = os.fstat(f.fileno())
+        key = file_key(stat)
+        
+        # Another file now lives at this path: finish reading the rotated one first
+        previous_key = self.checkpoints.key_at(file_path)
+        if previous_key and previous_key != key:
+            self.drain_rotated(previous_key, file_path)
+        
+        entry = self.checkpoints.get(key)
+        if not entry:
+            return key, 0
+        
+        if entry['offset'] > stat.st_size:
+            logger.warning(f"{file_path} was truncated, reading it from the start")
+            self.checkpoints.count('truncations')
+            return key, 0
+        
+        if entry['fingerprint'] and fingerprint(f, entry['fingerprint'][0]) != entry['fingerprint']:
+            logger.warning(f"{file_path} was rewritten or its inode reused, reading it from the start")
+            self.checkpoints.count('replaced')
+            return key, 0
+        
+        return key, entry['offset']
     
     def read_log_file(self, file_path):
-        """Read new lines from a log file"""
+        """Read the lines appended to a log file since its checkpoint
+        
+        Returns (lines, key, offset, fingerprint, more) with the lines as
+        undecoded bytes and offset the end of the last complete line; a line
+        still being written is left for the next read. About READ_BATCH_BYTES
+        are read, more tells whether the file has further lines.
+        """
         try:
-            # Get current position for this file
-            current_position = self.file_positions.get(file_path, 0)
-            
-            with open(file_path, 'r') as f:
-                f.seek(current_position)
-                new_lines = f.readlines()
-                self.file_positions[file_path] = f.tell()
-            
-            return new_lines
+            # Unbuffered: the reader fills its own chunk buffer
+            with open(file_path, 'rb', buffering=0) as f:
+                key, offset = self.resume_position(f, file_path)
+                lines, end = self.reader.read(f, offset, READ_BATCH_BYTES)
+                more = end > offset and os.fstat(f.fileno()).st_size > end
+                return lines, key, end, fingerprint(f, end), more
             
         except Exception as e:
             logger.error(f"Error reading log file {file_path}: {str(e)}")
-            return []
+            return [], None, 0, None, False
     
-    def process_log_line(self, line, source_file):
-        """Process a single log line and extract metadata"""
-        try:
-            # Try to parse as JSON first
-            if line.strip().startswith('{'):
-                log_entry = json.loads(line.strip())
-                log_entry['source_file'] = source_file
-                log_entry['collected_at'] = datetime.now().isoformat()
-                return log_entry
+    def drain_rotated(self, key, file_path):
+        """Collect what is left of a file rotated away from file_path"""
+        entry = self.checkpoints.get(key)
+        self.checkpoints.count('rotations')
+        
+        # Rotation renames within the directory (access.log -> access.log.1)
+        rotated = None
+        with os.scandir(self.log_directory) as entries:
+            for dir_entry in entries:
+                if dir_entry.is_file() and file_key(dir_entry.stat()) == key:
+                    rotated = dir_entry.path
+                    break
+        
+        if rotated is None:
+            logger.warning(f"{file_path} was rotated and the old file is gone, its unread lines are lost")
+            self.checkpoints.remove(key)
+            return
+        
+        with open(rotated, 'rb', buffering=0) as f:
+            # The rotated file no longer grows, so its last line counts even without a newline
+            offset = entry['offset']
+            while True:
+                lines, end = self.reader.read(f, offset, READ_BATCH_BYTES, final=True)
+                if end == offset:
+                    break
+                self.add_lines(lines, os.path.basename(file_path))
+                offset = end
+            
+            logger.info(f"Collected {offset - entry['offset']} remaining bytes of {file_path} from {rotated}")
+            if fnmatch.fnmatch(os.path.basename(rotated), LOG_PATTERN):
+                # Still a watched log under its new name, keep its position
+                self.checkpoints.update(key, rotated, offset, fingerprint(f, offset))
             else:
-                # Handle plain text logs
-                return {
-                    'message': line.strip(),
-                    'source_file': source_file,
-                    'collected_at': datetime.now().isoformat(),
-                    'log_level': 'INFO'  # Default level
-                }
-                
-        except json.JSONDecodeError:
-            # Not JSON, treat as plain text
-            return {
-                'message': line.strip(),
-                'source_file': source_file,
-                'collected_at': datetime.now().isoformat(),
-                'log_level': 'INFO'
-            }
-        except Exception as e:
-            logger.error(f"Error processing log line: {str(e)}")
-            return None
+                self.checkpoints.remove(key)
+    
+    def collect_file(self, log_file):
+        """Collect the new lines of one log file, returning whether more are waiting"""
+        # Read new lines from the file
+        new_lines, key, offset, head, more = self.read_log_file(log_file)
+        self.add_lines(new_lines, os.path.basename(log_file))
+        
+        # Only advance the checkpoint once the lines are queued for writing
+        if key:
+            self.checkpoints.update(key, log_file, offset, head)
+        return more
+    
+    def add_lines(self, lines, source_file):
+        """Queue raw lines for writing, blocking while the source's queue is full
+        
+        Lines are shipped as read; the processor parses them (log_record.py).
+        """
+        # Categorize logs by source
+        self.buffer.put(source_file, lines)
     
     def collect_logs(self):
-        """Collect logs from all log files"""
+        """Collect logs from the files the watcher reports as changed"""
+        self.watcher = create_watcher(self.log_directory, LOG_PATTERN, self.watch_mode)
+        logger.info(f"Watching {self.log_directory} for log changes ({self.watcher.mode}), "
+                    f"resuming {self.checkpoints.stats()['resumed']} checkpointed files")
+        
+        # None means every log file has to be looked at (startup, watcher overflow)
+        changed = None
         while self.running:
             try:
-                # Find all log files
-                log_files = glob.glob(os.path.join(self.log_directory, '*.log'))
+                if changed is None:
+                    changed = glob.glob(os.path.join(self.log_directory, LOG_PATTERN))
                 
-                for log_file in log_files:
-                    if not os.path.exists(log_file):
-                        continue
-                    
-                    # Read new lines from the file
-                    new_lines = self.read_log_file(log_file)
-                    
-                    for line in new_lines:
-                        if line.strip():  # Skip empty lines
-                            processed_log = self.process_log_line(line, os.path.basename(log_file))
-                            if processed_log:
-                                # Categorize logs by source
-                                source = processed_log.get('source_file', 'unknown')
-                                self.collected_logs[source].append(processed_log)
+                backlog = set()
+                for log_file in sorted(changed):
+                    if os.path.exists(log_file) and self.collect_file(log_file):
+                        # Come back for the rest once the other files had their turn
+                        backlog.add(log_file)
                 
-                time.sleep(1)  # Check for new logs every second
+                # Sleeps until a log file is created, written or rotated
+                changed = self.watcher.wait(0 if backlog else WATCH_TIMEOUT)
+                if changed is not None:
+                    changed |= backlog
                 
             except Exception as e:
                 logger.error(f"Log collection error: {str(e)}")
                 time.sleep(5)
+                changed = None
+        
+        self.watcher.close()
+    
+    def ship(self, source, data):
+        """Stream a batch to the processor, or write it to the source's segment"""
+        if self.transport:
+            if self.transport.send(source, data):
+                return
+            # Earlier batches the processor never acknowledged go first to keep the order
+            self.spool_unacked()
+        
+        # Write logs to source-specific segment
+        self.segments.write(source, data)
+    
+    def spool_unacked(self):
+        for source, data in self.transport.take_unacked():
+            self.segments.write(source, data)
+    
+    def flush_collected_logs(self, seal=False):
+        """Write collected logs to their segments, then checkpoint the positions they were read up to"""
+        with self.flush_lock:
+            # Positions taken first: every line before them is already in the buffer
+            positions = self.checkpoints.snapshot()
+            batches = self.buffer.take()
+            
+            for source, logs in batches:
+                self.ship(source, encode_batch(source, logs))
+            
+            # Streamed batches only count once the processor acknowledged them
+            if self.transport and not self.transport.drain():
+                self.spool_unacked()
+            self.segments.sync()
+            
+            written = sum(len(logs) for _, logs in batches)
+            self.buffer.written(written)
+            if written:
+                logger.debug(f"Wrote {written} logs from {len({source for source, _ in batches})} sources")
+            
+            if seal or time.monotonic() - self.last_checkpoint >= CHECKPOINT_INTERVAL:
+                self.checkpoints.save(positions)
+                self.last_checkpoint = time.monotonic()
+            
+            # Publish the segments that are full or old enough
+            self.segments.roll(force=seal)
     
     def write_collected_logs(self):
         """Write collected logs to output files"""
         while self.running:
             try:
-                for source, logs in self.collected_logs.items():
-                    if logs:
-                        # Write logs to source-specific file
-                        output_file = os.path.join(self.output_directory, f"collected_{source}")
-                        
-                        with open(output_file, 'a') as f:
-                            for log_entry in logs:
-                                f.write(json.dumps(log_entry) + '\n')
-                        
-                        # Clear processed logs
-                        self.collected_logs[source] = []
-                        
-                        logger.debug(f"Wrote {len(logs)} logs to {output_file}")
-                
-                time.sleep(5)  # Write collected logs every 5 seconds
+                # Woken when a source holds a full batch or its oldest log reaches the flush age;
+                # an idle buffer still gets a pass every DEFAULT_FLUSH_AGE to roll old segments
+                self.buffer.wait_ready(max(self.buffer.flush_age, DEFAULT_FLUSH_AGE))
+                self.flush_collected_logs()
                 
             except Exception as e:
                 logger.error(f"Log writing error: {str(e)}")
@@ -130,12 +273,20 @@ class LogCollector:
         """Generate statistics about log collection"""
         while self.running:
             try:
+                positions = self.checkpoints.positions()
+                pending = self.buffer.depths()
                 stats = {
                     'timestamp': datetime.now().isoformat(),
-                    'monitored_files': len(self.file_positions),
-                    'file_positions': self.file_positions.copy(),
-                    'pending_logs': {source: len(logs) for source, logs in self.collected_logs.items()},
-                    'total_pending': sum(len(logs) for logs in self.collected_logs.values())
+                    'monitored_files': len(positions),
+                    'file_positions': positions,
+                    'pending_logs': pending,
+                    'total_pending': sum(pending.values()),
+                    'buffer': self.buffer.stats(),
+                    'reader': self.reader.stats(),
+                    'segments': self.segments.stats(),
+                    'transport': self.transport.stats() if self.transport else None,
+                    'watcher': self.watcher.stats() if self.watcher else None,
+                    'checkpoints': self.checkpoints.stats()
                 }
                 
                 stats_file = os.path.join(self.output_directory, 'collection_stats.json')
@@ -180,7 +331,25 @@ class LogCollector:
         finally:
             self.running = False
             logger.info("Log collector shutting down")
+            self.buffer.close()
+            
+            # Ship what is still pending, seal the open segments and persist the final positions
+            try:
+                self.flush_collected_logs(seal=True)
+            except Exception as e:
+                logger.error(f"Final flush error: {str(e)}")
+            if self.transport:
+                self.transport.close()
+
+def signal_handler(sig, frame):
+    """Handle shutdown signals gracefully"""
+    logger.info("Received shutdown signal, cleaning up...")
+    sys.exit(0)
 
 if __name__ == '__main__':
+    # Setup signal handlers (the pending logs and checkpoints are flushed on the way out)
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    
     collector = LogCollector()
     collector.run()
\ No newline at end of file
@@ -4,9 +4,21 @@ import time
 import os
 import logging
 import threading
-import re
 from datetime import datetime
 import glob
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from log_segment import open_segment, segment_source, fsync_directory
+from log_transport import TransportServer, DEFAULT_ADDRESS
+from log_rules import Rules
+from log_record import RECORD_SEPARATOR, ESCAPED_SEPARATOR, WHITESPACE, parse_header, parse_line, batch_after, event_time
+from log_metrics import ProcessorMetrics, MetricsServer, DEFAULT_PORT
+from log_store import LogStore, entry_rows, file_origin, DEFAULT_RETENTION_DAYS
+from log_rollup import Rollups, RollupWriter, DEFAULT_DELAY_SECONDS
+from log_template import TemplateCompactor, DEFAULT_WINDOW_SECONDS
 
 # Configure logging
 logging.basicConfig(
@@ -16,23 +28,109 @@ logging.basicConfig(
 
 logger = logging.getLogger('log-processor')
 
+# Files are processed this many lines at a time, so memory does not grow with their size
+PROCESS_CHUNK_LINES = 1000
+WRITE_BUFFER_BYTES = 1024**2
+
+# With LOG_PROCESSOR_WORKERS > 1, files are cut into chunks of this many lines for the pool,
+# with up to POOL_TASKS_PER_WORKER chunks in flight per worker
+POOL_CHUNK_LINES = 5000
+POOL_TASKS_PER_WORKER = 2
+
+# Closed rollup minutes are written this often
+ROLLUP_WRITE_INTERVAL = 15
+
+# The lag of one processed entry in LAG_SAMPLE_LINES is observed, the first of each chunk included:
+# it is the distribution that matters, and timestamps cost about as much to parse as the rest of a line
+LAG_SAMPLE_LINES = 10
+
+# A collected file being processed is renamed to .claimed_<name>, which the collected_* glob does not match
+CLAIM_PREFIX = '.claimed_'
+
+# The LogProcessor whose rules the pool workers apply; they inherit it when forked
+pool_processor = None
+
+def init_worker(directories=None):
+    """Pool worker: a lock held by one of the parent's threads when it forked would stay held in the copy
+    
+    Workers started by the forkserver (directories given) build their own
+    LogProcessor instead, from the same environment.
+    """
+    global pool_processor
+    if directories:
+        pool_processor = LogProcessor(*directories, workers=1)
+    pool_processor.template_lock = threading.Lock()
+
+def process_chunk(lines, source, origin, first_line, batch):
+    """Pool worker: chunk_result() of a chunk of collected lines"""
+    lag = pool_processor.metrics.lag_histogram()
+    processed_logs = pool_processor.process_lines(lines, source, origin, first_line, batch, lag)
+    return pool_processor.chunk_result(processed_logs, source, origin, lag)
+
 class LogProcessor:
-    def __init__(self):
-        self.input_directory = '/collected-logs'
-        self.output_directory = '/processed-logs'
+    def __init__(self, input_directory='/collected-logs', output_directory='/processed-logs', workers=None):
+        self.input_directory = input_directory
+        self.output_directory = output_directory
+        self.workers = workers or int(os.environ.get('LOG_PROCESSOR_WORKERS', '1'))
+        self.pool = None
         self.running = True
         self.processed_count = 0
+        self.count_lock = threading.Lock()
+        
+        # Live metrics (log_metrics.py), served on LOG_METRICS_PORT unless it is 0
+        self.metrics = ProcessorMetrics()
+        self.metrics_server = None
+        metrics_port = int(os.environ.get('LOG_METRICS_PORT', str(DEFAULT_PORT)))
+        if metrics_port:
+            self.metrics_server = MetricsServer(metrics_port, self.render_metrics, os.environ.get('LOG_METRICS_HOST', '0.0.0.0'))
+        
+        # LOG_STORE=<path of a SQLite database> also adds the processed entries to an indexed store (log_store.py)
+        self.store = None
+        if os.environ.get('LOG_STORE'):
+            self.store = LogStore(os.environ['LOG_STORE'],
+                                  int(os.environ.get('LOG_STORE_RETENTION_DAYS', str(DEFAULT_RETENTION_DAYS))))
+        
+        # Per-minute rollups of access, database and job logs (log_rollup.py), unless LOG_ROLLUP_DIRECTORY is empty
+        self.rollup_writer = None
+        rollup_directory = os.environ.get('LOG_ROLLUP_DIRECTORY', os.path.join(self.output_directory, 'rollups'))
+        if rollup_directory:
+            self.rollup_writer = RollupWriter(rollup_directory,
+                                              int(os.environ.get('LOG_ROLLUP_DELAY_SECONDS', str(DEFAULT_DELAY_SECONDS))))
+        
+        # LOG_TEMPLATE_MODE=template|collapse writes text messages as mined templates (log_template.py)
+        self.templates = None
+        self.template_lock = threading.Lock()
+        self.known_templates = set()
+        self.template_counts = {}
+        self.templates_file = os.path.join(self.output_directory, 'templates.ndjson')
+        template_mode = os.environ.get('LOG_TEMPLATE_MODE', 'off')
+        if template_mode != 'off':
+            self.templates = TemplateCompactor(template_mode,
+                                               int(os.environ.get('LOG_TEMPLATE_WINDOW_SECONDS', str(DEFAULT_WINDOW_SECONDS))))
+            self.templates.miner.max_templates = int(os.environ.get('LOG_TEMPLATE_MAX', str(self.templates.miner.max_templates)))
+            self.load_templates()
+        
+        # LOG_TRANSPORT=socket also accepts batches streamed by the collector
+        self.transport = None
+        if os.environ.get('LOG_TRANSPORT', 'file') == 'socket':
+            self.transport = TransportServer(os.environ.get('LOG_TRANSPORT_ADDRESS', DEFAULT_ADDRESS), self.process_batch)
         
         # Ensure output directory exists
         os.makedirs(self.output_directory, exist_ok=True)
         
-        # Log processing rules
+        # Routes and message classifiers (log_rules.py), compiled once
+        self.rules = Rules()
+        self.classify_level = self.rules.classifier('log_level')
+        self.classify_error_type = self.rules.classifier('error_type')
+        self.classify_component = self.rules.classifier('component')
+        
+        # Log processing rules, by the category a source is routed to
         self.processing_rules = {
-            'access.log': self.process_access_logs,
-            'error.log': self.process_error_logs,
-            'application.log': self.process_application_logs,
-            'database-queries.log': self.process_database_logs,
-            'job-execution.log': self.process_job_logs
+            'access': self.process_access_logs,
+            'error': self.process_error_logs,
+            'application': self.process_application_logs,
+            'database': self.process_database_logs,
+            'job': self.process_job_logs
         }
         
         # Log level mapping
@@ -45,23 +143,10 @@ class LogProcessor:
         }
     
     def extract_log_level(self, message):
-        """Extract log level from message"""
-        level_patterns = {
-            'ERROR': r'\b(error|exception|failed|failure)\b',
-            'WARNING': r'\b(warn|warning|deprecated)\b',
-            'DEBUG': r'\b(debug|trace)\b',
-            'INFO': r'\b(info|started|completed|success)\b'
-        }
-        
-        message_lower = message.lower()
-        
-        for level, pattern in level_patterns.items():
-            if re.search(pattern, message_lower):
-                return level
-        
-        return 'INFO'  # Default level
+        """Extract log level from message (INFO by default)"""
+        return self.classify_level(message)
     
-    def process_access_logs(self, log_entry):
+    def process_access_logs(self, log_entry, processed_at=None):
         """Process access log entries"""
         processed = log_entry.copy()
         
@@ -76,7 +161,7 @@ class LogProcessor:
             processed.update({
                 'log_category': 'access',
                 'log_level': 'INFO',
-                'processed_at': datetime.now().isoformat()
+                'processed_at': processed_at or datetime.now().isoformat()
             })
             
             # Extract additional fields
@@ -99,7 +184,7 @@ class LogProcessor:
         
         return processed
     
-    def process_error_logs(self, log_entry):
+    def process_error_logs(self, log_entry, processed_at=None):
         """Process error log entries"""
         processed = log_entry.copy()
         
@@ -107,20 +192,12 @@ class LogProcessor:
             processed.update({
                 'log_category': 'error',
                 'log_level': 'ERROR',
-                'processed_at': datetime.now().isoformat(),
+                'processed_at': processed_at or datetime.now().isoformat(),
                 'severity': 'high'
             })
             
             # Extract error patterns
-            message = processed.get('message', '')
-            if 'timeout' in message.lower():
-                processed['error_type'] = 'timeout'
-            elif 'connection' in message.lower():
-                processed['error_type'] = 'connection'
-            elif 'validation' in message.lower():
-                processed['error_type'] = 'validation'
-            else:
-                processed['error_type'] = 'unknown'
+            processed['error_type'] = self.classify_error_type(processed.get('message', ''))
             
         except Exception as e:
             logger.warning(f"Failed to process error log: {str(e)}")
@@ -128,7 +205,7 @@ class LogProcessor:
         
         return processed
     
-    def process_application_logs(self, log_entry):
+    def process_application_logs(self, log_entry, processed_at=None):
         """Process application log entries"""
         processed = log_entry.copy()
         
@@ -141,16 +218,11 @@ class LogProcessor:
             processed.update({
                 'log_category': 'application',
                 'log_level': log_level,
-                'processed_at': datetime.now().isoformat()
+                'processed_at': processed_at or datetime.now().isoformat()
             })
             
             # Extract component name if present
-            if 'web-api' in message:
-                processed['component'] = 'web-api'
-            elif 'background' in message:
-                processed['component'] = 'background-task'
-            else:
-                processed['component'] = 'unknown'
+            processed['component'] = self.classify_component(message)
             
         except Exception as e:
             logger.warning(f"Failed to process application log: {str(e)}")
@@ -158,7 +230,7 @@ class LogProcessor:
         
         return processed
     
-    def process_database_logs(self, log_entry):
+    def process_database_logs(self, log_entry, processed_at=None):
         """Process database log entries"""
         processed = log_entry.copy()
         
@@ -172,7 +244,7 @@ class LogProcessor:
             processed.update({
                 'log_category': 'database',
                 'log_level': 'INFO',
-                'processed_at': datetime.now().isoformat()
+                'processed_at': processed_at or datetime.now().isoformat()
             })
             
             # Classify query performance
@@ -194,7 +266,7 @@ class LogProcessor:
         
         return processed
     
-    def process_job_logs(self, log_entry):
+    def process_job_logs(self, log_entry, processed_at=None):
         """Process job execution log entries"""
         processed = log_entry.copy()
         
@@ -208,7 +280,7 @@ class LogProcessor:
             processed.update({
                 'log_category': 'job',
                 'log_level': 'INFO',
-                'processed_at': datetime.now().isoformat()
+                'processed_at': processed_at or datetime.now().isoformat()
             })
             
             # Set log level based on job status
@@ -226,71 +298,417 @@ class LogProcessor:
         
         return processed
     
-    def process_log_file(self, file_path):
-        """Process a collected log file"""
-        filename = os.path.basename(file_path)
-        logger.info(f"Processing log file: {filename}")
+    def process_lines(self, lines, source, origin, first_line=1, batch=None, lag=None):
+        """Process collected lines of one source (counted by the caller once written)
         
-        try:
-            processed_logs = []
-            
-            with open(file_path, 'r') as f:
-                for line_num, line in enumerate(f, 1):
-                    if line.strip():
-                        try:
-                            log_entry = json.loads(line.strip())
-                            
-                            # Find appropriate processor
-                            processor = None
-                            for log_type, proc_func in self.processing_rules.items():
-                                if log_type in filename:
-                                    processor = proc_func
-                                    break
-                            
-                            if processor:
-                                processed_log = processor(log_entry)
-                            else:
-                                # Default processing
-                                processed_log = log_entry.copy()
-                                processed_log.update({
-                                    'log_category': 'unknown',
-                                    'log_level': 'INFO',
-                                    'processed_at': datetime.now().isoformat()
-                                })
-                            
-                            processed_logs.append(processed_log)
-                            
-                        except json.JSONDecodeError:
-                            logger.warning(f"Invalid JSON on line {line_num} in {filename}")
-                        except Exception as e:
-                            logger.error(f"Error processing line {line_num} in {filename}: {str(e)}")
+        Lines are batch headers and raw log lines (log_record.py); batch is
+        the header in effect before the first line when lines continue a batch.
+        The lags of a sample of the lines that tell when they were logged are
+        observed into the lag histogram, if one is given.
+        """
+        # Find appropriate processor, once for all the lines
+        processor = self.processing_rules.get(self.rules.route(source))
+        now = datetime.now()
+        processed_at = now.isoformat()
+        
+        processed_logs = []
+        for line_num, line in enumerate(lines, first_line):
+            if line.startswith(RECORD_SEPARATOR):
+                if not line.startswith(ESCAPED_SEPARATOR):
+                    batch = parse_header(line)
+                    continue
+                line = line[len(RECORD_SEPARATOR):]
             
-            # Write processed logs
-            output_file = os.path.join(self.output_directory, f"processed_{filename}")
-            with open(output_file, 'w') as f:
-                for log_entry in processed_logs:
-                    f.write(json.dumps(log_entry) + '\n')
+            line = line.strip(WHITESPACE)
+            if line:
+                try:
+                    log_entry = parse_line(line)
+                    if batch:
+                        log_entry['source_file'] = batch['source_file']
+                        log_entry['collected_at'] = batch['collected_at']
+                    
+                    if lag is not None and not len(processed_logs) % LAG_SAMPLE_LINES:
+                        logged = event_time(log_entry)
+                        if logged is not None:
+                            lag.observe(max((now - logged).total_seconds(), 0.0))
+                    
+                    if processor:
+                        processed_log = processor(log_entry, processed_at)
+                    else:
+                        # Default processing
+                        processed_log = log_entry.copy()
+                        processed_log.update({
+                            'log_category': 'unknown',
+                            'log_level': 'INFO',
+                            'processed_at': processed_at
+                        })
+                    
+                    processed_logs.append(processed_log)
+                    
+                except Exception as e:
+                    logger.error(f"Error processing line {line_num} in {origin}: {str(e)}")
+        
+        return processed_logs
+    
+    def count_processed(self, count):
+        with self.count_lock:
+            self.processed_count += count
+    
+    def store_entries(self, rows):
+        """Add rows to the store; it only indexes the processed files, so an error does not fail them"""
+        try:
+            self.store.add(rows)
+        except Exception as e:
+            logger.error(f"Log store error: {str(e)}")
+    
+    def chunk_result(self, processed_logs, source, origin, lag=None):
+        """What is written for processed entries: their NDJSON output, entry count, lag histogram,
+        store rows, rollups and new templates (None without a store, rollups or templates)
+        
+        The store and the rollups get the entries whole, templates or not.
+        """
+        result = {'count': len(processed_logs), 'lag': lag, 'rows': None, 'rollups': None, 'templates': None}
+        
+        texts = [json.dumps(log_entry) for log_entry in processed_logs] if self.store or not self.templates else None
+        if self.store:
+            result['rows'] = entry_rows(processed_logs, texts, file_origin(origin))
+        
+        if self.templates:
+            with self.template_lock:
+                counts = self.templates.counts()
+                records = self.templates.compact(processed_logs)
+                result['templates'] = self.templates.miner.take_new()
+                result['template_counts'] = {name: count - counts[name] for name, count in self.templates.counts().items()}
+            result['text'] = ''.join(json.dumps(record) + '\n' for record in records)
+        else:
+            result['text'] = ''.join(text + '\n' for text in texts)
+        
+        if self.rollup_writer:
+            result['rollups'] = Rollups()
+            result['rollups'].add_entries(self.category(source), processed_logs)
+        return result
+    
+    def load_templates(self):
+        """Ids of the templates already in templates.ndjson"""
+        try:
+            with open(self.templates_file, 'r') as f:
+                for line in f:
+                    try:
+                        self.known_templates.add(json.loads(line)['template_id'])
+                    except (json.JSONDecodeError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+    
+    def write_templates(self, result):
+        """Add a chunk_result()'s new templates to templates.ndjson, before any output that refers to them is committed"""
+        with self.template_lock:
+            for name, count in result['template_counts'].items():
+                self.template_counts[name] = self.template_counts.get(name, 0) + count
             
-            logger.info(f"Processed {len(processed_logs)} log entries from {filename}")
-            self.processed_count += len(processed_logs)
+            new_templates = {template_id: template for template_id, template in result['templates'].items()
+                             if template_id not in self.known_templates}
+            if not new_templates:
+                return
             
-            # Remove processed file
-            os.remove(file_path)
+            with open(self.templates_file, 'a') as f:
+                f.write(''.join(json.dumps({'template_id': template_id, 'template': template}) + '\n'
+                                for template_id, template in new_templates.items()))
+                f.flush()
+                os.fsync(f.fileno())
+            self.known_templates.update(new_templates)
+    
+    def template_stats(self):
+        with self.template_lock:
+            stats = {'mode': self.templates.mode, 'templates': len(self.known_templates)}
+            stats.update(self.template_counts)
+        return stats
+    
+    def write_chunk(self, job, result):
+        """Write a chunk_result() to a claimed file's output"""
+        if self.templates:
+            self.write_templates(result)
+        job['output'].write(result['text'])
+        job['count'] += result['count']
+        if result['rows']:
+            self.store_entries(result['rows'])
+        if result['rollups']:
+            job['rollups'].merge(result['rollups'])
+        self.metrics.record_lines(self.category(job['source']), result['count'], result['lag'])
+    
+    def category(self, source):
+        """Category of a source, as labelled in the metrics"""
+        return self.rules.route(source) or 'unknown'
+    
+    def claim_file(self, file_path):
+        """Claim a collected file and open its temporary output; the job, or None if it is already claimed
+        
+        The file is renamed to .claimed_<name>, so no other pass picks it up.
+        """
+        filename = os.path.basename(file_path)
+        claimed_path = os.path.join(os.path.dirname(file_path), f"{CLAIM_PREFIX}{filename}")
+        try:
+            os.rename(file_path, claimed_path)
+        except FileNotFoundError:
+            return None
+        
+        output_name = filename[:-len('.gz')] if filename.endswith('.gz') else filename
+        job = {
+            'file_path': file_path,
+            'filename': filename,
+            'source': segment_source(filename) or filename,
+            'claimed_path': claimed_path,
+            'output_file': os.path.join(self.output_directory, f"processed_{output_name}"),
+            'temporary_file': os.path.join(self.output_directory, f".processed_{output_name}.tmp"),
+            'output': None,
+            'count': 0,
+            'error': None,
+            'claimed_at': time.monotonic(),
+            # Rolled up as processed, and merged into the writer's once committed
+            'rollups': Rollups() if self.rollup_writer else None
+        }
+        try:
+            job['output'] = open(job['temporary_file'], 'w', buffering=WRITE_BUFFER_BYTES)
+        except OSError as e:
+            job['error'] = e
+            self.finish_file(job)
+            return None
+        
+        logger.info(f"Processing log file: {filename}")
+        return job
+    
+    def read_chunks(self, job, chunk_lines):
+        """(lines, number of the first line, batch header before them) of a claimed file, chunk_lines at a time"""
+        # Sealed segments are complete and never written again, gzipped or not
+        with open_segment(job['claimed_path']) as f:
+            line_num = 1
+            batch = None
+            while True:
+                chunk = list(islice(f, chunk_lines))
+                if not chunk:
+                    return
+                yield chunk, line_num, batch
+                line_num += len(chunk)
+                batch = batch_after(chunk, batch)
+    
+    def finish_file(self, job):
+        """Commit the output of a claimed file and remove it, or give it back if processing failed
+        
+        The output is fsynced and renamed into place before the input is
+        removed, so a crash leaves either the claimed input, processed
+        again at the next start, or the complete output.
+        """
+        try:
+            if job['error'] is None:
+                job['output'].flush()
+                os.fsync(job['output'].fileno())
+                job['output'].close()
+                os.rename(job['temporary_file'], job['output_file'])
+                fsync_directory(self.output_directory)
+                os.remove(job['claimed_path'])
+                fsync_directory(os.path.dirname(job['claimed_path']))
+                
+                self.count_processed(job['count'])
+                if job['rollups']:
+                    self.rollup_writer.merge(job['rollups'])
+                self.metrics.record_file(time.monotonic() - job['claimed_at'])
+                logger.info(f"Processed {job['count']} log entries from {job['filename']}")
+                return job['count']
+        except Exception as e:
+            job['error'] = e
+        
+        logger.error(f"Error processing file {job['file_path']}: {str(job['error'])}")
+        self.metrics.record_file(time.monotonic() - job['claimed_at'], committed=False)
+        
+        # Give the file back for the next pass, which adds its entries to the store again
+        try:
+            if self.store:
+                self.store.remove(file_origin(job['filename']))
+            if job['output'] is not None:
+                job['output'].close()
+            if os.path.exists(job['temporary_file']):
+                os.remove(job['temporary_file'])
+            os.rename(job['claimed_path'], job['file_path'])
+        except OSError as e:
+            logger.error(f"Error releasing file {job['claimed_path']}: {str(e)}")
+        return 0
+    
+    def process_log_file(self, file_path):
+        """Process a collected log file, PROCESS_CHUNK_LINES at a time"""
+        job = self.claim_file(file_path)
+        if job is None:
+            return 0
+        
+        try:
+            for chunk, line_num, batch in self.read_chunks(job, PROCESS_CHUNK_LINES):
+                lag = self.metrics.lag_histogram()
+                processed_logs = self.process_lines(chunk, job['source'], job['filename'], line_num, batch, lag)
+                self.write_chunk(job, self.chunk_result(processed_logs, job['source'], job['filename'], lag))
+        except Exception as e:
+            job['error'] = e
+        return self.finish_file(job)
+    
+    def process_files_parallel(self, file_paths):
+        """Process collected files on the worker pool
+        
+        Files are claimed and read here, in order, and cut into chunks of
+        POOL_CHUNK_LINES that the workers process concurrently, across
+        files as well as within a large one. Results are written in the
+        order the chunks were cut, so every output keeps the order of its
+        input and the files of a source are committed oldest first.
+        """
+        pending = deque()
+        in_flight = self.workers * POOL_TASKS_PER_WORKER
+        total = 0
+        
+        for file_path in file_paths:
+            job = self.claim_file(file_path)
+            if job is None:
+                continue
             
-            return len(processed_logs)
+            try:
+                for chunk, line_num, batch in self.read_chunks(job, POOL_CHUNK_LINES):
+                    while len(pending) >= in_flight:
+                        total += self.write_result(*pending.popleft())
+                    pending.append((self.pool.submit(process_chunk, chunk, job['source'], job['filename'],
+                                                     line_num, batch), job))
+            except BrokenProcessPool as e:
+                # The pool broke before this file's chunks could be submitted
+                job['error'] = e
+                self.pool_broken = True
+            except Exception as e:
+                job['error'] = e
             
+            # Marks the end of the file: it is committed once its last chunk is written
+            pending.append((None, job))
+        
+        while pending:
+            total += self.write_result(*pending.popleft())
+        return total
+    
+    def write_result(self, future, job):
+        """Write a chunk's output to its file, or commit the file at its end marker"""
+        if future is None:
+            return self.finish_file(job)
+        
+        try:
+            result = future.result()
+            if job['error'] is None:
+                self.write_chunk(job, result)
+        except BrokenProcessPool as e:
+            # A worker died; the pool is replaced after this pass
+            job['error'] = e
+            self.pool_broken = True
         except Exception as e:
-            logger.error(f"Error processing file {file_path}: {str(e)}")
-            return 0
+            job['error'] = e
+        return 0
+    
+    def start_pool(self, restart=False):
+        """Start the worker processes
+        
+        The first pool is started before any thread, so its workers are
+        forked from this process. A pool replacing a broken one is started
+        with the threads running: its workers come from a forkserver and
+        set up their own LogProcessor (init_worker).
+        """
+        global pool_processor
+        pool_processor = self
+        self.pool_broken = False
+        if restart:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('forkserver'),
+                                            initializer=init_worker, initargs=((self.input_directory, self.output_directory),))
+        else:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('fork'),
+                                            initializer=init_worker)
+        
+        # With fork, the first task starts every worker (the forkserver starts them as needed)
+        self.pool.submit(os.getpid).result()
+        logger.info(f"Processing files with {self.workers} worker processes")
+    
+    def recover_claims(self):
+        """Give back the files claimed by a run that stopped before committing them"""
+        for claimed_path in glob.glob(os.path.join(self.input_directory, f"{CLAIM_PREFIX}collected_*")):
+            original_path = os.path.join(self.input_directory, os.path.basename(claimed_path)[len(CLAIM_PREFIX):])
+            os.rename(claimed_path, original_path)
+            if self.store:
+                self.store.remove(file_origin(original_path))
+            logger.info(f"Recovered claimed file {os.path.basename(original_path)}")
+        
+        # Their partial outputs are written again
+        for temporary_file in glob.glob(os.path.join(self.output_directory, '.processed_*.tmp')):
+            os.remove(temporary_file)
+    
+    def process_batch(self, source, data):
+        """Process a batch streamed by the collector
+        
+        The collector forgets the batch once this returns (the batch is
+        acknowledged), so the output is fsynced first. Exceptions leave it
+        unacknowledged and the collector spools it to a segment instead.
+        """
+        # Split on newlines only: splitlines() would also split on the header's record separator
+        lines = bytes(data).decode('utf-8', errors='replace').split('\n')
+        lag = self.metrics.lag_histogram()
+        processed_logs = self.process_lines(lines, source, f"streamed {source}", lag=lag)
+        result = self.chunk_result(processed_logs, source, f"stream_{source}", lag)
+        if self.templates:
+            self.write_templates(result)
+        
+        output_file = os.path.join(self.output_directory, f"processed_stream_{source}")
+        with open(output_file, 'a') as f:
+            f.write(result['text'])
+            f.flush()
+            os.fsync(f.fileno())
+        
+        if result['rows']:
+            self.store_entries(result['rows'])
+        if result['rollups']:
+            self.rollup_writer.merge(result['rollups'])
+        
+        self.count_processed(len(processed_logs))
+        self.metrics.record_lines(self.category(source), len(processed_logs), lag)
+        self.metrics.record_batch()
+        logger.debug(f"Processed {len(processed_logs)} streamed log entries from {source}")
+        return len(processed_logs)
+    
+    def backlog(self):
+        """(pending files, claimed files, bytes, age of the oldest in seconds) of the collected files not processed yet"""
+        pending = claimed = size = 0
+        oldest = None
+        for path in glob.glob(os.path.join(self.input_directory, '*collected_*')):
+            filename = os.path.basename(path)
+            if filename.startswith(CLAIM_PREFIX):
+                claimed += 1
+            elif segment_source(filename):
+                pending += 1
+            else:
+                continue
+            
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            size += stat.st_size
+            oldest = stat.st_mtime if oldest is None else min(oldest, stat.st_mtime)
+        
+        return pending, claimed, size, 0 if oldest is None else max(time.time() - oldest, 0)
+    
+    def render_metrics(self):
+        return self.metrics.render(self.backlog(), self.workers)
     
     def process_logs(self):
         """Process collected log files"""
         while self.running:
             try:
-                # Find collected log files
-                collected_files = glob.glob(os.path.join(self.input_directory, 'collected_*.log'))
+                # Find sealed segments (open ones are hidden .collected_*.open files), oldest first
+                collected_files = sorted(path for path in glob.glob(os.path.join(self.input_directory, 'collected_*'))
+                                         if segment_source(os.path.basename(path)))
                 
-                if collected_files:
+                if collected_files and self.pool:
+                    self.process_files_parallel(collected_files)
+                    if self.pool_broken:
+                        self.pool.shutdown(cancel_futures=True)
+                        self.start_pool(restart=True)
+                elif collected_files:
                     for file_path in collected_files:
                         self.process_log_file(file_path)
                 else:
@@ -300,6 +718,15 @@ class LogProcessor:
                 logger.error(f"Log processing error: {str(e)}")
                 time.sleep(10)
     
+    def write_rollups(self):
+        """Write the rollup minutes older than the delay"""
+        while self.running:
+            time.sleep(ROLLUP_WRITE_INTERVAL)
+            try:
+                self.rollup_writer.write()
+            except Exception as e:
+                logger.error(f"Rollup writing error: {str(e)}")
+    
     def generate_processing_stats(self):
         """Generate processing statistics"""
         while self.running:
@@ -307,8 +734,13 @@ class LogProcessor:
                 stats = {
                     'timestamp': datetime.now().isoformat(),
                     'total_processed': self.processed_count,
-                    'processing_rate_per_minute': 0,  # Could be calculated
-                    'active_processors': len(self.processing_rules)
+                    'processing_rate_per_minute': round(self.metrics.lines_per_second() * 60),
+                    'active_processors': len(self.processing_rules),
+                    'workers': self.workers,
+                    'transport': self.transport.stats() if self.transport else None,
+                    'store': self.store.stats() if self.store else None,
+                    'rollups': self.rollup_writer.stats() if self.rollup_writer else None,
+                    'templates': self.template_stats() if self.templates else None
                 }
                 
                 stats_file = os.path.join(self.output_directory, 'processing_stats.json')
@@ -327,6 +759,21 @@ class LogProcessor:
         """Start the log processor"""
         logger.info("Log processor starting up")
         
+        self.recover_claims()
+        
+        if self.workers > 1:
+            self.start_pool()
+        
+        # Streamed batches are handled as they arrive; segment files keep being processed as the fallback
+        if self.transport:
+            self.transport.start()
+        
+        if self.metrics_server:
+            try:
+                self.metrics_server.start()
+            except OSError as e:
+                logger.error(f"Metrics server error: {str(e)}")
+        
         # Start processing threads
         processing_thread = threading.Thread(target=self.process_logs, daemon=True)
         processing_thread.start()
@@ -334,6 +781,10 @@ class LogProcessor:
         stats_thread = threading.Thread(target=self.generate_processing_stats, daemon=True)
         stats_thread.start()
         
+        if self.rollup_writer:
+            rollup_thread = threading.Thread(target=self.write_rollups, daemon=True)
+            rollup_thread.start()
+        
         logger.info("Log processor started")
         
         # Keep main thread alive
@@ -345,6 +796,20 @@ class LogProcessor:
         finally:
             self.running = False
             logger.info("Log processor shutting down")
+            if self.transport:
+                self.transport.close()
+            if self.metrics_server:
+                self.metrics_server.close()
+            if self.pool:
+                self.pool.shutdown(cancel_futures=True)
+            if self.store:
+                self.store.close()
+            if self.rollup_writer:
+                # The open minutes too: they would be lost otherwise
+                try:
+                    self.rollup_writer.write(everything=True)
+                except Exception as e:
+                    logger.error(f"Rollup writing error: {str(e)}")
 
 if __name__ == '__main__':
     processor = LogProcessor()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import logging
+from datetime import datetime, timedelta
+from log_store import LogStore, INDEXED_COLUMNS
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger('log-query')
+
+DURATION_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
+
+def parse_time(value):
+    """A datetime from an ISO timestamp, or from a duration before now (30s, 10m, 2h, 1d)"""
+    duration = re.fullmatch(r'(\d+(?:\.\d+)?)([smhd])', value)
+    if duration:
+        return datetime.now() - timedelta(**{DURATION_UNITS[duration.group(2)]: float(duration.group(1))})
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is neither a duration (10m) nor an ISO timestamp")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Query the indexed store of processed logs, newest entries first",
+                                     epilog="Example, 5xx on /users in the last 10 minutes: log-query.py --since 10m --status 5xx --endpoint /users")
+    parser.add_argument('--db', default=os.environ.get('LOG_STORE', '/processed-logs/logs.db'),
+                        help="Store database (LOG_STORE, /processed-logs/logs.db by default)")
+    parser.add_argument('--since', type=parse_time, help="Entries logged since a duration ago (10m) or an ISO timestamp")
+    parser.add_argument('--until', type=parse_time, help="Entries logged before a duration ago or an ISO timestamp")
+    parser.add_argument('--category', dest='log_category', help="log_category (access, error, application, database, job)")
+    parser.add_argument('--level', dest='log_level', help="log_level (DEBUG, INFO, WARNING, ERROR)")
+    parser.add_argument('--status', help="Status class (5xx), code (503) or status_category (server_error)")
+    parser.add_argument('--error-type', dest='error_type', help="error_type (timeout, connection, validation)")
+    parser.add_argument('--endpoint', help="Endpoint, with the paths under it (/users matches /users/3)")
+    parser.add_argument('--search', help="Full-text search of text messages (FTS5 syntax)")
+    parser.add_argument('--limit', type=int, default=100, help="Entries returned at most")
+    parser.add_argument('--count', action='store_true', help="Print the number of matching entries instead")
+    parser.add_argument('--ingest', nargs='+', metavar='FILE',
+                        help="Add processed NDJSON files to the store (replacing what was added from them) instead of querying")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    
+    if args.ingest:
+        store = LogStore(args.db)
+        try:
+            for path in args.ingest:
+                logger.info(f"Added {store.ingest(path)} entries from {path}")
+        except Exception as e:
+            logger.error(f"Ingest error: {str(e)}")
+            return 1
+        finally:
+            store.close()
+        return 0
+    
+    if not os.path.exists(args.db):
+        logger.error(f"No log store at {args.db}")
+        return 1
+    
+    store = LogStore(args.db, read_only=True)
+    try:
+        started = time.perf_counter()
+        result = store.query(since=args.since, until=args.until, status=args.status, search=args.search,
+                             limit=args.limit, count=args.count,
+                             **{column: getattr(args, column, None) for column in INDEXED_COLUMNS})
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    except Exception as e:
+        logger.error(f"Query error: {str(e)}")
+        return 1
+    finally:
+        store.close()
+    
+    if args.count:
+        print(result)
+    else:
+        for log_entry in result:
+            print(json.dumps(log_entry))
+    
+    logger.info(f"{result if args.count else len(result)} entries in {elapsed_ms:.1f} ms")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""Bounded queues of collected log lines, one per source file
+
+The collection thread puts the raw lines it read (undecoded bytes), the
+writing thread takes them. Each source holds at most max_entries lines;
+when a source is full put() blocks (the default), so a writer that falls
+behind slows reading down instead of growing the heap, or with
+overflow='drop_oldest' it discards the oldest lines and counts them. The
+writer is woken as soon as a source has flush_entries queued or its
+oldest line is flush_age seconds old.
+"""
+import time
+import threading
+from collections import deque
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_FLUSH_ENTRIES = 1000
+DEFAULT_FLUSH_AGE = 5.0
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest')
+
+class LogBuffer:
+    """Per-source bounded queues of raw lines with size and age flush triggers"""
+    
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, flush_entries=DEFAULT_FLUSH_ENTRIES,
+                 flush_age=DEFAULT_FLUSH_AGE, overflow='block'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}', expected one of {', '.join(OVERFLOW_POLICIES)}")
+        self.max_entries = max_entries
+        self.flush_entries = min(flush_entries, max_entries)
+        self.flush_age = flush_age
+        self.overflow = overflow
+        self.queues = {}
+        self.oldest = {}
+        self.condition = threading.Condition()
+        self.closed = False
+        self.counters = {'queued': 0, 'written': 0, 'dropped': 0, 'blocked': 0, 'blocked_seconds': 0.0}
+    
+    def put(self, source, lines):
+        """Queue lines of a source, waiting for room while it is full"""
+        with self.condition:
+            queue = self.queues.setdefault(source, deque())
+            for line in lines:
+                if len(queue) >= self.max_entries and not self.closed:
+                    if self.overflow == 'drop_oldest':
+                        queue.popleft()
+                        self.counters['dropped'] += 1
+                    else:
+                        self.counters['blocked'] += 1
+                        started = time.monotonic()
+                        self.condition.notify_all()
+                        while len(queue) >= self.max_entries and not self.closed:
+                            self.condition.wait()
+                        self.counters['blocked_seconds'] += time.monotonic() - started
+                
+                if not queue:
+                    # Lets a waiting writer schedule the age trigger of this line
+                    self.oldest[source] = time.monotonic()
+                    self.condition.notify_all()
+                queue.append(line)
+                self.counters['queued'] += 1
+            
+            if len(queue) >= self.flush_entries:
+                self.condition.notify_all()
+    
+    def due_in(self):
+        """Seconds until a source has to be flushed, 0 if one already has to"""
+        now = time.monotonic()
+        due = None
+        for source, queue in self.queues.items():
+            if not queue:
+                continue
+            if len(queue) >= self.flush_entries:
+                return 0
+            remaining = max(0, self.oldest[source] + self.flush_age - now)
+            due = remaining if due is None else min(due, remaining)
+        return due
+    
+    def wait_ready(self, timeout):
+        """Wait until a source reaches a flush trigger, the buffer is closed or timeout passes"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while not self.closed:
+                due = self.due_in()
+                if due == 0:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining if due is None else min(due, remaining))
+            return True
+    
+    def take(self):
+        """All queued lines as (source, batch) pairs, sources taking turns a batch at a time"""
+        with self.condition:
+            batches = []
+            queues = [(source, queue) for source, queue in self.queues.items() if queue]
+            while queues:
+                for source, queue in queues:
+                    batch = [queue.popleft() for _ in range(min(self.flush_entries, len(queue)))]
+                    batches.append((source, batch))
+                queues = [(source, queue) for source, queue in queues if queue]
+            self.condition.notify_all()
+            return batches
+    
+    def written(self, count):
+        with self.condition:
+            self.counters['written'] += count
+    
+    def close(self):
+        """Stop blocking producers; lines put from now on are kept beyond the bound"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+    
+    def depths(self):
+        with self.condition:
+            return {source: len(queue) for source, queue in self.queues.items()}
+    
+    def stats(self):
+        with self.condition:
+            return dict(self.counters,
+                        blocked_seconds=round(self.counters['blocked_seconds'], 3),
+                        max_entries=self.max_entries,
+                        overflow=self.overflow)
\ No newline at end of file
@@ -0,0 +1,129 @@
+"""Read positions of the tailed log files, persisted across collector restarts
+
+Positions are keyed by the file's identity (device and inode) rather than
+its path, so a renamed file keeps its offset and a new file created at the
+same path (rotation) starts from zero. A crc32 of the first bytes guards
+against inode reuse and against files truncated and rewritten between two
+reads.
+
+The collector only marks positions whose lines were handed off; save()
+writes a snapshot atomically (temporary file, fsync, rename) and is called
+once per write cycle, so at most one batch is shipped twice after a crash.
+"""
+import os
+import json
+import zlib
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger('log-collector')
+
+CHECKPOINT_VERSION = 1
+
+# Bytes at the start of a file hashed into its fingerprint
+FINGERPRINT_BYTES = 256
+
+def file_key(stat):
+    """Identity of a file that survives renames"""
+    return f"{stat.st_dev}:{stat.st_ino}"
+
+def fingerprint(f, offset):
+    """(length, crc32) of the first bytes of an open binary file, up to offset"""
+    length = min(FINGERPRINT_BYTES, offset)
+    head = os.pread(f.fileno(), length, 0)
+    return [len(head), zlib.crc32(head)]
+
+class Checkpoints:
+    """Offsets of the tailed files by device and inode, with the path each was last seen at"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.lock = threading.Lock()
+        self.saved = None
+        self.counters = {'saves': 0, 'truncations': 0, 'rotations': 0, 'replaced': 0, 'resumed': 0}
+        self.load()
+    
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring unreadable checkpoint file {self.path}: {str(e)}")
+            return
+        
+        if data.get('version') == CHECKPOINT_VERSION:
+            self.files = data.get('files', {})
+            self.counters['resumed'] = len(self.files)
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.files.get(key)
+            return dict(entry) if entry else None
+    
+    def key_at(self, path):
+        """Key of the file last seen at path, or None"""
+        with self.lock:
+            return next((key for key, entry in self.files.items() if entry['path'] == path), None)
+    
+    def update(self, key, path, offset, fingerprint):
+        with self.lock:
+            entry = self.files.get(key)
+            if entry and (entry['path'], entry['offset'], entry['fingerprint']) == (path, offset, fingerprint):
+                return
+            self.files[key] = {
+                'path': path,
+                'offset': offset,
+                'fingerprint': fingerprint,
+                'updated_at': datetime.now().isoformat()
+            }
+    
+    def remove(self, key):
+        with self.lock:
+            self.files.pop(key, None)
+    
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+    
+    def snapshot(self):
+        """Copy of the positions, to be saved once the lines before them are written"""
+        with self.lock:
+            return {key: dict(entry) for key, entry in self.files.items()}
+    
+    def positions(self):
+        """Offset by path, for the collection stats"""
+        with self.lock:
+            return {entry['path']: entry['offset'] for entry in self.files.values()}
+    
+    def save(self, files=None):
+        """Write positions atomically unless unchanged; files defaults to the current positions"""
+        if files is None:
+            files = self.snapshot()
+        if files == self.saved:
+            return
+        
+        directory = os.path.dirname(self.path) or '.'
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump({'version': CHECKPOINT_VERSION, 'saved_at': datetime.now().isoformat(), 'files': files}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        
+        # Make the rename itself durable
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        
+        self.saved = files
+        self.count('saves')
+    
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, file=self.path, tracked_files=len(self.files))
\ No newline at end of file
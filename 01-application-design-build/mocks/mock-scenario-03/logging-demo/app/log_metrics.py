@@ -0,0 +1,257 @@
+"""Live metrics of the log processor, served in the Prometheus text format
+
+The processor records what it does as it does it: lines processed per
+category, with their rate over a sliding window, how long each collected
+file took from claim to commit, and the end-to-end lag of a sample of
+the lines, from the time they were logged to their processed_at. The
+backlog of collected files still waiting is measured when the metrics
+are scraped.
+
+MetricsServer serves them on http://<host>:<port>/metrics with the
+standard library's HTTP server, so nothing else needs to be installed.
+
+Lines are processed in chunks, often in other processes, so their lags are
+observed into a Histogram of the chunk and merged into the metrics with the
+chunk's line count, taking the lock once per chunk rather than per line.
+"""
+import time
+import logging
+import threading
+from bisect import bisect_left
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger('log-metrics')
+
+DEFAULT_PORT = 9102
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of the histogram buckets, in seconds
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+FILE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Lines per second are averaged over this many seconds
+RATE_WINDOW_SECONDS = 60
+
+class Histogram:
+    """Counts of observed values per bucket, with their sum"""
+    
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        # One count per bucket, and the last one for values above all of them
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.sum += other.sum
+        self.count += other.count
+
+class RateWindow:
+    """Events per second over the last window seconds, counted in one second slots"""
+    
+    def __init__(self, window=RATE_WINDOW_SECONDS):
+        self.window = window
+        self.slots = deque()  # [second, count]
+    
+    def add(self, count, now=None):
+        second = int(time.monotonic() if now is None else now)
+        if self.slots and self.slots[-1][0] == second:
+            self.slots[-1][1] += count
+        else:
+            self.slots.append([second, count])
+        self.expire(second)
+    
+    def expire(self, second):
+        while self.slots and self.slots[0][0] <= second - self.window:
+            self.slots.popleft()
+    
+    def rate(self, now=None):
+        self.expire(int(time.monotonic() if now is None else now))
+        return sum(count for _, count in self.slots) / self.window
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Exposition:
+    """Lines of a Prometheus text exposition"""
+    
+    def __init__(self):
+        self.lines = []
+    
+    def family(self, name, metric_type, help_text):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {metric_type}")
+    
+    def sample(self, name, value, labels=()):
+        self.lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+    
+    def histogram(self, name, histogram, labels=()):
+        labels = list(labels)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+            cumulative += count
+            self.sample(f"{name}_bucket", cumulative, labels + [('le', format_value(float(bound)))])
+        self.sample(f"{name}_sum", histogram.sum, labels)
+        self.sample(f"{name}_count", histogram.count, labels)
+    
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+class ProcessorMetrics:
+    """Counters, rates and histograms of a LogProcessor, shared by its threads"""
+    
+    def __init__(self, window=RATE_WINDOW_SECONDS):
+        self.window = window
+        self.lock = threading.Lock()
+        self.lines = {}  # category -> lines processed
+        self.rates = {}  # category -> RateWindow
+        self.lags = {}  # category -> Histogram of LAG_BUCKETS
+        self.files = {'committed': 0, 'failed': 0}
+        self.file_seconds = Histogram(FILE_BUCKETS)
+        self.batches = 0
+    
+    def lag_histogram(self):
+        """Empty histogram to observe the lags of a chunk into"""
+        return Histogram(LAG_BUCKETS)
+    
+    def record_lines(self, category, count, lag=None):
+        """Count lines of a category as processed, with the histogram of their lags"""
+        with self.lock:
+            if category not in self.lines:
+                self.lines[category] = 0
+                self.rates[category] = RateWindow(self.window)
+                self.lags[category] = Histogram(LAG_BUCKETS)
+            self.lines[category] += count
+            self.rates[category].add(count)
+            if lag is not None:
+                self.lags[category].merge(lag)
+    
+    def record_file(self, seconds, committed=True):
+        """Count a collected file as committed, with the seconds from its claim, or as failed"""
+        with self.lock:
+            if committed:
+                self.files['committed'] += 1
+                self.file_seconds.observe(seconds)
+            else:
+                self.files['failed'] += 1
+    
+    def record_batch(self):
+        with self.lock:
+            self.batches += 1
+    
+    def lines_per_second(self):
+        """Lines processed per second over the window, all categories together"""
+        with self.lock:
+            return sum(rate.rate() for rate in self.rates.values())
+    
+    def render(self, backlog=None, workers=None):
+        """Prometheus text exposition of the metrics
+        
+        backlog is the processor's (pending files, claimed files, bytes,
+        age of the oldest file in seconds), measured by the caller.
+        """
+        exposition = Exposition()
+        with self.lock:
+            categories = sorted(self.lines)
+            
+            exposition.family('log_processor_lines_total', 'counter', 'Log lines processed, by category')
+            for category in categories:
+                exposition.sample('log_processor_lines_total', self.lines[category], [('category', category)])
+            
+            exposition.family('log_processor_lines_per_second', 'gauge',
+                              f"Log lines processed per second over the last {self.window} seconds, by category")
+            for category in categories:
+                exposition.sample('log_processor_lines_per_second', self.rates[category].rate(), [('category', category)])
+            
+            exposition.family('log_processor_lag_seconds', 'histogram',
+                              'Seconds from when a line was logged to its processed_at, by category')
+            for category in categories:
+                exposition.histogram('log_processor_lag_seconds', self.lags[category], [('category', category)])
+            
+            exposition.family('log_processor_file_seconds', 'histogram',
+                              'Seconds from the claim of a collected file to the commit of its output')
+            exposition.histogram('log_processor_file_seconds', self.file_seconds)
+            
+            exposition.family('log_processor_files_total', 'counter', 'Collected files processed, by result')
+            for result, count in self.files.items():
+                exposition.sample('log_processor_files_total', count, [('result', result)])
+            
+            exposition.family('log_processor_streamed_batches_total', 'counter', 'Batches streamed by the collector and processed')
+            exposition.sample('log_processor_streamed_batches_total', self.batches)
+        
+        if backlog is not None:
+            pending, claimed, size, oldest = backlog
+            exposition.family('log_processor_backlog_files', 'gauge', 'Collected files waiting to be processed, by state')
+            exposition.sample('log_processor_backlog_files', pending, [('state', 'pending')])
+            exposition.sample('log_processor_backlog_files', claimed, [('state', 'claimed')])
+            exposition.family('log_processor_backlog_bytes', 'gauge', 'Bytes of collected files waiting to be processed, as stored')
+            exposition.sample('log_processor_backlog_bytes', size)
+            exposition.family('log_processor_backlog_oldest_seconds', 'gauge', 'Age of the oldest collected file waiting to be processed')
+            exposition.sample('log_processor_backlog_oldest_seconds', float(oldest))
+        
+        if workers is not None:
+            exposition.family('log_processor_workers', 'gauge', 'Worker processes (1 without a pool)')
+            exposition.sample('log_processor_workers', workers)
+        
+        return exposition.text()
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        
+        try:
+            body = self.server.render().encode('utf-8')
+        except Exception as e:
+            logger.error(f"Metrics rendering error: {str(e)}")
+            self.send_error(500)
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        # Every scrape would be logged otherwise
+        pass
+
+class MetricsServer:
+    """HTTP server of /metrics, on a daemon thread"""
+    
+    def __init__(self, port=DEFAULT_PORT, render=None, host='0.0.0.0'):
+        self.address = (host, port)
+        self.render = render
+        self.server = None
+    
+    def start(self):
+        self.server = ThreadingHTTPServer(self.address, MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.render = self.render
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on http://{self.address[0]}:{self.server.server_address[1]}/metrics")
+    
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
\ No newline at end of file
@@ -0,0 +1,105 @@
+"""Incremental reader of the complete lines appended to a log file
+
+Lines are returned as undecoded bytes: the last newline of each chunk of a
+reused buffer, or of a memory map when the region to read is large, is found
+with rfind() and the complete part is split in one call, so a burst is never
+read into one big allocation and nothing is decoded here. A line split across chunks is carried over to the
+next chunk; a trailing line still being written is left for the next pass.
+
+Only rotated files (final reads) are mapped: a live log can be truncated
+while it is read, and touching a mapped page past its new end raises
+SIGBUS, which kills the collector instead of raising an exception.
+"""
+import os
+import mmap
+
+CHUNK_BYTES = 64 * 1024
+
+# Regions at least this large are mapped instead of read chunk by chunk
+MMAP_THRESHOLD = 1024**2
+
+class LineReader:
+    """Reads lines of binary files into bytes, one bounded region at a time"""
+    
+    def __init__(self, chunk_bytes=CHUNK_BYTES, mmap_threshold=MMAP_THRESHOLD):
+        self.buffer = bytearray(chunk_bytes)
+        self.mmap_threshold = mmap_threshold
+        self.counters = {'bytes': 0, 'lines': 0, 'mapped_reads': 0, 'chunked_reads': 0}
+    
+    def read(self, f, offset, limit, final=False):
+        """Lines from offset until about limit bytes were consumed
+        
+        Returns (lines, end) where lines are bytes without the newline and
+        end is the offset after the last line returned. A line crossing the
+        limit is returned whole. An unterminated last line is only returned
+        when final is set (a rotated file that will not grow anymore).
+        """
+        size = os.fstat(f.fileno()).st_size
+        if final and size - offset >= self.mmap_threshold:
+            lines, end = self.read_mapped(f, offset, limit, size, final)
+        else:
+            lines, end = self.read_chunked(f, offset, limit, final)
+        
+        self.counters['bytes'] += end - offset
+        self.counters['lines'] += len(lines)
+        return lines, end
+    
+    def read_mapped(self, f, offset, limit, size, final):
+        self.counters['mapped_reads'] += 1
+        
+        # Mappings start on an allocation boundary
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        lines = []
+        with mmap.mmap(f.fileno(), size - start, access=mmap.ACCESS_READ, offset=start) as mapped:
+            position = offset - start
+            length = size - start
+            
+            # Last line ending before the limit, or the end of a line longer than it
+            newline = mapped.rfind(b'\n', position, min(position + limit, length))
+            if newline < 0:
+                newline = mapped.find(b'\n', position + limit, length)
+            
+            if newline >= 0:
+                lines = mapped[position:newline].split(b'\n')
+                position = newline + 1
+            elif final and position < length:
+                lines = [mapped[position:length]]
+                position = length
+        return lines, start + position
+    
+    def read_chunked(self, f, offset, limit, final):
+        self.counters['chunked_reads'] += 1
+        
+        f.seek(offset)
+        view = memoryview(self.buffer)
+        lines = []
+        partial = bytearray()
+        base = end = offset
+        at_end = False
+        while end - offset < limit:
+            count = f.readinto(self.buffer)
+            if not count:
+                at_end = True
+                break
+            
+            newline = self.buffer.rfind(b'\n', 0, count)
+            if newline < 0:
+                partial += view[:count]
+            else:
+                chunk_lines = view[:newline].tobytes().split(b'\n')
+                if partial:
+                    chunk_lines[0] = bytes(partial) + chunk_lines[0]
+                lines.extend(chunk_lines)
+                end = base + newline + 1
+                
+                # The rest of the chunk starts a line that continues in the next one
+                partial = bytearray(view[newline + 1:count])
+            base += count
+        
+        if final and at_end and partial:
+            lines.append(bytes(partial))
+            end = base
+        return lines, end
+    
+    def stats(self):
+        return dict(self.counters)
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""Collected log records, as the collector ships them and the processor reads them
+
+The collector does not parse log lines. It ships each batch of a source
+as one header line, holding the fields shared by the whole batch,
+followed by the raw lines as they were read:
+    
+    \\x1e{"source_file": "access.log", "collected_at": "2026-10-19T05:00:00.123456"}
+    2026-10-19 05:00:00,120 - {"method": "GET", "path": "/api/users", ...}
+    2026-10-19 05:00:00,121 - web-api - INFO - Fetching 3 users
+
+Header lines start with RECORD_SEPARATOR; a raw line starting with it is
+escaped by doubling it. The processor turns each raw line into the
+fields of its record with parse_line() and adds the batch fields, so
+every line is parsed once, and timestamps are taken once per batch.
+"""
+import json
+from datetime import datetime
+
+RECORD_SEPARATOR = '\x1e'
+ESCAPED_SEPARATOR = RECORD_SEPARATOR * 2
+
+# What bytes.strip() strips; str.strip() would also take the separator and other control characters
+WHITESPACE = ' \t\n\r\x0b\x0c'
+
+# Length of logging's default asctime, '2026-10-19 05:00:00,120'
+ASCTIME_LENGTH = 23
+ASCTIME_JSON = ' - {'
+
+def encode_batch(source_file, lines, collected_at=None):
+    """Header and raw lines (bytes, without newlines) of a batch, as bytes"""
+    header = json.dumps({'source_file': source_file, 'collected_at': collected_at or datetime.now().isoformat()})
+    data = b'\n'.join(lines)
+    
+    separator = RECORD_SEPARATOR.encode('utf-8')
+    if data.startswith(separator) or b'\n' + separator in data:
+        data = b'\n'.join(separator + line if line.startswith(separator) else line for line in lines)
+    return separator + header.encode('utf-8') + b'\n' + data + b'\n'
+
+def parse_header(line):
+    """Batch fields of a header line"""
+    return json.loads(line[len(RECORD_SEPARATOR):])
+
+def is_header(line):
+    return line.startswith(RECORD_SEPARATOR) and not line.startswith(ESCAPED_SEPARATOR)
+
+def batch_after(lines, batch=None):
+    """Batch fields in effect after lines, given those in effect before them"""
+    for line in reversed(lines):
+        if is_header(line):
+            return parse_header(line)
+    return batch
+
+def parse_line(line):
+    """Fields of a raw log line (stripped text)
+    
+    A JSON object gives its fields, as does a JSON object after logging's
+    asctime (how the demo apps write access, job and query logs), with
+    the asctime kept as logged_at. Anything else is a plain text message.
+    """
+    try:
+        if line.startswith('{'):
+            return json.loads(line)
+        if line[ASCTIME_LENGTH:ASCTIME_LENGTH + len(ASCTIME_JSON)] == ASCTIME_JSON:
+            fields = json.loads(line[ASCTIME_LENGTH + len(ASCTIME_JSON) - 1:])
+            if isinstance(fields, dict):
+                fields['logged_at'] = line[:ASCTIME_LENGTH]
+                return fields
+    except json.JSONDecodeError:
+        pass
+    
+    return {'message': line, 'log_level': 'INFO'}
+
+def event_time(fields):
+    """When a record was logged, as a naive local datetime, or None if it does not say
+    
+    From its logging asctime, its own timestamp, or the asctime starting
+    a plain text message (how the demo apps write their other logs).
+    """
+    value = fields.get('logged_at') or fields.get('timestamp')
+    if value is None:
+        value = fields.get('message')
+        if not isinstance(value, str):
+            return None
+        value = value[:ASCTIME_LENGTH]
+    
+    try:
+        logged = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if logged.tzinfo is not None:
+        logged = logged.astimezone().replace(tzinfo=None)
+    return logged
\ No newline at end of file
@@ -0,0 +1,261 @@
+"""Per-minute rollups of processed access, database and job logs
+
+As entries are processed, the classifications the processor gives them
+are aggregated by the minute they were logged in, into three series:
+  
+  requests  by endpoint: responses by status_category, processing_time_ms percentiles
+  queries   by query_type: queries by status and performance_category, execution_time_ms percentiles
+  jobs      by type: jobs by status, success rate, processing_time_ms percentiles
+
+A minute is written once it is older than the rollup delay, as one
+NDJSON record per key in <series>.<YYYYMMDD>.ndjson. Entries of a minute
+already written, processed late, are written as another record marked
+late; counts add up across records.
+
+Percentiles come from a Sketch: counts of values in buckets a fixed
+ratio apart, accurate to SKETCH_RELATIVE_ERROR whatever the number of
+values, and merged by adding counts. The processor's pool workers roll
+up their chunks and the processor merges them, like the rollups of a
+file, once its output is committed.
+"""
+import os
+import math
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger('log-rollup')
+
+DEFAULT_DELAY_SECONDS = 120
+
+# Percentiles are within 1% of the exact value
+SKETCH_RELATIVE_ERROR = 0.01
+SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ERROR) / (1 - SKETCH_RELATIVE_ERROR)
+SKETCH_LOG_GAMMA = math.log(SKETCH_GAMMA)
+PERCENTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+
+# Series -> the field they are keyed by, the entry count name and the latency field
+SERIES = {
+    'requests': ('endpoint', 'requests', 'processing_time_ms'),
+    'queries': ('query_type', 'queries', 'execution_time_ms'),
+    'jobs': ('type', 'jobs', 'processing_time_ms')
+}
+
+# Statuses that end a query or a job; the others (started, queued) are counted by status only
+FINAL_STATUSES = ('completed', 'failed', 'error')
+
+def entry_minute(log_entry):
+    """Minute an entry was logged in (2026-10-19T05:00), or processed when it does not say"""
+    value = log_entry.get('logged_at') or log_entry.get('timestamp') or log_entry.get('processed_at')
+    if not isinstance(value, str) or len(value) < 16:
+        return datetime.now().strftime('%Y-%m-%dT%H:%M')
+    return value[:10] + 'T' + value[11:16]
+
+def label(value):
+    """A rollup key or status as a string: entries are JSON, and any of their values could be a list"""
+    return value if isinstance(value, str) else json.dumps(value)
+
+class Sketch:
+    """Counts of non-negative values in buckets SKETCH_GAMMA apart, for percentiles"""
+    
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def add(self, value):
+        bucket = math.ceil(math.log(value) / SKETCH_LOG_GAMMA) if value > 0 else None
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+    
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+    
+    def percentile(self, fraction):
+        rank = fraction * (self.count - 1)
+        seen = 0
+        # Zeros (bucket None) come first
+        for bucket in sorted(self.buckets, key=lambda bucket: -math.inf if bucket is None else bucket):
+            seen += self.buckets[bucket]
+            if seen > rank:
+                if bucket is None:
+                    return 0.0
+                # Middle of the bucket, in relative terms: within SKETCH_RELATIVE_ERROR of any value in it
+                return min(2 * SKETCH_GAMMA ** bucket / (SKETCH_GAMMA + 1), self.max)
+        return self.max
+    
+    def summary(self):
+        summary = {name: round(self.percentile(fraction), 2) for name, fraction in PERCENTILES}
+        summary['max'] = round(self.max, 2)
+        summary['mean'] = round(self.total / self.count, 2)
+        return summary
+
+class Aggregate:
+    """Rollup of one key in one minute"""
+    
+    def __init__(self):
+        self.count = 0
+        self.statuses = {}
+        self.categories = {}
+        self.latency = Sketch()
+    
+    def merge(self, other):
+        self.count += other.count
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        for category, count in other.categories.items():
+            self.categories[category] = self.categories.get(category, 0) + count
+        self.latency.merge(other.latency)
+
+class Rollups:
+    """Open minutes of every series: {series: {(minute, key): Aggregate}}"""
+    
+    def __init__(self):
+        self.series = {name: {} for name in SERIES}
+    
+    def aggregate(self, series, minute, key):
+        aggregates = self.series[series]
+        if (minute, key) not in aggregates:
+            aggregates[(minute, key)] = Aggregate()
+        return aggregates[(minute, key)]
+    
+    def add_entries(self, category, processed_logs):
+        """Roll up processed entries of a category; other categories than access, database and job are ignored"""
+        add = {'access': self.add_request, 'database': self.add_query, 'job': self.add_job}.get(category)
+        if add:
+            for log_entry in processed_logs:
+                add(log_entry)
+    
+    def add_request(self, log_entry):
+        # Responses: request entries are logged before the status is known
+        status_category = log_entry.get('status_category')
+        if status_category is None:
+            return
+        aggregate = self.aggregate('requests', entry_minute(log_entry), label(log_entry.get('endpoint', 'unknown')))
+        aggregate.count += 1
+        aggregate.statuses[status_category] = aggregate.statuses.get(status_category, 0) + 1
+        self.add_latency(aggregate, log_entry.get('processing_time_ms'))
+    
+    def add_query(self, log_entry):
+        status = log_entry.get('status')
+        if status is None:
+            return
+        status = label(status)
+        aggregate = self.aggregate('queries', entry_minute(log_entry), label(log_entry.get('query_type', 'unknown')))
+        aggregate.statuses[status] = aggregate.statuses.get(status, 0) + 1
+        if status in FINAL_STATUSES:
+            aggregate.count += 1
+            performance_category = log_entry.get('performance_category')
+            if performance_category:
+                performance_category = label(performance_category)
+                aggregate.categories[performance_category] = aggregate.categories.get(performance_category, 0) + 1
+            self.add_latency(aggregate, log_entry.get('execution_time_ms'))
+    
+    def add_job(self, log_entry):
+        status = log_entry.get('status')
+        # Progress steps have no status nor type
+        if status is None or 'type' not in log_entry:
+            return
+        status = label(status)
+        aggregate = self.aggregate('jobs', entry_minute(log_entry), label(log_entry['type']))
+        aggregate.statuses[status] = aggregate.statuses.get(status, 0) + 1
+        if status in FINAL_STATUSES:
+            aggregate.count += 1
+            self.add_latency(aggregate, log_entry.get('processing_time_ms'))
+    
+    def add_latency(self, aggregate, value):
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0:
+            aggregate.latency.add(value)
+    
+    def merge(self, other):
+        for name, aggregates in other.series.items():
+            for (minute, key), aggregate in aggregates.items():
+                self.aggregate(name, minute, key).merge(aggregate)
+    
+    def __bool__(self):
+        return any(self.series.values())
+
+class RollupWriter:
+    """Rollups shared by the processor's threads, written as minutes close"""
+    
+    def __init__(self, directory, delay_seconds=DEFAULT_DELAY_SECONDS):
+        self.directory = directory
+        self.delay_seconds = delay_seconds
+        self.lock = threading.Lock()
+        self.rollups = Rollups()
+        # Minutes before this one have been written: entries for them are late
+        self.closed_before = None
+        self.records_written = 0
+        self.late_records = 0
+        
+        os.makedirs(self.directory, exist_ok=True)
+    
+    def merge(self, rollups):
+        with self.lock:
+            self.rollups.merge(rollups)
+    
+    def take_closed(self, everything=False):
+        """Remove and return {series: [(minute, key, aggregate)]} of the minutes older than the delay"""
+        cutoff = (datetime.now() - timedelta(seconds=self.delay_seconds)).strftime('%Y-%m-%dT%H:%M')
+        closed = {}
+        with self.lock:
+            for name, aggregates in self.rollups.series.items():
+                keys = [key for key in aggregates if everything or key[0] < cutoff]
+                closed[name] = sorted((minute, key, aggregates.pop((minute, key))) for minute, key in keys)
+        return closed, cutoff
+    
+    def record(self, name, minute, key, aggregate):
+        key_field, count_field, latency_field = SERIES[name]
+        record = {'minute': minute, key_field: key, count_field: aggregate.count}
+        record['status_category' if name == 'requests' else 'status'] = aggregate.statuses
+        if aggregate.categories:
+            record['performance_category'] = aggregate.categories
+        if name == 'jobs' and aggregate.count:
+            record['success_rate'] = round(aggregate.statuses.get('completed', 0) / aggregate.count, 4)
+        if aggregate.latency.count:
+            record[latency_field] = aggregate.latency.summary()
+        if self.closed_before is not None and minute < self.closed_before:
+            record['late'] = True
+        return record
+    
+    def write(self, everything=False):
+        """Write the closed minutes (all with everything, at shutdown); the number of records written"""
+        closed, cutoff = self.take_closed(everything)
+        
+        files = {}
+        for name, aggregates in closed.items():
+            for minute, key, aggregate in aggregates:
+                record = self.record(name, minute, key, aggregate)
+                self.late_records += 'late' in record
+                path = os.path.join(self.directory, f"{name}.{minute[:10].replace('-', '')}.ndjson")
+                files.setdefault(path, []).append(json.dumps(record))
+        
+        for path, records in files.items():
+            with open(path, 'a') as f:
+                f.write(''.join(record + '\n' for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+        
+        count = sum(len(records) for records in files.values())
+        self.records_written += count
+        self.closed_before = max(self.closed_before or cutoff, cutoff)
+        return count
+    
+    def stats(self):
+        with self.lock:
+            open_minutes = len({minute for aggregates in self.rollups.series.values() for minute, _ in aggregates})
+        return {
+            'directory': self.directory,
+            'open_minutes': open_minutes,
+            'records_written': self.records_written,
+            'late_records': self.late_records
+        }
\ No newline at end of file
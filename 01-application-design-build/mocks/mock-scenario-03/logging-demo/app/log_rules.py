@@ -0,0 +1,125 @@
+"""Classification rules of the log processor, declared once and compiled once
+
+ROUTES maps the name of a collected source file to the category of logs
+it holds. CLASSIFIERS list, for each field the processor derives from a
+message (log level, error type, component), the values it can take with
+the words that select them, highest priority first. When several values
+match, the one listed first wins, as it did with the original chains of
+searches.
+
+A classifier matching whole words is compiled into a single regex with
+one named group per value, so a message is lowercased and scanned once
+however many values there are. A classifier matching fragments anywhere
+in the message tests them with plain substring checks, which are faster
+than any regex for a few literals. Routes are resolved once per source
+name and cached.
+"""
+import re
+
+# Fragment of the source file name -> category; the first fragment found wins
+ROUTES = [
+    ('access.log', 'access'),
+    ('error.log', 'error'),
+    ('application.log', 'application'),
+    ('database-queries.log', 'database'),
+    ('job-execution.log', 'job')
+]
+
+MATCH_TYPES = ('words', 'substring')
+
+CLASSIFIERS = {
+    'log_level': {
+        'match': 'words',
+        'ignore_case': True,
+        'default': 'INFO',
+        'values': [
+            ('ERROR', ['error', 'exception', 'failed', 'failure']),
+            ('WARNING', ['warn', 'warning', 'deprecated']),
+            ('DEBUG', ['debug', 'trace']),
+            ('INFO', ['info', 'started', 'completed', 'success'])
+        ]
+    },
+    'error_type': {
+        'match': 'substring',
+        'ignore_case': True,
+        'default': 'unknown',
+        'values': [
+            ('timeout', ['timeout']),
+            ('connection', ['connection']),
+            ('validation', ['validation'])
+        ]
+    },
+    'component': {
+        'match': 'substring',
+        'ignore_case': False,
+        'default': 'unknown',
+        'values': [
+            ('web-api', ['web-api']),
+            ('background-task', ['background'])
+        ]
+    }
+}
+
+class Classifier:
+    """One field's values, compiled for the way they are matched"""
+    
+    def __init__(self, values, default, match='words', ignore_case=False):
+        if match not in MATCH_TYPES:
+            raise ValueError(f"Unknown match type '{match}', expected one of {', '.join(MATCH_TYPES)}")
+        self.match = match
+        self.default = default
+        self.ignore_case = ignore_case
+        self.labels = [label for label, _ in values]
+        self.fragments = [[word.lower() if ignore_case else word for word in words] for _, words in values]
+        
+        if match == 'words':
+            # Group names are the value's priority, since labels are not always identifiers
+            groups = '|'.join(f"(?P<v{rank}>{'|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))})"
+                              for rank, words in enumerate(self.fragments))
+            self.pattern = re.compile(rf'\b(?:{groups})\b')
+            self.classify = self.classify_words
+        else:
+            # (fragment, value) pairs, in priority order
+            self.checks = [(fragment, label) for label, fragments in zip(self.labels, self.fragments) for fragment in fragments]
+            self.classify = self.classify_substring
+    
+    def classify_words(self, text):
+        """Highest priority value whose words are found in text, or the default"""
+        best = None
+        for found in self.pattern.finditer(text.lower() if self.ignore_case else text):
+            rank = int(found.lastgroup[1:])
+            if rank == 0:
+                return self.labels[0]
+            if best is None or rank < best:
+                best = rank
+        return self.default if best is None else self.labels[best]
+    
+    def classify_substring(self, text):
+        """First value with a fragment in text, or the default"""
+        if self.ignore_case:
+            text = text.lower()
+        for fragment, label in self.checks:
+            if fragment in text:
+                return label
+        return self.default
+
+class Rules:
+    """Compiled routes and classifiers"""
+    
+    def __init__(self, routes=ROUTES, classifiers=CLASSIFIERS):
+        self.routes = list(routes)
+        self.classifiers = {
+            field: Classifier(rule['values'], rule['default'], rule.get('match', 'words'), rule.get('ignore_case', False))
+            for field, rule in classifiers.items()
+        }
+        self.resolved = {}
+    
+    def route(self, source):
+        """Category of a source file name, or None"""
+        if source not in self.resolved:
+            self.resolved[source] = next((category for fragment, category in self.routes if fragment in source), None)
+        return self.resolved[source]
+    
+    def classifier(self, field):
+        """classify(text) function of a field"""
+        return self.classifiers[field].classify
\ No newline at end of file
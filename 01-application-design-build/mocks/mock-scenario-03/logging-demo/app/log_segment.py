@@ -0,0 +1,183 @@
+"""Rolled, compressed output segments of the collected logs
+
+The collector appends the logs of each source to an open segment, a hidden
+.collected_<...>.open file holding a gzip stream that is sync-flushed and
+fsynced every write cycle. Once a segment holds max_bytes of logs or is
+max_age seconds old it is sealed: the gzip trailer is written, the file is
+fsynced and renamed to collected_<source>.<opened at>.<sequence>.log.gz.
+Readers only glob collected_* names, so they only ever see complete
+segments, and a sealed segment is never written again.
+
+Open segments left behind by a crash are sealed by recover() at startup.
+"""
+import os
+import re
+import glob
+import gzip
+import time
+import zlib
+import logging
+from datetime import datetime
+
+logger = logging.getLogger('log-collector')
+
+DEFAULT_SEGMENT_BYTES = 8 * 1024**2
+DEFAULT_SEGMENT_AGE = 60.0
+
+COMPRESSIONS = ('gzip', 'none')
+
+# The collector runs on a small CPU limit; JSON logs still shrink about 8x
+COMPRESS_LEVEL = 1
+
+# collected_access.20261019T050000.000001.log.gz, or the unsegmented collected_access.log
+SEGMENT_NAME = re.compile(r'^collected_(?P<stem>.+?)(?:\.\d{8}T\d{6}\.\d{6})?(?P<extension>\.log)(?:\.gz)?$')
+
+def segment_source(filename):
+    """Source log file of a collected file ('access.log'), or None if it is not one"""
+    match = SEGMENT_NAME.match(filename)
+    return f"{match['stem']}{match['extension']}" if match else None
+
+def open_segment(path):
+    """Open a sealed segment for reading text lines
+    
+    Lines are raw logs: they end at newlines only (a carriage return is
+    part of its line) and invalid UTF-8 is replaced rather than fatal.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace', newline='\n')
+    return open(path, 'r', encoding='utf-8', errors='replace', newline='\n')
+
+def fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class Segment:
+    """An open segment of one source"""
+    
+    def __init__(self, directory, source, sequence, compression):
+        stem = source[:-len('.log')] if source.endswith('.log') else source
+        opened = datetime.now().strftime('%Y%m%dT%H%M%S')
+        self.name = f"collected_{stem}.{opened}.{sequence:06d}.log" + ('.gz' if compression == 'gzip' else '')
+        self.path = os.path.join(directory, self.name)
+        self.open_path = os.path.join(directory, f".{self.name}.open")
+        self.opened_at = time.monotonic()
+        self.bytes = 0
+        
+        self.file = open(self.open_path, 'wb')
+        if compression == 'gzip':
+            self.stream = gzip.GzipFile(filename='', fileobj=self.file, mode='wb', compresslevel=COMPRESS_LEVEL)
+        else:
+            self.stream = self.file
+    
+    def write(self, data):
+        self.stream.write(data)
+        self.bytes += len(data)
+    
+    def sync(self):
+        """Make everything written so far durable (a gzip sync flush keeps the stream going)"""
+        self.stream.flush()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+    
+    def seal(self):
+        """Finish the segment and publish it under its collected_ name"""
+        if self.stream is not self.file:
+            self.stream.close()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        size = os.fstat(self.file.fileno()).st_size
+        self.file.close()
+        os.rename(self.open_path, self.path)
+        return size
+
+class SegmentWriter:
+    """Open segments by source, rolled by size and age"""
+    
+    def __init__(self, directory, max_bytes=DEFAULT_SEGMENT_BYTES, max_age=DEFAULT_SEGMENT_AGE, compression='gzip'):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown segment compression '{compression}', expected one of {', '.join(COMPRESSIONS)}")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compression = compression
+        self.segments = {}
+        self.sequence = 0
+        self.counters = {'sealed': 0, 'recovered': 0, 'bytes_written': 0, 'sealed_log_bytes': 0, 'sealed_file_bytes': 0}
+    
+    def write(self, source, data):
+        """Append encoded log lines of a source to its open segment"""
+        segment = self.segments.get(source)
+        if segment is None:
+            self.sequence += 1
+            segment = self.segments[source] = Segment(self.directory, source, self.sequence, self.compression)
+        segment.write(data)
+        self.counters['bytes_written'] += len(data)
+        
+        if segment.bytes >= self.max_bytes:
+            self.seal(source)
+            fsync_directory(self.directory)
+    
+    def seal(self, source):
+        segment = self.segments.pop(source)
+        self.counters['sealed_file_bytes'] += segment.seal()
+        self.counters['sealed_log_bytes'] += segment.bytes
+        self.counters['sealed'] += 1
+        logger.debug(f"Sealed segment {segment.name} ({segment.bytes} bytes of logs)")
+    
+    def sync(self):
+        for segment in self.segments.values():
+            segment.sync()
+    
+    def roll(self, force=False):
+        """Seal the segments that are old enough (all of them if force); full ones are sealed on write"""
+        now = time.monotonic()
+        due = [source for source, segment in self.segments.items() if force or now - segment.opened_at >= self.max_age]
+        for source in due:
+            self.seal(source)
+        
+        if due:
+            fsync_directory(self.directory)
+    
+    def recover(self):
+        """Seal the open segments a previous run left behind, up to their last complete line"""
+        for open_path in sorted(glob.glob(os.path.join(self.directory, '.collected_*.open'))):
+            name = os.path.basename(open_path)[1:-len('.open')]
+            try:
+                with open(open_path, 'rb') as f:
+                    data = f.read()
+                if name.endswith('.gz'):
+                    # The stream has no trailer; decompress whatever was synced
+                    data = zlib.decompressobj(wbits=31).decompress(data)
+                data = data[:data.rfind(b'\n') + 1]
+                if not data:
+                    os.remove(open_path)
+                    continue
+                
+                temporary = os.path.join(self.directory, f".{name}.tmp")
+                with open(temporary, 'wb') as f:
+                    if name.endswith('.gz'):
+                        with gzip.GzipFile(filename='', fileobj=f, mode='wb', compresslevel=COMPRESS_LEVEL) as stream:
+                            stream.write(data)
+                    else:
+                        f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.rename(temporary, os.path.join(self.directory, name))
+                os.remove(open_path)
+                self.counters['recovered'] += 1
+                logger.info(f"Recovered segment {name} ({len(data)} bytes of logs)")
+            
+            except Exception as e:
+                logger.error(f"Error recovering segment {open_path}: {str(e)}")
+        
+        fsync_directory(self.directory)
+    
+    def stats(self):
+        return dict(self.counters,
+                    open_segments=len(self.segments),
+                    compression=self.compression,
+                    compression_ratio=round(self.counters['sealed_log_bytes'] / self.counters['sealed_file_bytes'], 2)
+                    if self.counters['sealed_file_bytes'] else None)
\ No newline at end of file
@@ -0,0 +1,349 @@
+"""Indexed store of processed logs, in an embedded SQLite database
+
+The processed_* NDJSON files stay the record of what was processed; the
+store indexes the same entries so they can be queried without scanning
+them. It is optional (LOG_STORE) and can be rebuilt from the files with
+log-query.py --ingest.
+
+Entries are kept in one table per day (logs_YYYYMMDD) of the time they
+were logged, or processed when they do not say. A query only reads the
+days it covers, and expired days are dropped whole instead of deleted row
+by row. Each table is indexed on (column, ts) for the columns queries
+filter on, leaving out the entries without the column (an error has no
+endpoint), and text messages are indexed for full-text search in an FTS5
+table. Times are local, like the timestamps the demo apps log, kept as
+seconds since 1970-01-01 00:00 local time.
+
+The database is in WAL mode: queries read while the processor writes.
+Rows are tagged with the file or stream they came from (origin), so the
+rows of a file that has to be processed again are removed first. A
+collected file and its processed_ output have the same origin
+(file_origin), whether the processor or --ingest added the rows.
+"""
+import os
+import re
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+from log_record import event_time
+
+logger = logging.getLogger('log-store')
+
+DEFAULT_RETENTION_DAYS = 7
+
+PARTITION_PREFIX = 'logs_'
+PARTITION_PATTERN = re.compile(r'^logs_(\d{8})$')
+
+# Columns queries filter on; each is indexed with the time
+INDEXED_COLUMNS = ('log_category', 'log_level', 'status_category', 'error_type', 'endpoint')
+
+COLUMNS = ('ts',) + INDEXED_COLUMNS + ('status_code', 'origin', 'message', 'entry')
+MESSAGE_INDEX = COLUMNS.index('message')
+
+# Status classes accepted by query(status=...), with the status_category the processor gives them
+STATUS_CLASSES = {
+    '2xx': ('success', 200, 299),
+    '3xx': ('redirect', 300, 399),
+    '4xx': ('client_error', 400, 499),
+    '5xx': ('server_error', 500, 599)
+}
+
+LOCAL_EPOCH = datetime(1970, 1, 1)
+
+def local_seconds(moment):
+    """Seconds of a naive local datetime since LOCAL_EPOCH: no time zone lookup, unlike timestamp()"""
+    return (moment - LOCAL_EPOCH).total_seconds()
+
+# Day names by ordinal: formatting one costs more than the rest of a row
+day_names = {}
+
+def partition_day(logged):
+    ordinal = logged.toordinal()
+    if ordinal not in day_names:
+        day_names[ordinal] = f"{logged.year:04d}{logged.month:02d}{logged.day:02d}"
+    return day_names[ordinal]
+
+def file_origin(name):
+    """Origin of the rows of a collected file or stream, from its name or its processed_ output's"""
+    name = os.path.basename(name)
+    if name.startswith('processed_'):
+        name = name[len('processed_'):]
+    return name[:-len('.gz')] if name.endswith('.gz') else name
+
+def entry_row(log_entry, text, origin):
+    """(day, row) of a processed entry and its JSON text, to add to the store"""
+    logged = event_time(log_entry)
+    if logged is None:
+        try:
+            logged = datetime.fromisoformat(log_entry['processed_at'])
+        except (KeyError, TypeError, ValueError):
+            logged = datetime.now()
+    
+    message = log_entry.get('message')
+    return partition_day(logged), (
+        local_seconds(logged),
+        log_entry.get('log_category'),
+        log_entry.get('log_level'),
+        log_entry.get('status_category'),
+        log_entry.get('error_type'),
+        log_entry.get('endpoint'),
+        log_entry.get('status_code'),
+        origin,
+        message if isinstance(message, str) else None,
+        text
+    )
+
+def entry_rows(processed_logs, texts, origin):
+    return [entry_row(log_entry, text, origin) for log_entry, text in zip(processed_logs, texts)]
+
+class LogStore:
+    """Day partitioned tables of processed entries, shared by the processor's threads"""
+    
+    def __init__(self, path, retention_days=DEFAULT_RETENTION_DAYS, read_only=False):
+        self.path = path
+        self.retention_days = retention_days
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.rows_added = 0
+        self.rows_removed = 0
+        self.rows_expired = 0
+        
+        if read_only:
+            self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            # With WAL, a commit survives a crash of the processor; only a power loss can undo the last ones
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('PRAGMA busy_timeout=5000')
+        
+        self.partitions = self.load_partitions()
+    
+    def load_partitions(self):
+        rows = self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'logs_%'")
+        return {match.group(1) for match in (PARTITION_PATTERN.match(name) for name, in rows) if match}
+    
+    def cutoff_day(self):
+        """Days before this one are expired"""
+        return partition_day(datetime.now() - timedelta(days=self.retention_days))
+    
+    def create_partition(self, day):
+        table = f"{PARTITION_PREFIX}{day}"
+        statements = [
+            f"""CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                log_category TEXT,
+                log_level TEXT,
+                status_category TEXT,
+                error_type TEXT,
+                endpoint TEXT,
+                status_code INTEGER,
+                origin TEXT,
+                message TEXT,
+                entry TEXT NOT NULL
+            )""",
+            f"CREATE INDEX IF NOT EXISTS {table}_ts ON {table} (ts)",
+            f"CREATE INDEX IF NOT EXISTS {table}_origin ON {table} (origin)"
+        ]
+        # Partial: a filter on column = value still uses them
+        statements += [f"CREATE INDEX IF NOT EXISTS {table}_{column} ON {table} ({column}, ts) WHERE {column} IS NOT NULL"
+                       for column in INDEXED_COLUMNS]
+        statements.append(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(message, content='{table}', content_rowid='id')")
+        for statement in statements:
+            self.connection.execute(statement)
+        self.partitions.add(day)
+        logger.info(f"Created partition {table}")
+        
+        self.drop_expired()
+    
+    def drop_expired(self):
+        cutoff = self.cutoff_day()
+        for day in sorted(self.partitions):
+            if day >= cutoff:
+                break
+            self.connection.execute(f"DROP TABLE IF EXISTS {PARTITION_PREFIX}{day}_fts")
+            self.connection.execute(f"DROP TABLE IF EXISTS {PARTITION_PREFIX}{day}")
+            self.partitions.discard(day)
+            logger.info(f"Dropped expired partition {PARTITION_PREFIX}{day}")
+    
+    def add(self, rows):
+        """Add (day, row) pairs from entry_row(), in one transaction; the number added"""
+        by_day = {}
+        for day, row in rows:
+            by_day.setdefault(day, []).append(row)
+        
+        added = 0
+        with self.lock:
+            cutoff = self.cutoff_day()
+            with self.connection:
+                # Write lock first: log-query.py --ingest may be adding rows to the same partitions
+                self.connection.execute('BEGIN IMMEDIATE')
+                for day, day_rows in by_day.items():
+                    if day < cutoff:
+                        self.rows_expired += len(day_rows)
+                        continue
+                    if day not in self.partitions:
+                        self.create_partition(day)
+                    
+                    # Rows and their full-text entries are inserted with the same id, the next one under the lock
+                    last_id = self.connection.execute(f"SELECT max(id) FROM {PARTITION_PREFIX}{day}").fetchone()[0]
+                    first_id = (last_id or 0) + 1
+                    self.connection.executemany(
+                        f"INSERT INTO {PARTITION_PREFIX}{day} (id, {', '.join(COLUMNS)}) VALUES (?, {', '.join('?' * len(COLUMNS))})",
+                        ((row_id,) + row for row_id, row in enumerate(day_rows, first_id)))
+                    self.connection.executemany(
+                        f"INSERT INTO {PARTITION_PREFIX}{day}_fts (rowid, message) VALUES (?, ?)",
+                        ((row_id, row[MESSAGE_INDEX]) for row_id, row in enumerate(day_rows, first_id) if row[MESSAGE_INDEX] is not None))
+                    added += len(day_rows)
+            self.rows_added += added
+        return added
+    
+    def remove(self, origin):
+        """Remove the rows that came from origin; the number removed"""
+        removed = 0
+        with self.lock:
+            with self.connection:
+                self.connection.execute('BEGIN IMMEDIATE')
+                # Partitions another process (log-query.py --ingest) created count as well
+                self.partitions |= self.load_partitions()
+                for day in self.partitions:
+                    table = f"{PARTITION_PREFIX}{day}"
+                    # An external content FTS5 table forgets an entry when given the text it indexed
+                    self.connection.execute(f"""INSERT INTO {table}_fts ({table}_fts, rowid, message)
+                        SELECT 'delete', id, message FROM {table} WHERE origin = ? AND message IS NOT NULL""", (origin,))
+                    removed += self.connection.execute(f"DELETE FROM {table} WHERE origin = ?", (origin,)).rowcount
+            self.rows_removed += removed
+        return removed
+    
+    def ingest(self, path, batch_lines=10000):
+        """Add the entries of a processed NDJSON file, replacing those added from it before; the number added
+        
+        A file written with LOG_TEMPLATE_MODE is refused (ValueError), leaving
+        the store as it was: its records hold template_id instead of the
+        message, some for several entries, and are not whole entries. The
+        processor stores those entries whole itself.
+        """
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            if any('"template_id"' in line and 'template_id' in self.parse_record(line) for line in f):
+                raise ValueError(f"{path} has templated records (LOG_TEMPLATE_MODE), not whole entries")
+        
+        origin = file_origin(path)
+        self.remove(origin)
+        
+        added = 0
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            rows = []
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rows.append(entry_row(json.loads(line), line, origin))
+                except (json.JSONDecodeError, AttributeError):
+                    continue
+                if len(rows) >= batch_lines:
+                    added += self.add(rows)
+                    rows = []
+            added += self.add(rows)
+        return added
+    
+    def parse_record(self, line):
+        """A processed record as a dict, or an empty one"""
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            return {}
+        return record if isinstance(record, dict) else {}
+    
+    def query(self, since=None, until=None, status=None, search=None, limit=100, count=False, **filters):
+        """Entries matching every given condition, newest first, or their number with count
+        
+        since and until are datetimes; status is a class (5xx), a code (503)
+        or a status_category; filters are INDEXED_COLUMNS values, and an
+        endpoint also matches the paths under it. search is an FTS5 query
+        on text messages.
+        """
+        since, until = (moment.astimezone().replace(tzinfo=None) if moment is not None and moment.tzinfo else moment
+                        for moment in (since, until))
+        
+        conditions = []
+        parameters = []
+        if since is not None:
+            conditions.append('ts >= ?')
+            parameters.append(local_seconds(since))
+        if until is not None:
+            conditions.append('ts < ?')
+            parameters.append(local_seconds(until))
+        
+        if status is not None:
+            status = str(status)
+            if status.lower() in STATUS_CLASSES:
+                category, low, high = STATUS_CLASSES[status.lower()]
+                conditions.append('status_category = ? AND status_code BETWEEN ? AND ?')
+                parameters += [category, low, high]
+            elif status.isdigit():
+                conditions.append('status_code = ?')
+                parameters.append(int(status))
+            else:
+                conditions.append('status_category = ?')
+                parameters.append(status)
+        
+        for column, value in filters.items():
+            if column not in INDEXED_COLUMNS:
+                raise ValueError(f"Unknown filter '{column}', expected one of {', '.join(INDEXED_COLUMNS)}")
+            if value is None:
+                continue
+            if column == 'endpoint':
+                # '/' is followed by '0': the range holds every path under the endpoint
+                endpoint = value.rstrip('/') or '/'
+                conditions.append('(endpoint = ? OR (endpoint >= ? AND endpoint < ?))')
+                parameters += [endpoint, endpoint.rstrip('/') + '/', endpoint.rstrip('/') + '0']
+            else:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        
+        # Only the days the time range covers
+        first = partition_day(since) if since is not None else None
+        last = partition_day(until) if until is not None else None
+        days = sorted((day for day in self.partitions if (first is None or day >= first) and (last is None or day <= last)),
+                      reverse=True)
+        
+        total = 0
+        entries = []
+        with self.lock:
+            for day in days:
+                table = f"{PARTITION_PREFIX}{day}"
+                where = list(conditions)
+                day_parameters = list(parameters)
+                if search:
+                    where.append(f"id IN (SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH ?)")
+                    day_parameters.append(search)
+                clause = f" WHERE {' AND '.join(where)}" if where else ''
+                
+                if count:
+                    total += self.connection.execute(f"SELECT count(*) FROM {table}{clause}", day_parameters).fetchone()[0]
+                    continue
+                
+                rows = self.connection.execute(f"SELECT entry FROM {table}{clause} ORDER BY ts DESC LIMIT ?",
+                                               day_parameters + [limit - len(entries)])
+                entries += [json.loads(entry) for entry, in rows]
+                if len(entries) >= limit:
+                    break
+        return total if count else entries
+    
+    def stats(self):
+        return {
+            'path': self.path,
+            'partitions': len(self.partitions),
+            'rows_added': self.rows_added,
+            'rows_removed': self.rows_removed,
+            'rows_expired': self.rows_expired
+        }
+    
+    def close(self):
+        with self.lock:
+            self.connection.close()
\ No newline at end of file
@@ -0,0 +1,235 @@
+"""Online mining of log message templates, Drain style
+
+Most text messages are a few fixed sentences with variables in them
+("Processing simulated request 42"). TemplateMiner learns these
+templates as messages come: a message is split into tokens, tokens with
+digits are taken as variables, and a fixed depth tree, by token count and
+then by the first tokens, leads to a few candidate templates. The most
+similar one takes the message, turning the tokens that differ into <*>,
+or the message starts a new template. At most max_templates are kept;
+the least recently used is forgotten first.
+
+A template's id is a hash of its text, so processes mining on their own
+give the same id to the same template, and a template made more general
+gets a new id. With the processor's LOG_TEMPLATE_MODE:
+  
+  template  a record holds template_id and parameters instead of the
+            message; the asctime starting it is kept as logged_at
+  collapse  as template, and repeats of an INFO or DEBUG template
+            in the same chunk become one record with a count (the
+            parameters of the first), as long as they are at most
+            LOG_TEMPLATE_WINDOW_SECONDS after it. Collapsing is per
+            chunk: the next chunk starts its own records, so a
+            steady message gives one record per chunk, not per window
+
+The message is logged_at + ' - ' + render(template, parameters), or the
+rendered template alone without logged_at; templates are listed in
+templates.ndjson next to the processed files. Messages that would not
+render back exactly (repeated spaces, tabs) are left as they are.
+"""
+import re
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
+from log_record import ASCTIME_LENGTH
+
+WILDCARD = '<*>'
+MODES = ('off', 'template', 'collapse')
+
+DEFAULT_DEPTH = 4
+DEFAULT_SIMILARITY = 0.5
+DEFAULT_MAX_CHILDREN = 100
+DEFAULT_MAX_TEMPLATES = 1000
+DEFAULT_WINDOW_SECONDS = 60
+
+ASCTIME_PREFIX = re.compile(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3} - ')
+DIGIT = re.compile(r'\d')
+
+# Only repeats of these levels are collapsed: warnings and errors are kept one by one
+COLLAPSED_LEVELS = ('DEBUG', 'INFO')
+
+def template_id(template):
+    return hashlib.blake2b(template.encode('utf-8'), digest_size=6).hexdigest()
+
+def render(template, parameters):
+    """Message of a template with its parameters"""
+    tokens = template.split(' ')
+    parameters = iter(parameters)
+    return ' '.join(next(parameters) if token == WILDCARD else token for token in tokens)
+
+class Template:
+    __slots__ = ('tokens', 'id', 'size', 'leaf')
+    
+    def __init__(self, tokens, leaf):
+        self.tokens = tokens
+        self.id = template_id(' '.join(tokens))
+        self.size = 1
+        self.leaf = leaf
+    
+    def similarity(self, tokens):
+        """(share of tokens the template matches, wildcards included; wildcards of the template)"""
+        equal = wildcards = 0
+        for template_token, token in zip(self.tokens, tokens):
+            if template_token == WILDCARD:
+                wildcards += 1
+            elif template_token == token:
+                equal += 1
+        return (equal + wildcards) / len(tokens), wildcards
+
+class TemplateMiner:
+    """Drain: a tree of templates by token count and first tokens"""
+    
+    def __init__(self, depth=DEFAULT_DEPTH, similarity=DEFAULT_SIMILARITY, max_children=DEFAULT_MAX_CHILDREN,
+                 max_templates=DEFAULT_MAX_TEMPLATES):
+        self.depth = depth
+        self.similarity_threshold = similarity
+        self.max_children = max_children
+        self.max_templates = max_templates
+        self.root = {}
+        self.templates = OrderedDict()  # id -> Template, least recently used first
+        self.new_templates = {}  # id -> text, of templates not reported yet by take_new()
+        self.evicted = 0
+    
+    def leaf(self, tokens):
+        """List of the templates the tokens lead to, created if needed"""
+        node = self.root.setdefault(len(tokens), {})
+        for token in tokens[:self.depth - 2]:
+            if token != WILDCARD and token not in node and len(node) >= self.max_children:
+                token = WILDCARD
+            node = node.setdefault(token, {})
+        return node.setdefault(None, [])
+    
+    def match(self, message):
+        """(template, parameters) of a message, learning from it"""
+        raw_tokens = message.split()
+        tokens = [WILDCARD if DIGIT.search(token) else token for token in raw_tokens]
+        if not tokens:
+            tokens = raw_tokens = ['']
+        leaf = self.leaf(tokens)
+        
+        best = None
+        best_score = (-1, -1)
+        for candidate in leaf:
+            score = candidate.similarity(tokens)
+            if score > best_score:
+                best, best_score = candidate, score
+        
+        if best is not None and best_score[0] >= self.similarity_threshold:
+            merged = [template_token if template_token == token else WILDCARD for template_token, token in zip(best.tokens, tokens)]
+            if merged != best.tokens:
+                del self.templates[best.id]
+                best.tokens = merged
+                best.id = template_id(' '.join(merged))
+                existing = self.templates.get(best.id)
+                if existing is not None:
+                    # Made as general as another template: they are one now
+                    best.leaf.remove(best)
+                    existing.size += best.size
+                    best = existing
+                else:
+                    self.new_templates[best.id] = ' '.join(merged)
+            best.size += 1
+            self.templates[best.id] = best
+            self.templates.move_to_end(best.id)
+        elif template_id(' '.join(tokens)) in self.templates:
+            # The same template, generalized to these tokens from another leaf: one template per id
+            best = self.templates[template_id(' '.join(tokens))]
+            best.size += 1
+            self.templates.move_to_end(best.id)
+        else:
+            best = Template(tokens, leaf)
+            leaf.append(best)
+            self.templates[best.id] = best
+            self.new_templates[best.id] = ' '.join(tokens)
+            if len(self.templates) > self.max_templates:
+                _, evicted = self.templates.popitem(last=False)
+                evicted.leaf.remove(evicted)
+                self.evicted += 1
+        
+        parameters = [raw_token for template_token, raw_token in zip(best.tokens, raw_tokens) if template_token == WILDCARD]
+        return best, parameters
+    
+    def take_new(self):
+        """{id: template} learned since the last call"""
+        new_templates, self.new_templates = self.new_templates, {}
+        return new_templates
+
+class TemplateCompactor:
+    """Records of processed entries, their messages replaced by templates (and repeats collapsed)"""
+    
+    def __init__(self, mode='template', window_seconds=DEFAULT_WINDOW_SECONDS, miner=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown template mode '{mode}', expected one of {', '.join(MODES)}")
+        self.mode = mode
+        self.window_seconds = window_seconds
+        self.miner = miner or TemplateMiner()
+        self.templated = 0
+        self.collapsed = 0
+    
+    def template_record(self, log_entry):
+        """Record of an entry with its message as template_id and parameters, or the entry itself"""
+        message = log_entry.get('message')
+        if not isinstance(message, str):
+            return log_entry
+        
+        logged_at = None
+        body = message
+        if ASCTIME_PREFIX.match(message) and 'logged_at' not in log_entry:
+            logged_at = message[:ASCTIME_LENGTH]
+            body = message[ASCTIME_LENGTH + 3:]
+        
+        template, parameters = self.miner.match(body)
+        if render(' '.join(template.tokens), parameters) != body:
+            return log_entry
+        
+        record = log_entry.copy()
+        del record['message']
+        if logged_at:
+            record['logged_at'] = logged_at
+        record['template_id'] = template.id
+        record['parameters'] = parameters
+        self.templated += 1
+        return record
+    
+    def compact(self, processed_logs):
+        """Records to write for processed entries, in their order; repeats only collapse within these entries"""
+        records = [self.template_record(log_entry) for log_entry in processed_logs]
+        if self.mode != 'collapse':
+            return records
+        
+        output = []
+        # (template_id, category, level, source) -> (record, started) of the repeats being collapsed
+        open_groups = {}
+        for record in records:
+            if 'template_id' not in record or record.get('log_level') not in COLLAPSED_LEVELS:
+                output.append(record)
+                continue
+            
+            key = (record['template_id'], record.get('log_category'), record.get('log_level'), record.get('source_file'))
+            logged = self.logged_time(record)
+            group = open_groups.get(key)
+            if group is not None and (logged is None or group[1] is None or (logged - group[1]).total_seconds() <= self.window_seconds):
+                group[0]['count'] += 1
+                if record.get('logged_at'):
+                    group[0]['last_logged_at'] = record['logged_at']
+                self.collapsed += 1
+                continue
+            
+            record['count'] = 1
+            open_groups[key] = (record, logged)
+            output.append(record)
+        return output
+    
+    def logged_time(self, record):
+        try:
+            return datetime.fromisoformat(record['logged_at'])
+        except (KeyError, TypeError, ValueError):
+            return None
+    
+    def counts(self):
+        """Entries templated and collapsed, templates evicted: pool workers report them per chunk"""
+        return {
+            'templated_entries': self.templated,
+            'collapsed_entries': self.collapsed,
+            'evicted_templates': self.miner.evicted
+        }
\ No newline at end of file
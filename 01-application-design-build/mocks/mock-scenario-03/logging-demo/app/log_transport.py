@@ -0,0 +1,259 @@
+"""Streaming of collected log batches from the collector to the processor
+
+An optional alternative to the segment files in /collected-logs: the
+collector sends each batch over a Unix domain socket (or localhost TCP)
+as soon as it is taken from the buffer, and the processor handles it
+right away instead of finding it with its 5 second glob.
+
+Every frame is a header (payload length, frame type) and a payload:
+  
+  HELLO  processor -> collector  credits: batches the collector may have unacknowledged
+  BATCH  collector -> processor  sequence, source name length, source name, NDJSON lines
+  ACK    processor -> collector  sequence, credits given back
+
+The processor acknowledges a batch once its output is on disk, so the
+collector keeps unacknowledged batches and spools them to segment files
+when the processor goes away; nothing acknowledged is ever spooled again.
+
+Addresses are unix:/path/to/socket or tcp:host:port.
+"""
+import os
+import time
+import socket
+import struct
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('log-transport')
+
+FRAME_HEADER = struct.Struct('!IB')
+HELLO_BODY = struct.Struct('!I')
+BATCH_HEADER = struct.Struct('!QH')
+ACK_BODY = struct.Struct('!QI')
+
+HELLO = 1
+BATCH = 2
+ACK = 3
+
+# Larger frames mean a corrupted stream rather than a real batch
+MAX_FRAME_BYTES = 64 * 1024**2
+
+DEFAULT_ADDRESS = 'unix:/collected-logs/.processor.sock'
+DEFAULT_CREDITS = 8
+
+# A processor that does not acknowledge within ACK_TIMEOUT is treated as down
+ACK_TIMEOUT = 10.0
+RECONNECT_INTERVAL = 5.0
+
+def parse_address(address):
+    """(socket family, address) of unix:/path or tcp:host:port"""
+    scheme, _, rest = address.partition(':')
+    if scheme == 'unix' and rest:
+        return socket.AF_UNIX, rest
+    if scheme == 'tcp' and rest:
+        host, _, port = rest.rpartition(':')
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    raise ValueError(f"Invalid transport address '{address}', expected unix:/path or tcp:host:port")
+
+def recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("Connection closed by peer")
+        received += count
+    return buffer
+
+def read_frame(sock):
+    """(frame type, payload) of the next frame"""
+    length, frame_type = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+    if length > MAX_FRAME_BYTES:
+        raise ConnectionError(f"Frame of {length} bytes exceeds the {MAX_FRAME_BYTES} byte limit")
+    return frame_type, recv_exactly(sock, length)
+
+def send_frame(sock, frame_type, *parts):
+    length = sum(len(part) for part in parts)
+    sock.sendall(b''.join([FRAME_HEADER.pack(length, frame_type), *parts]))
+
+class TransportClient:
+    """Collector side: sends batches within the credit the processor granted"""
+    
+    def __init__(self, address=DEFAULT_ADDRESS, ack_timeout=ACK_TIMEOUT, reconnect_interval=RECONNECT_INTERVAL):
+        self.family, self.address = parse_address(address)
+        self.ack_timeout = ack_timeout
+        self.reconnect_interval = reconnect_interval
+        self.sock = None
+        self.credits = 0
+        self.sequence = 0
+        self.unacked = OrderedDict()
+        self.retry_at = 0
+        self.counters = {'batches_sent': 0, 'batches_acked': 0, 'bytes_sent': 0, 'connects': 0, 'disconnects': 0}
+    
+    def connect(self):
+        """Connect unless a recent attempt failed; False while the processor is unreachable"""
+        if time.monotonic() < self.retry_at:
+            return False
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.ack_timeout)
+            sock.connect(self.address)
+            if self.family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            frame_type, payload = read_frame(sock)
+            if frame_type != HELLO:
+                raise ConnectionError(f"Expected HELLO, got frame type {frame_type}")
+        except (OSError, ConnectionError) as e:
+            sock.close()
+            self.retry_at = time.monotonic() + self.reconnect_interval
+            logger.debug(f"Processor not reachable: {str(e)}")
+            return False
+        
+        self.sock = sock
+        self.credits = HELLO_BODY.unpack(payload)[0]
+        self.counters['connects'] += 1
+        logger.info(f"Streaming batches to the processor ({self.credits} credits)")
+        return True
+    
+    def disconnect(self, reason):
+        if self.sock is not None:
+            logger.warning(f"Processor connection lost ({reason}), spooling to files")
+            self.sock.close()
+            self.sock = None
+            self.counters['disconnects'] += 1
+        self.retry_at = time.monotonic() + self.reconnect_interval
+    
+    def read_ack(self):
+        frame_type, payload = read_frame(self.sock)
+        if frame_type != ACK:
+            raise ConnectionError(f"Expected ACK, got frame type {frame_type}")
+        sequence, credits = ACK_BODY.unpack(payload)
+        self.unacked.pop(sequence, None)
+        self.credits += credits
+        self.counters['batches_acked'] += 1
+    
+    def send(self, source, data):
+        """Send a batch; False if it was not sent and has to be spooled by the caller"""
+        if self.sock is None and not self.connect():
+            return False
+        try:
+            # Flow control: wait for acknowledgements while the credit is used up
+            while self.credits <= 0:
+                self.read_ack()
+            
+            self.sequence += 1
+            name = source.encode('utf-8')
+            self.unacked[self.sequence] = (source, data)
+            send_frame(self.sock, BATCH, BATCH_HEADER.pack(self.sequence, len(name)), name, data)
+            self.credits -= 1
+            self.counters['batches_sent'] += 1
+            self.counters['bytes_sent'] += len(data)
+            return True
+        except (OSError, ConnectionError) as e:
+            self.disconnect(str(e))
+            return False
+    
+    def drain(self):
+        """Wait until every batch sent is acknowledged; False if some never will be"""
+        try:
+            while self.unacked and self.sock is not None:
+                self.read_ack()
+        except (OSError, ConnectionError) as e:
+            self.disconnect(str(e))
+        return not self.unacked
+    
+    def take_unacked(self):
+        """(source, data) of the batches the processor did not acknowledge, oldest first"""
+        batches = list(self.unacked.values())
+        self.unacked.clear()
+        return batches
+    
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+    
+    def stats(self):
+        return dict(self.counters, connected=self.sock is not None, unacked=len(self.unacked))
+
+class TransportServer:
+    """Processor side: accepts collector connections and hands each batch to handler(source, data)"""
+    
+    def __init__(self, address, handler, credits=DEFAULT_CREDITS):
+        self.address_string = address
+        self.family, self.address = parse_address(address)
+        self.handler = handler
+        self.credits = credits
+        self.running = False
+        self.listener = None
+        self.lock = threading.Lock()
+        self.counters = {'connections': 0, 'batches': 0, 'bytes': 0, 'errors': 0}
+    
+    def start(self):
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            # Left behind by a previous run
+            os.unlink(self.address)
+        self.listener = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_INET:
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen()
+        self.running = True
+        threading.Thread(target=self.accept_connections, daemon=True).start()
+        logger.info(f"Accepting log batches on {self.address_string}")
+    
+    def accept_connections(self):
+        while self.running:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                if self.running:
+                    logger.error("Transport listener failed")
+                return
+            with self.lock:
+                self.counters['connections'] += 1
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+    
+    def serve(self, conn):
+        """Handle the batches of one collector connection, acknowledging each once handled"""
+        with conn:
+            try:
+                if self.family == socket.AF_INET:
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                send_frame(conn, HELLO, HELLO_BODY.pack(self.credits))
+                while self.running:
+                    frame_type, payload = read_frame(conn)
+                    if frame_type != BATCH:
+                        raise ConnectionError(f"Expected BATCH, got frame type {frame_type}")
+                    
+                    sequence, name_length = BATCH_HEADER.unpack_from(payload)
+                    start = BATCH_HEADER.size
+                    source = bytes(payload[start:start + name_length]).decode('utf-8')
+                    data = memoryview(payload)[start + name_length:]
+                    self.handler(source, data)
+                    
+                    send_frame(conn, ACK, ACK_BODY.pack(sequence, 1))
+                    with self.lock:
+                        self.counters['batches'] += 1
+                        self.counters['bytes'] += len(data)
+            
+            except ConnectionError:
+                pass
+            except Exception as e:
+                # Unacknowledged batches go to the collector's file spool instead
+                logger.error(f"Transport connection error: {str(e)}")
+                with self.lock:
+                    self.counters['errors'] += 1
+    
+    def close(self):
+        self.running = False
+        if self.listener is not None:
+            self.listener.close()
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+    
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, address=self.address_string)
\ No newline at end of file
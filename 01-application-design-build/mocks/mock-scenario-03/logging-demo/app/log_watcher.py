@@ -0,0 +1,205 @@
+"""Change notification for the log directory watched by the collector
+
+InotifyWatcher asks the kernel (inotify, called through ctypes) for the
+files that are created, written, moved or deleted, so an idle directory
+costs no syscalls at all. PollingWatcher is the fallback where inotify is
+not available: it compares stat() snapshots and backs off while nothing
+changes.
+
+wait(timeout) returns the paths that changed, or None when the caller
+should rescan the whole directory (event queue overflow, directory
+recreated).
+"""
+import os
+import time
+import ctypes
+import select
+import struct
+import fnmatch
+import logging
+
+logger = logging.getLogger('log-collector')
+
+# Event flags from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+# struct inotify_event: int wd; uint32_t mask, cookie, len; char name[len]
+EVENT_HEADER = struct.Struct('iIII')
+READ_BUFFER_BYTES = 64 * 1024
+
+# Polling interval doubles while the directory is idle and resets on a change
+MIN_POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 2.0
+
+class InotifyWatcher:
+    """Kernel change notifications for the files of one directory"""
+    
+    mode = 'inotify'
+    
+    def __init__(self, directory, pattern='*.log'):
+        self.directory = directory
+        self.pattern = pattern
+        self.counters = {'wakeups': 0, 'events': 0, 'rescans': 0}
+        
+        # dlopen(NULL): the interpreter is linked against libc (glibc or musl)
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1 failed: {os.strerror(error)}")
+        
+        self.wd = None
+        try:
+            self.add_watch()
+        except OSError:
+            os.close(self.fd)
+            raise
+        
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+    
+    def add_watch(self):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(self.directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_add_watch {self.directory} failed: {os.strerror(error)}")
+        self.wd = wd
+    
+    def wait(self, timeout):
+        """Paths changed since the last call, waiting up to timeout seconds for the first one"""
+        if self.wd is None:
+            # The directory went away; watch it again once it is back
+            try:
+                self.add_watch()
+            except OSError:
+                time.sleep(timeout)
+                return set()
+            self.counters['rescans'] += 1
+            return None
+        
+        if not self.poller.poll(timeout * 1000):
+            return set()
+        self.counters['wakeups'] += 1
+        
+        changed = set()
+        rescan = False
+        while True:
+            try:
+                buffer = os.read(self.fd, READ_BUFFER_BYTES)
+            except BlockingIOError:
+                break
+            
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                start = offset + EVENT_HEADER.size
+                name = os.fsdecode(buffer[start:start + length].rstrip(b'\0'))
+                offset = start + length
+                self.counters['events'] += 1
+                
+                if mask & IN_Q_OVERFLOW:
+                    rescan = True
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    if mask & IN_MOVE_SELF:
+                        self.libc.inotify_rm_watch(self.fd, wd)
+                    self.wd = None
+                    rescan = True
+                elif name and fnmatch.fnmatch(name, self.pattern):
+                    changed.add(os.path.join(self.directory, name))
+        
+        if rescan:
+            self.counters['rescans'] += 1
+            return None
+        return changed
+    
+    def stats(self):
+        return dict(self.counters, mode=self.mode)
+    
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """stat() snapshots of a directory, taken at an adaptive interval"""
+    
+    mode = 'polling'
+    
+    def __init__(self, directory, pattern='*.log', min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL):
+        self.directory = directory
+        self.pattern = pattern
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.counters = {'wakeups': 0, 'scans': 0}
+        self.snapshot = self.scan()
+    
+    def scan(self):
+        """(inode, size, mtime) of every matching file"""
+        self.counters['scans'] += 1
+        snapshot = {}
+        try:
+            entries = os.scandir(self.directory)
+        except FileNotFoundError:
+            return snapshot
+        
+        with entries:
+            for entry in entries:
+                if not fnmatch.fnmatch(entry.name, self.pattern):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[entry.path] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        return snapshot
+    
+    def wait(self, timeout):
+        """Paths changed since the last call, waiting up to timeout seconds for the first one"""
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(max(0, min(self.interval, deadline - time.monotonic())))
+            self.counters['wakeups'] += 1
+            
+            snapshot = self.scan()
+            changed = {path for path, state in snapshot.items() if self.snapshot.get(path) != state}
+            changed.update(path for path in self.snapshot if path not in snapshot)
+            self.snapshot = snapshot
+            
+            if changed:
+                self.interval = self.min_interval
+                return changed
+            
+            self.interval = min(self.interval * 2, self.max_interval)
+            if time.monotonic() >= deadline:
+                return set()
+    
+    def stats(self):
+        return dict(self.counters, mode=self.mode, interval_seconds=self.interval)
+    
+    def close(self):
+        pass
+
+def create_watcher(directory, pattern='*.log', mode='auto'):
+    """inotify watcher if the kernel offers it (mode auto or inotify), adaptive polling otherwise"""
+    if mode in ('auto', 'inotify'):
+        try:
+            return InotifyWatcher(directory, pattern)
+        except (OSError, AttributeError) as e:
+            if mode == 'inotify':
+                raise
+            logger.warning(f"inotify unavailable ({str(e)}), falling back to adaptive polling")
+    
+    return PollingWatcher(directory, pattern)
\ No newline at end of file
@@ -66,6 +66,8 @@ def log_response(response):
     """Log response details"""
     response_log_entry = {
         "timestamp": datetime.now().isoformat(),
+        "method": request.method,
+        "path": request.path,
         "status_code": response.status_code,
         "content_length": response.content_length or 0,
         "processing_time_ms": random.randint(10, 500)  # Simulated processing time
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import glob
+import time
+import shutil
+import logging
+import resource
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger('collector-benchmark')
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), 'app')
+
+# legacy is the collector's original loop, kept here as the baseline
+MODES = ['inotify', 'polling', 'legacy']
+SOURCES = ['access.log', 'error.log', 'application.log']
+
+def load_app_module(filename):
+    """Import one of the app scripts (log-collector.py) as a module"""
+    sys.path.insert(0, APP_DIR)
+    spec = importlib.util.spec_from_file_location(filename[:-3].replace('-', '_'), os.path.join(APP_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class LegacyWatcher:
+    """Re-glob the directory and re-open every file once per second"""
+    
+    mode = 'legacy'
+    
+    def __init__(self, directory, pattern='*.log'):
+        self.directory = directory
+        self.pattern = pattern
+    
+    def wait(self, timeout):
+        time.sleep(1)
+        return set(glob.glob(os.path.join(self.directory, self.pattern)))
+    
+    def stats(self):
+        return {'mode': self.mode}
+    
+    def close(self):
+        pass
+
+def process_counters():
+    """CPU time, read/write syscalls (from /proc/self/io) and voluntary context switches"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    io = {}
+    with open('/proc/self/io', 'r') as f:
+        for line in f:
+            key, value = line.split(':')
+            io[key] = int(value)
+    return {
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        'read_syscalls': io['syscr'],
+        'write_syscalls': io['syscw'],
+        'voluntary_switches': usage.ru_nvcsw
+    }
+
+def counters_delta(before, after, seconds):
+    return {f"{key}_per_second": round((after[key] - before[key]) / seconds, 3) for key in before}
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def latency_summary(latencies):
+    return {
+        'latency_ms_p50': round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        'latency_ms_p95': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'latency_ms_max': round(max(latencies) * 1000, 2) if latencies else None
+    }
+
+def run_mode(mode, work_dir, idle_seconds, lines, rate, existing_lines, transport=None, segment_age=1.0):
+    """Measure one watcher mode in this process, end to end through the processor if transport is set"""
+    if transport:
+        os.environ.update({
+            'LOG_TRANSPORT': transport,
+            'LOG_TRANSPORT_ADDRESS': f"unix:{os.path.join(work_dir, 'processor.sock')}",
+            'LOG_SEGMENT_AGE_SECONDS': str(segment_age)
+        })
+    module = load_app_module('log-collector.py')
+    log_dir = os.path.join(work_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    
+    for source in SOURCES:
+        with open(os.path.join(log_dir, source), 'w') as f:
+            for i in range(existing_lines):
+                f.write(json.dumps({'message': f"existing line {i}"}) + '\n')
+    
+    lock = threading.Lock()
+    latencies = []
+    collected = [0]
+    
+    class MeasuredCollector(module.LogCollector):
+        def add_lines(self, lines, source_file):
+            # The collector ships raw lines, so the write time is parsed here
+            now = time.time()
+            written = [json.loads(line).get('written_at') for line in lines if line.strip()]
+            with lock:
+                collected[0] += len(written)
+                latencies.extend(now - written_at for written_at in written if written_at)
+            super().add_lines(lines, source_file)
+    
+    if mode == 'legacy':
+        module.create_watcher = lambda directory, pattern, _: LegacyWatcher(directory, pattern)
+    
+    delivery_latencies = []
+    delivered = [0]
+    if transport:
+        processor_module = load_app_module('log-processor.py')
+        
+        class MeasuredProcessor(processor_module.LogProcessor):
+            def process_lines(self, lines, *args, **kwargs):
+                processed = super().process_lines(lines, *args, **kwargs)
+                now = time.time()
+                with lock:
+                    delivered[0] += len(processed)
+                    delivery_latencies.extend(now - entry['written_at'] for entry in processed if 'written_at' in entry)
+                return processed
+        
+        processor = MeasuredProcessor(os.path.join(work_dir, 'collected'), os.path.join(work_dir, 'processed'))
+        if processor.transport:
+            processor.transport.start()
+        threading.Thread(target=processor.process_logs, daemon=True).start()
+    
+    collector = MeasuredCollector(log_dir, os.path.join(work_dir, 'collected'))
+    collector.watch_mode = 'polling' if mode == 'polling' else 'inotify'
+    for target in (collector.collect_logs, collector.write_collected_logs):
+        threading.Thread(target=target, daemon=True).start()
+    
+    def wait_for(count, timeout):
+        deadline = time.time() + timeout
+        while collected[0] < count and time.time() < deadline:
+            time.sleep(0.01)
+        return collected[0] >= count
+    
+    expected = existing_lines * len(SOURCES)
+    wait_for(expected, 30)
+    
+    # Idle: nothing is written, every syscall and wakeup is overhead
+    before = process_counters()
+    time.sleep(idle_seconds)
+    idle = counters_delta(before, process_counters(), idle_seconds)
+    
+    # Active: lines are appended at a steady rate across the sources
+    files = [open(os.path.join(log_dir, source), 'a', buffering=1) for source in SOURCES]
+    before = process_counters()
+    started = time.time()
+    for i in range(lines):
+        files[i % len(files)].write(json.dumps({'message': f"line {i}", 'written_at': time.time()}) + '\n')
+        time.sleep(max(0, started + (i + 1) / rate - time.time()))
+    complete = wait_for(expected + lines, 30)
+    active_seconds = time.time() - started
+    active = counters_delta(before, process_counters(), active_seconds)
+    
+    if transport:
+        # File segments reach the processor once sealed and found by its glob
+        deadline = time.time() + segment_age + 30
+        while delivered[0] < expected + lines and time.time() < deadline:
+            time.sleep(0.01)
+        complete = complete and delivered[0] >= expected + lines
+    
+    transport_stats = None
+    if transport == 'socket':
+        # Batches spooled to files after a failed delivery would be measured as socket latencies
+        deadline = time.time() + 30
+        while collector.transport.counters['batches_acked'] < collector.transport.counters['batches_sent'] and time.time() < deadline:
+            time.sleep(0.01)
+        transport_stats = collector.transport.stats()
+        if transport_stats['disconnects'] or not transport_stats['batches_sent'] \
+                or transport_stats['batches_acked'] < transport_stats['batches_sent']:
+            logger.error(f"Batches were not all acknowledged by the processor: {transport_stats}")
+            complete = False
+    for f in files:
+        f.close()
+    
+    collector.running = False
+    return {
+        'success': complete,
+        'mode': collector.watcher.mode if collector.watcher else mode,
+        'idle': idle,
+        'active': dict(active, lines=lines, **latency_summary(latencies)),
+        'delivery': dict(latency_summary(delivery_latencies), transport=transport, delivered=delivered[0],
+                         transport_stats=transport_stats)
+        if transport else None,
+        'watcher': collector.watcher.stats() if collector.watcher else None
+    }
+
+def run_mode_subprocess(mode, args, work_dir):
+    """Run a mode in a fresh interpreter so process counters are not shared"""
+    command = [sys.executable, os.path.abspath(__file__), '--run-mode', mode, '--work-dir', work_dir,
+               '--idle-seconds', str(args.idle_seconds), '--lines', str(args.lines),
+               '--rate', str(args.rate), '--existing-lines', str(args.existing_lines),
+               '--segment-age', str(args.segment_age)] + (['--transport', args.transport] if args.transport else [])
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        logger.error(f"Mode {mode} failed:\n{completed.stderr[-2000:]}")
+        return {'success': False}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure latency, CPU and syscalls of the log collector's file watching")
+    parser.add_argument('--modes', default=','.join(MODES), help=f"Comma separated subset of {','.join(MODES)}")
+    parser.add_argument('--idle-seconds', type=float, default=10, help="Length of the idle phase")
+    parser.add_argument('--lines', type=int, default=2000, help="Lines appended during the active phase")
+    parser.add_argument('--rate', type=float, default=200, help="Lines per second during the active phase")
+    parser.add_argument('--existing-lines', type=int, default=1000, help="Lines per file present at startup")
+    parser.add_argument('--transport', choices=['file', 'socket'],
+                        help="Also run the processor and measure delivery latency through this transport")
+    parser.add_argument('--segment-age', type=float, default=1.0, help="Segment age limit with --transport file")
+    parser.add_argument('--output', help="Results file (benchmarks/results/collector-benchmark-<timestamp>.json by default)")
+    parser.add_argument('--run-mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    
+    # Child process: measure a single mode and print the results
+    if args.run_mode:
+        logging.getLogger().setLevel(logging.WARNING)
+        print(json.dumps(run_mode(args.run_mode, args.work_dir, args.idle_seconds, args.lines,
+                                  args.rate, args.existing_lines, args.transport, args.segment_age)))
+        return 0
+    
+    results = {
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'parameters': {key: getattr(args, key) for key in ('idle_seconds', 'lines', 'rate', 'existing_lines',
+                                                           'transport', 'segment_age')},
+        'modes': {}
+    }
+    
+    for mode in [mode.strip() for mode in args.modes.split(',') if mode.strip()]:
+        work_dir = tempfile.mkdtemp(prefix=f'collector-benchmark-{mode}-')
+        try:
+            result = run_mode_subprocess(mode, args, work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        results['modes'][mode] = result
+        
+        if result.get('success'):
+            idle, active = result['idle'], result['active']
+            logger.info(f"{mode:<8} idle: {idle['cpu_seconds_per_second'] * 1000:>7.2f} ms CPU/s, "
+                        f"{idle['read_syscalls_per_second']:>8.1f} reads/s, "
+                        f"{idle['voluntary_switches_per_second']:>7.1f} wakeups/s | "
+                        f"active: latency p50 {active['latency_ms_p50']} ms, p95 {active['latency_ms_p95']} ms, "
+                        f"{active['read_syscalls_per_second']:>8.1f} reads/s")
+            if result['delivery']:
+                delivery = result['delivery']
+                logger.info(f"{mode:<8} delivery through {delivery['transport']}: latency p50 {delivery['latency_ms_p50']} ms, "
+                            f"p95 {delivery['latency_ms_p95']} ms, max {delivery['latency_ms_max']} ms")
+    
+    output = args.output or os.path.join(
+        BENCHMARK_DIR, 'results', f"collector-benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results written to {output}")
+    
+    failed = [mode for mode, result in results['modes'].items() if not result.get('success')]
+    if failed:
+        logger.error(f"Failed modes: {', '.join(failed)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
\ No newline at end of file
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+import argparse
+import importlib.util
+import json
+import os
+import gzip
+import glob
+import re
+import sys
+import time
+import random
+import logging
+import resource
+import tempfile
+import shutil
+from datetime import datetime
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger('processor-benchmark')
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), 'app')
+
+sys.path.insert(0, APP_DIR)
+from log_record import encode_batch, is_header, parse_header, parse_line
+
+# Lines per batch, as the collector flushes them by default
+BATCH_LINES = 1000
+
+# legacy is the processor's original classification, kept here as the baseline
+MODES = ['compiled', 'legacy']
+
+APPLICATION_MESSAGES = [
+    "web-api - INFO - Fetching {n} users",
+    "web-api - INFO - Fetching user with ID: {n}",
+    "web-api - WARNING - User not found: {n}",
+    "web-api - INFO - Processing simulated request {n}",
+    "web-api - INFO - Background task: Cache cleanup performed",
+    "web-api - WARNING - Background task: High memory usage detected",
+    "web-api - INFO - User created successfully: {{'id': {n}, 'name': 'user{n}'}}",
+    "background-worker - DEBUG - Worker thread worker-{n} started",
+    "background-worker - ERROR - Job job_{n} failed"
+]
+
+ERROR_MESSAGES = [
+    "ERROR - Failed to fetch users: Database connection timeout",
+    "ERROR - User creation failed: Missing required fields",
+    "ERROR - User creation failed: validation error on email {n}",
+    "ERROR - Simulated error in request {n}",
+    "ERROR - Background task error: connection reset by peer"
+]
+
+def load_app_module(filename):
+    """Import one of the app scripts (log-processor.py) as a module"""
+    sys.path.insert(0, APP_DIR)
+    spec = importlib.util.spec_from_file_location(filename[:-3].replace('-', '_'), os.path.join(APP_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    
+    # Registered so pool workers can find its functions
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def legacy_processor_class(processor_module):
+    """LogProcessor with the original per-line rule scan, level searches, substring chains and timestamps"""
+    
+    class LegacyProcessor(processor_module.LogProcessor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.processing_rules = {
+                'access.log': self.process_access_logs,
+                'error.log': self.process_error_logs,
+                'application.log': self.process_application_logs,
+                'database-queries.log': self.process_database_logs,
+                'job-execution.log': self.process_job_logs
+            }
+            self.classify_error_type = self.legacy_error_type
+            self.classify_component = self.legacy_component
+        
+        def extract_log_level(self, message):
+            level_patterns = {
+                'ERROR': r'\b(error|exception|failed|failure)\b',
+                'WARNING': r'\b(warn|warning|deprecated)\b',
+                'DEBUG': r'\b(debug|trace)\b',
+                'INFO': r'\b(info|started|completed|success)\b'
+            }
+            
+            message_lower = message.lower()
+            
+            for level, pattern in level_patterns.items():
+                if re.search(pattern, message_lower):
+                    return level
+            
+            return 'INFO'
+        
+        def legacy_error_type(self, message):
+            if 'timeout' in message.lower():
+                return 'timeout'
+            elif 'connection' in message.lower():
+                return 'connection'
+            elif 'validation' in message.lower():
+                return 'validation'
+            return 'unknown'
+        
+        def legacy_component(self, message):
+            if 'web-api' in message:
+                return 'web-api'
+            elif 'background' in message:
+                return 'background-task'
+            return 'unknown'
+        
+        def process_lines(self, lines, source, origin, first_line=1, batch=None):
+            processed_logs = []
+            for line in lines:
+                if is_header(line):
+                    batch = parse_header(line)
+                elif line.strip():
+                    log_entry = dict(parse_line(line.strip()), **batch)
+                    
+                    # The original scanned the rules for every line
+                    processor = None
+                    for log_type, proc_func in self.processing_rules.items():
+                        if log_type in source:
+                            processor = proc_func
+                            break
+                    processed_logs.append(processor(log_entry))
+            return processed_logs
+    
+    return LegacyProcessor
+
+def generate_lines(source, count, seed):
+    """Collected lines of a source as the processor reads them: batch headers and raw log lines"""
+    rng = random.Random(seed)
+    raw_lines = []
+    for n in range(count):
+        asctime = datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
+        if source == 'access.log':
+            entry = {'timestamp': datetime.now().isoformat(), 'method': rng.choice(['GET', 'POST']),
+                     'path': rng.choice(['/api/users', f'/api/users/{n % 100}', '/health']),
+                     'query_string': '', 'remote_addr': '10.0.0.1', 'user_agent': 'curl/8.0', 'content_length': 0,
+                     'status_code': rng.choice([200, 200, 201, 404, 500]), 'processing_time_ms': rng.randint(10, 500)}
+        elif source == 'database-queries.log':
+            entry = {'query_id': f'q_{n}', 'query_type': rng.choice(['SELECT', 'INSERT', 'UPDATE']),
+                     'execution_time_ms': rng.randint(1, 6000), 'timestamp': datetime.now().isoformat()}
+        elif source == 'job-execution.log':
+            entry = {'job_id': f'job_{n}', 'type': 'data_processing', 'priority': 'normal',
+                     'status': rng.choice(['queued', 'started', 'completed', 'failed']), 'timestamp': datetime.now().isoformat()}
+        else:
+            templates = ERROR_MESSAGES if source == 'error.log' else APPLICATION_MESSAGES
+            raw_lines.append(f"{asctime} - {rng.choice(templates).format(n=n)}".encode('utf-8'))
+            continue
+        raw_lines.append(f"{asctime} - {json.dumps(entry)}".encode('utf-8'))
+    
+    lines = []
+    for start in range(0, count, BATCH_LINES):
+        lines.extend(encode_batch(source, raw_lines[start:start + BATCH_LINES]).decode('utf-8').split('\n')[:-1])
+    return lines
+
+def measure(processor, source, lines, repeats):
+    """Best lines/s of processing the lines of a source, and the result of the last run"""
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        processed = processor.process_lines(lines, source, source)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(len(lines) / best), processed
+
+def comparable(processed_logs):
+    return [{key: value for key, value in entry.items() if key != 'processed_at'} for entry in processed_logs]
+
+def write_segments(directory, lines, segment_lines):
+    """Gzip segments of the generated lines, named like the collector's, cut between batches"""
+    sequence = 0
+    step = max(1, segment_lines // BATCH_LINES) * (BATCH_LINES + 1)
+    for source, source_lines in lines.items():
+        stem = source[:-len('.log')]
+        for start in range(0, len(source_lines), step):
+            sequence += 1
+            path = os.path.join(directory, f"collected_{stem}.20261019T000000.{sequence:06d}.log.gz")
+            with gzip.open(path, 'wt', encoding='utf-8', compresslevel=1) as f:
+                f.write(''.join(line + '\n' for line in source_lines[start:start + step]))
+
+def measure_workers(processor_module, segments_dir, work_dir, workers):
+    """lines/s of processing every segment with a number of worker processes, the share of the
+    CPU time spent reading and writing in this process (which bounds the speedup) and the outputs"""
+    input_dir = os.path.join(work_dir, f'input-{workers}')
+    output_dir = os.path.join(work_dir, f'output-{workers}')
+    shutil.copytree(segments_dir, input_dir)
+    
+    processor = processor_module.LogProcessor(input_dir, output_dir, workers=workers)
+    files = sorted(glob.glob(os.path.join(input_dir, 'collected_*')))
+    try:
+        if workers > 1:
+            processor.start_pool()
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        started = time.perf_counter()
+        if workers > 1:
+            processor.process_files_parallel(files)
+        else:
+            for file_path in files:
+                processor.process_log_file(file_path)
+        elapsed = time.perf_counter() - started
+        after = resource.getrusage(resource.RUSAGE_SELF)
+    finally:
+        if processor.pool:
+            processor.pool.shutdown()
+    
+    # Workers are counted once they have exited
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    parent_cpu = after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime
+    workers_cpu = (children_after.ru_utime + children_after.ru_stime
+                   - children_before.ru_utime - children_before.ru_stime)
+    
+    outputs = {}
+    for path in sorted(glob.glob(os.path.join(output_dir, 'processed_*'))):
+        with open(path, 'r') as f:
+            outputs[os.path.basename(path)] = comparable(json.loads(line) for line in f)
+    return round(processor.processed_count / elapsed), round(parent_cpu / (parent_cpu + workers_cpu), 3), outputs
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the log processor's classification throughput in lines per second")
+    parser.add_argument('--modes', default=','.join(MODES), help=f"Comma separated subset of {','.join(MODES)}")
+    parser.add_argument('--lines', type=int, default=50000, help="Lines generated per source")
+    parser.add_argument('--repeats', type=int, default=5, help="Runs per source and mode, the fastest is reported")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', default='1,2,4',
+                        help="Comma separated worker counts to process segment files with (empty to skip)")
+    parser.add_argument('--segment-lines', type=int, default=10000, help="Lines per segment file with --workers")
+    parser.add_argument('--output', help="Results file (benchmarks/results/processor-benchmark-<timestamp>.json by default)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    processor_module = load_app_module('log-processor.py')
+    logging.getLogger('log-processor').setLevel(logging.WARNING)
+    
+    sources = [source for source, _ in processor_module.Rules().routes]
+    lines = {source: generate_lines(source, args.lines, args.seed) for source in sources}
+    
+    results = {
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'parameters': {'lines': args.lines, 'repeats': args.repeats, 'seed': args.seed,
+                       'workers': args.workers, 'segment_lines': args.segment_lines},
+        'cpu_count': os.cpu_count(),
+        'modes': {},
+        'workers': {}
+    }
+    
+    output_dir = tempfile.mkdtemp(prefix='processor-benchmark-')
+    outputs = {}
+    try:
+        for mode in [mode.strip() for mode in args.modes.split(',') if mode.strip()]:
+            processor_class = legacy_processor_class(processor_module) if mode == 'legacy' else processor_module.LogProcessor
+            processor = processor_class(output_dir, output_dir)
+            
+            result = {'sources': {}}
+            outputs[mode] = {}
+            for source in sources:
+                rate, processed = measure(processor, source, lines[source], args.repeats)
+                result['sources'][source] = {'lines_per_second': rate}
+                outputs[mode][source] = comparable(processed)
+            
+            total_lines = args.lines * len(sources)
+            total_seconds = sum(args.lines / source['lines_per_second'] for source in result['sources'].values())
+            result['lines_per_second'] = round(total_lines / total_seconds)
+            results['modes'][mode] = result
+            
+            logger.info(f"{mode:<9} {result['lines_per_second']:>8} lines/s | " +
+                        ', '.join(f"{source} {value['lines_per_second']}" for source, value in result['sources'].items()))
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    
+    # Both classifications have to produce the same entries
+    if len(outputs) > 1:
+        reference = next(iter(outputs.values()))
+        results['identical_output'] = all(output == reference for output in outputs.values())
+        if not results['identical_output']:
+            logger.error("Processed entries differ between modes")
+    
+    # Whole segment files, one to several worker processes
+    worker_counts = [int(count) for count in args.workers.split(',') if count.strip()]
+    if worker_counts:
+        work_dir = tempfile.mkdtemp(prefix='processor-benchmark-workers-')
+        try:
+            segments_dir = os.path.join(work_dir, 'segments')
+            os.makedirs(segments_dir)
+            write_segments(segments_dir, lines, args.segment_lines)
+            
+            reference = None
+            for workers in worker_counts:
+                rate, parent_share, outputs = measure_workers(processor_module, segments_dir, work_dir, workers)
+                reference = reference or outputs
+                baseline = results['workers'].get(str(worker_counts[0]), {}).get('lines_per_second', rate)
+                results['workers'][str(workers)] = {
+                    'lines_per_second': rate,
+                    'speedup': round(rate / baseline, 2),
+                    'parent_cpu_share': parent_share,
+                    'ordered_output': outputs == reference
+                }
+                logger.info(f"{workers:>2} workers {rate:>8} lines/s, speedup {results['workers'][str(workers)]['speedup']}x, "
+                            f"{parent_share:.0%} of the CPU time in the reading process"
+                            f"{'' if outputs == reference else ', OUTPUT DIFFERS'}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        if not all(result['ordered_output'] for result in results['workers'].values()):
+            logger.error("Pool output differs from the single process output")
+            results['identical_output'] = False
+    
+    output = args.output or os.path.join(
+        BENCHMARK_DIR, 'results', f"processor-benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results written to {output}")
+    
+    return 0 if results.get('identical_output', True) else 1
+
+if __name__ == '__main__':
+    exit(main())
\ No newline at end of file
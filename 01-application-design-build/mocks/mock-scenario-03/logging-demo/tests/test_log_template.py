@@ -0,0 +1,82 @@
+import os
+import sys
+import unittest
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app')
+sys.path.insert(0, APP_DIR)
+from log_template import TemplateMiner, TemplateCompactor, render
+
+def tree_templates(miner):
+    """Templates reachable from the miner's tree"""
+    templates = []
+    nodes = [miner.root]
+    while nodes:
+        node = nodes.pop()
+        for key, child in node.items():
+            if key is None:
+                templates.extend(child)
+            else:
+                nodes.append(child)
+    return templates
+
+class TemplateMinerTest(unittest.TestCase):
+    
+    def test_numeric_messages_share_one_template(self):
+        miner = TemplateMiner(max_templates=10)
+        for i in range(1000):
+            template, parameters = miner.match(f"GET /users/{i} 200 {i % 97}ms")
+            self.assertEqual(render(' '.join(template.tokens), parameters), f"GET /users/{i} 200 {i % 97}ms")
+        self.assertEqual(len(miner.templates), 1)
+        self.assertEqual(len(tree_templates(miner)), 1)
+    
+    def test_tree_stays_within_max_templates(self):
+        miner = TemplateMiner(max_templates=10)
+        for i in range(2000):
+            words = ' '.join(chr(ord('a') + (i >> shift) % 26) * 3 for shift in range(0, 15, 5))
+            miner.match(f"{words} /users/{i} 200 {i}ms")
+            miner.match(f"Processing simulated request {i}")
+            self.assertLessEqual(len(tree_templates(miner)), 10)
+        self.assertLessEqual(len(miner.templates), 10)
+        self.assertGreater(miner.evicted, 0)
+        self.assertEqual({template.id for template in tree_templates(miner)}, set(miner.templates))
+    
+    def test_generalized_template(self):
+        miner = TemplateMiner()
+        miner.match("Background task: Checking system health")
+        template, parameters = miner.match("Background task: Checking cache health")
+        self.assertEqual(' '.join(template.tokens), "Background task: Checking <*> health")
+        self.assertEqual(parameters, ['cache'])
+        self.assertEqual(len(tree_templates(miner)), 1)
+
+class TemplateCompactorTest(unittest.TestCase):
+    
+    def entry(self, second, message, level='INFO'):
+        return {'message': f"2026-10-19 05:00:{second:02d},000 - {message}", 'log_level': level,
+                'log_category': 'application', 'source_file': 'application.log'}
+    
+    def test_template_records_render_back(self):
+        compactor = TemplateCompactor('template')
+        entries = [self.entry(i, f"Processing simulated request {i}") for i in range(10)]
+        for log_entry, record in zip(entries, compactor.compact(entries)):
+            self.assertNotIn('message', record)
+            rendered = record['logged_at'] + ' - ' + render(' '.join(compactor.miner.templates[record['template_id']].tokens),
+                                                              record['parameters'])
+            self.assertEqual(rendered, log_entry['message'])
+    
+    def test_collapse_keeps_errors(self):
+        compactor = TemplateCompactor('collapse', window_seconds=60)
+        entries = [self.entry(i, f"Processing simulated request {i}") for i in range(5)]
+        entries += [self.entry(i, f"Simulated error in request {i}", 'ERROR') for i in range(3)]
+        records = compactor.compact(entries)
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[0]['count'], 5)
+        self.assertEqual(records[0]['last_logged_at'], '2026-10-19 05:00:04,000')
+    
+    def test_collapse_is_per_chunk(self):
+        compactor = TemplateCompactor('collapse', window_seconds=60)
+        first = compactor.compact([self.entry(i, f"Processing simulated request {i}") for i in range(3)])
+        second = compactor.compact([self.entry(i, f"Processing simulated request {i}") for i in range(3, 6)])
+        self.assertEqual([record['count'] for record in first + second], [3, 3])
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file